@@ -1,7 +1,7 @@
 from .client import OkxClient
 from .consts import *
 from .types import *
-from .utils import RateLimiter
+from .utils import MicroBatcher, iter_with_pagination
 import logging
 
 
@@ -9,23 +9,29 @@ class AccountAPI(OkxClient):
     logger = logging.getLogger("AccountAPI")
     logger.setLevel(logging.DEBUG)
 
-    def __init__(self, api_key, api_secret_key, passphrase, use_server_time=False, test=False, **kwargs):
+    def __init__(
+        self, api_key, api_secret_key, passphrase, use_server_time=False, test=False, batch_window=0.0, **kwargs
+    ):
+        """
+        :param batch_window: seconds to collect concurrent single instrument position and single currency balance
+            queries into one request, 0 to send each on its own
+        """
         super(AccountAPI, self).__init__(api_key, api_secret_key, passphrase, use_server_time, test, **kwargs)
-
-    ACCOUNT_CONFIG_SEMAPHORE = RateLimiter(5, 2)
+        self.batch_window = batch_window
+        if batch_window:
+            self._position_batcher = MicroBatcher(self._batch_positions("instId"), 10, batch_window)
+            self._posId_batcher = MicroBatcher(self._batch_positions("posId"), 20, batch_window)
+            self._balance_batcher = MicroBatcher(self._batch_balances, 20, batch_window)
 
     async def get_account_config(self) -> AccountConfigResponse:
         """查看当前账户的配置信息
 
         GET /api/v5/account/config 限速：5次/2s
         """
-        async with self.ACCOUNT_CONFIG_SEMAPHORE:
-            res = await self._request_without_params(GET, ACCOUNT_CONFIG)
+        res = await self._request_without_params(GET, ACCOUNT_CONFIG)
         assert res["code"] == "0", f"{ACCOUNT_CONFIG}, msg={res['msg']}"
         return res["data"][0]
 
-    POSITION_MODE_SEMAPHORE = RateLimiter(5, 2)
-
     async def set_position_mode(self, posMode: Literal["long_short_mode", "net_mode"]) -> PosModeResponse:
         """设置持仓模式
 
@@ -34,13 +40,10 @@ class AccountAPI(OkxClient):
         :param posMode: 持仓方式 long_short_mode：双向持仓 net_mode：单向持仓
         """
         params = dict(posMode=posMode)
-        async with self.POSITION_MODE_SEMAPHORE:
-            res = await self._request_with_params(POST, POSITION_MODE, params)
+        res = await self._request_with_params(POST, POSITION_MODE, params)
         assert res["code"] == "0", f"{POSITION_MODE}, msg={res['msg']}"
         return res["data"][0]
 
-    ACCOUNT_POSITION_SEMAPHORE = RateLimiter(10, 2)
-
     async def get_positions(
         self, instType: Literal["MARGIN", "SWAP", "FUTURES", "OPTION"] = None, instId=None, posId=None
     ) -> List[Dict]:
@@ -64,8 +67,7 @@ class AccountAPI(OkxClient):
                 assert len(posId) <= 20
                 posId = ",".join(posId)
             params = dict(posId=posId)
-        async with self.ACCOUNT_POSITION_SEMAPHORE:
-            res = await self._request_with_params(GET, ACCOUNT_POSITION, params)
+        res = await self._request_with_params(GET, ACCOUNT_POSITION, params)
         assert res["code"] == "0", f"{ACCOUNT_POSITION}, msg={res['msg']}"
         return res["data"]
 
@@ -77,42 +79,56 @@ class AccountAPI(OkxClient):
         :param instId: 产品ID
         :param posId: 持仓ID
         """
+        if self.batch_window:
+            return await (self._position_batcher.get(instId) if instId else self._posId_batcher.get(posId))
         params = dict(instId=instId) if instId else dict(posId=posId)
-        async with self.ACCOUNT_POSITION_SEMAPHORE:
-            res = await self._request_with_params(GET, ACCOUNT_POSITION, params)
+        res = await self._request_with_params(GET, ACCOUNT_POSITION, params)
         assert res["code"] == "0", f"{ACCOUNT_POSITION}, msg={res['msg']}"
         return res["data"]
 
-    ACCOUNT_BALANCE_SEMAPHORE = RateLimiter(10, 2)
+    def _batch_positions(self, field):
+        async def fetch(keys: List[str]) -> Dict[str, List[Dict]]:
+            # A list of its own for every key, also without positions
+            positions = {key: [] for key in keys}
+            for position in await self.get_positions(**{field: keys}):
+                positions.setdefault(position[field], []).append(position)
+            return positions
+
+        return fetch
+
+    async def _batch_balances(self, currencies: List[str]) -> Dict[str, Dict]:
+        balance = await self.get_coin_balance(currencies, batch=False)
+        details = {detail["ccy"]: detail for detail in balance["details"]}
+        # Each currency gets the account summary with its own details only
+        return {ccy: dict(balance, details=[details[ccy]] if ccy in details else []) for ccy in currencies}
 
     async def get_account_balance(self) -> Dict:
         """获取账户中所有资产余额
 
         GET /api/v5/account/balance 限速： 10次/2s
         """
-        async with self.ACCOUNT_BALANCE_SEMAPHORE:
-            res = await self._request_without_params(GET, ACCOUNT_BALANCE)
+        res = await self._request_without_params(GET, ACCOUNT_BALANCE)
         assert res["code"] == "0", f"{ACCOUNT_BALANCE}, msg={res['msg']}"
         return res["data"][0]
 
-    async def get_coin_balance(self, ccy) -> Dict:
+    async def get_coin_balance(self, ccy, batch=True) -> Dict:
         """获取账户中单币种余额
 
         GET /api/v5/account/balance?ccy=BTC,ETH
 
         :param ccy: 币种，如 BTC，支持多币种查询（不超过20个），币种之间半角逗号分隔
+        :param batch: 设置 batch_window 时，与同时查询的单币种合并为一次请求
         """
+        if batch and self.batch_window and type(ccy) is str and "," not in ccy:
+            return await self._balance_batcher.get(ccy)
         if not type(ccy) is str:
             assert len(ccy) <= 20
             ccy = ",".join(ccy)
         params = dict(ccy=ccy)
-        async with self.ACCOUNT_BALANCE_SEMAPHORE:
-            res = await self._request_with_params(GET, ACCOUNT_BALANCE, params)
+        res = await self._request_with_params(GET, ACCOUNT_BALANCE, params)
         assert res["code"] == "0", f"{ACCOUNT_BALANCE}, msg={res['msg']}"
         return res["data"][0]
 
-    TRADE_FEE_SEMAPHORE = RateLimiter(5, 2)
-
     async def get_trade_fee(self, instType, instId="", uly="", category="") -> Dict:
         """获取当前账户交易手续费费率
 
@@ -125,13 +141,10 @@ class AccountAPI(OkxClient):
         """
         params = dict(instId=instId) if instId else dict(uly=uly) if uly else dict(category=category)
         params["instType"] = instType
-        async with self.TRADE_FEE_SEMAPHORE:
-            res = await self._request_with_params(GET, TRADE_FEE, params)
+        res = await self._request_with_params(GET, TRADE_FEE, params)
         assert res["code"] == "0", f"{TRADE_FEE}, msg={res['msg']}"
         return res["data"][0]
 
-    GET_LEVERAGE_SEMAPHORE = RateLimiter(20, 2)
-
     async def get_leverage(self, instId, mgnMode) -> Dict:
         """获取杠杆倍数
 
@@ -141,13 +154,10 @@ class AccountAPI(OkxClient):
         :param mgnMode: 保证金模式 isolated：逐仓 cross：全仓
         """
         params = dict(instId=instId, mgnMode=mgnMode)
-        async with self.GET_LEVERAGE_SEMAPHORE:
-            res = await self._request_with_params(GET, GET_LEVERAGE, params)
+        res = await self._request_with_params(GET, GET_LEVERAGE, params)
         assert res["code"] == "0", f"{GET_LEVERAGE}, msg={res['msg']}"
         return res["data"][0]
 
-    SET_LEVERAGE_SEMAPHORE = RateLimiter(20, 2)
-
     async def set_leverage(self, lever, mgnMode, instId="", ccy="", posSide="") -> Dict:
         """设置杠杆倍数
 
@@ -165,13 +175,10 @@ class AccountAPI(OkxClient):
             params = dict(lever=lever, mgnMode=mgnMode, ccy=ccy)
         if posSide:
             params["posSide"] = posSide
-        async with self.SET_LEVERAGE_SEMAPHORE:
-            res = await self._request_with_params(POST, SET_LEVERAGE, params)
+        res = await self._request_with_params(POST, SET_LEVERAGE, params)
         assert res["code"] == "0", f"{SET_LEVERAGE}, msg={res['msg']}"
         return res["data"][0]
 
-    MAX_SIZE_SEMAPHORE = RateLimiter(20, 2)
-
     async def get_max_size(self, instId, tdMode, ccy="", px="", leverage="") -> Dict:
         """获取最大可买卖/开仓数量
 
@@ -190,13 +197,10 @@ class AccountAPI(OkxClient):
             params["px"] = px
         if ccy:
             params["leverage"] = leverage
-        async with self.MAX_SIZE_SEMAPHORE:
-            res = await self._request_with_params(GET, MAX_SIZE, params)
+        res = await self._request_with_params(GET, MAX_SIZE, params)
         assert res["code"] == "0", f"{MAX_SIZE}, msg={res['msg']}"
         return res["data"][0]
 
-    GET_LEDGER_SEMAPHORE = RateLimiter(5, 1)
-
     async def get_ledger(
         self, instType, ccy, mgnMode="", ctType="", type="", subType="", after="", before="", limit=""
     ) -> List[Dict]:
@@ -226,12 +230,41 @@ class AccountAPI(OkxClient):
             before=before,
             limit=limit,
         )
-        async with self.GET_LEDGER_SEMAPHORE:
-            res = await self._request_with_params(GET, GET_LEDGER, params)
+        res = await self._request_with_params(GET, GET_LEDGER, params)
         assert res["code"] == "0", f"{GET_LEDGER}, msg={res['msg']}"
         return res["data"]
 
-    ARCHIVE_LEDGER_SEMAPHORE = RateLimiter(5, 2)
+    def iter_ledger(self, instType, ccy, mgnMode="", ctType="", type="", subType="", after="", prefetch=2, rows=False):
+        """逐页查询账单流水，后续页面在后台预取
+
+        Usage:
+            async for page in api.iter_ledger("SWAP", "USDT"):
+                ...
+
+        :param instType: 产品类型 SPOT：币币 MARGIN：币币杠杆 SWAP：永续合约 FUTURES：交割合约 OPTION：期权
+        :param ccy: 币种
+        :param mgnMode: 仓位类型 isolated：逐仓 cross：全仓
+        :param ctType: linear： 正向合约 inverse： 反向合约
+        :param type: 账单类型
+        :param subType: 账单子类型
+        :param after: 请求此id之前
+        :param prefetch: 预取页数
+        :param rows: 逐条返回
+        """
+        return iter_with_pagination(
+            self.get_ledger,
+            tag="billId",
+            page_size=100,
+            prefetch=prefetch,
+            rows=rows,
+            instType=instType,
+            ccy=ccy,
+            mgnMode=mgnMode,
+            ctType=ctType,
+            type=type,
+            subType=subType,
+            after=after,
+        )
 
     async def get_archive_ledger(
         self, instType, ccy, mgnMode="", ctType="", type="", subType="", after="", before="", limit=""
@@ -262,12 +295,43 @@ class AccountAPI(OkxClient):
             before=before,
             limit=limit,
         )
-        async with self.ARCHIVE_LEDGER_SEMAPHORE:
-            res = await self._request_with_params(GET, GET_ARCHIVE_LEDGER, params)
+        res = await self._request_with_params(GET, GET_ARCHIVE_LEDGER, params)
         assert res["code"] == "0", f"{GET_ARCHIVE_LEDGER}, msg={res['msg']}"
         return res["data"]
 
-    MARGIN_BALANCE_SEMAPHORE = RateLimiter(20, 2)
+    def iter_archive_ledger(
+        self, instType, ccy, mgnMode="", ctType="", type="", subType="", after="", prefetch=2, rows=False
+    ):
+        """逐页查询账单流水（近三月），后续页面在后台预取
+
+        Usage:
+            async for page in api.iter_archive_ledger("SWAP", "USDT"):
+                ...
+
+        :param instType: 产品类型 SPOT：币币 MARGIN：币币杠杆 SWAP：永续合约 FUTURES：交割合约 OPTION：期权
+        :param ccy: 币种
+        :param mgnMode: 仓位类型 isolated：逐仓 cross：全仓
+        :param ctType: linear： 正向合约 inverse： 反向合约
+        :param type: 账单类型
+        :param subType: 账单子类型
+        :param after: 请求此id之前
+        :param prefetch: 预取页数
+        :param rows: 逐条返回
+        """
+        return iter_with_pagination(
+            self.get_archive_ledger,
+            tag="billId",
+            page_size=100,
+            prefetch=prefetch,
+            rows=rows,
+            instType=instType,
+            ccy=ccy,
+            mgnMode=mgnMode,
+            ctType=ctType,
+            type=type,
+            subType=subType,
+            after=after,
+        )
 
     async def adjust_margin(self, instId, posSide, type, amt):
         """增加或者减少逐仓保证金
@@ -281,8 +345,7 @@ class AccountAPI(OkxClient):
         :rtype: bool
         """
         params = dict(instId=instId, posSide=posSide, type=type, amt=amt)
-        async with self.MARGIN_BALANCE_SEMAPHORE:
-            res = await self._request_with_params(POST, MARGIN_BALANCE, params)
+        res = await self._request_with_params(POST, MARGIN_BALANCE, params)
         if res["code"] == "0":
             return True
         else:
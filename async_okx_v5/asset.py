@@ -1,60 +1,113 @@
+from . import models
 from .client import OkxClient
 from .consts import *
+from .exceptions import OkexAmbiguousException, OkexAPIException, OkexException
 from .types import *
-from .utils import RateLimiter
+from .utils import MicroBatcher, client_order_id
 import logging
+from typing import Optional, Union
 
 
 class AssetAPI(OkxClient):
     logger = logging.getLogger("AssetAPI")
     logger.setLevel(logging.DEBUG)
+    # Submissions of a transfer after ambiguous failures
+    TRANSFER_ATTEMPTS = 2
 
-    def __init__(self, api_key, api_secret_key, passphrase, use_server_time=False, test=False, **kwargs):
+    def __init__(
+        self, api_key, api_secret_key, passphrase, use_server_time=False, test=False, batch_window=0.0, **kwargs
+    ):
+        """
+        :param batch_window: seconds to collect concurrent single currency balance queries into one request,
+            0 to send each on its own
+        """
         super(AssetAPI, self).__init__(api_key, api_secret_key, passphrase, use_server_time, test, **kwargs)
+        self.batch_window = batch_window
+        if batch_window:
+            self._balance_batcher = MicroBatcher(self._batch_balances, 20, batch_window)
 
-    ASSET_BALANCE_SEMAPHORE = RateLimiter(6, 1)
+    async def _batch_balances(
+        self, currencies: List[str]
+    ) -> Dict[str, Union[AssetBalanceResponse, models.AssetBalance]]:
+        params = dict(ccy=",".join(currencies))
+        res = await self._request_with_params(GET, ASSET_BALANCE, params)
+        assert res["code"] == "0", f"{ASSET_BALANCE}, msg={res['msg']}"
+        return {d["ccy"]: balance for d, balance in zip(res["data"], self._parse(models.AssetBalance, res["data"]))}
 
-    async def get_balance(self, ccy: Sequence[str]) -> AssetBalanceResponse:
-        """获取资金账户余额信息
+    async def get_balance(
+        self, ccy: Sequence[str], batch=True
+    ) -> Optional[Union[AssetBalanceResponse, models.AssetBalance]]:
+        """获取资金账户余额信息，没有余额时返回 None
 
         GET /api/v5/asset/balances 限速： 6次/s
 
         :param ccy: 币种，支持多币种查询（不超过20个），币种之间半角逗号分隔
+        :param batch: 设置 batch_window 时，与同时查询的单币种合并为一次请求
         """
+        if batch and self.batch_window and type(ccy) is str and "," not in ccy:
+            return await self._balance_batcher.get(ccy)
         if not type(ccy) is str:
             assert len(ccy) <= 20
             ccy = ",".join(ccy)
         params = dict(ccy=ccy)
-        async with self.ASSET_BALANCE_SEMAPHORE:
-            res = await self._request_with_params(GET, ASSET_BALANCE, params)
+        res = await self._request_with_params(GET, ASSET_BALANCE, params)
         assert res["code"] == "0", f"{ASSET_BALANCE}, msg={res['msg']}"
-        return res["data"][0]
+        balances = self._parse(models.AssetBalance, res["data"])
+        return balances[0] if balances else None
 
-    ASSET_TRANSFER_SEMAPHORE = dict()
+    async def _lookup_transfer(self, clientId) -> Optional[AssetTransferResponse]:
+        """Transfer by client ID, None if the exchange does not have it
 
-    async def transfer(self, ccy, amt, account_from, account_to, instId="", toInstId="") -> AssetTransferResponse:
+        :raise OkexAPIException: the lookup failed, so whether the exchange has the transfer is unknown
+        """
+        res = await self._request_with_params(GET, ASSET_TRANSFER_STATE, dict(clientId=clientId))
+        if res["code"] != "0":
+            raise OkexAPIException(200, res)
+        if not res["data"]:
+            return None
+        info = res["data"][0]
+        return {key: info.get(key, "") for key in ("transId", "ccy", "from", "amt", "to", "clientId")}
+
+    async def transfer(
+        self, ccy, amt, account_from, account_to, instId="", toInstId="", client_id=""
+    ) -> AssetTransferResponse:
         """资金划转
 
         POST /api/v5/asset/transfer
 
         限速： 1 次/s 限速规则：UserID + Currency
 
+        划转结果不确定时按 clientId 查询划转状态，只有交易所没有收到的划转才会重新提交。
+
         :param ccy: 币种
         :param amt: 划转数量
         :param account_from: 转出账户 6：资金账户 18：统一账户
         :param account_to: 转入账户 6：资金账户 18：统一账户
         :param instId:
         :param toInstId:
+        :param client_id: 客户自定义ID，默认自动生成
         """
         params = {"ccy": ccy, "amt": amt, "from": account_from, "to": account_to}
         if instId:
             params["instId"] = instId
         if toInstId:
             params["toInstId"] = toInstId
-        if ccy not in AssetAPI.ASSET_TRANSFER_SEMAPHORE.keys():
-            AssetAPI.ASSET_TRANSFER_SEMAPHORE[ccy] = RateLimiter(1, 1)
-        async with AssetAPI.ASSET_TRANSFER_SEMAPHORE[ccy]:
-            res = await self._request_with_params(POST, ASSET_TRANSFER, params)
+        params["clientId"] = client_id or client_order_id()
+        for attempt in range(self.TRANSFER_ATTEMPTS):
+            try:
+                res = await self._request_with_params(POST, ASSET_TRANSFER, params)
+                break
+            except OkexAmbiguousException as exc:
+                self.logger.debug(f"Checking transfer {params['clientId']} after {exc}")
+                try:
+                    info = await self._lookup_transfer(params["clientId"])
+                except OkexException:
+                    # State of the transfer stays unknown
+                    raise exc
+                if info:
+                    return info
+                if attempt == self.TRANSFER_ATTEMPTS - 1:
+                    raise
         if res["code"] == "0":
             return res["data"][0]
         else:
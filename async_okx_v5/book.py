@@ -0,0 +1,335 @@
+import asyncio
+import functools
+import logging
+import zlib
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+from .channel import BookChannelName
+from .exceptions import OkexBookException
+from .multiplex import Subscriber, WebsocketManager
+
+# Levels per side covered by the checksum
+CHECKSUM_LEVELS = 25
+
+Level = Tuple[float, float]
+
+
+def checksum(bids: Sequence[Sequence[str]], asks: Sequence[Sequence[str]]) -> int:
+    """Signed CRC32 of the best 25 levels of each side, as in the `checksum` of OKX order books
+
+    Levels are joined best first as `bidPx:bidSz:askPx:askSz:...`, with the remaining levels of the deeper side
+    at the end. Prices and sizes are the strings received, not parsed numbers.
+    """
+    bids = bids[:CHECKSUM_LEVELS]
+    asks = asks[:CHECKSUM_LEVELS]
+    parts = []
+    for i in range(max(len(bids), len(asks))):
+        if i < len(bids):
+            parts.append(bids[i][0])
+            parts.append(bids[i][1])
+        if i < len(asks):
+            parts.append(asks[i][0])
+            parts.append(asks[i][1])
+    crc = zlib.crc32(":".join(parts).encode())
+    return crc - (1 << 32) if crc >= 1 << 31 else crc
+
+
+class BookSide:
+    """Price levels of one side in parallel arrays sorted best first
+
+    Keys are prices negated for bids, so both sides sort ascending and the best level is always at index 0.
+    Levels are found by binary search, and an update shifts at most a few hundred contiguous items.
+    """
+
+    __slots__ = ("sign", "keys", "sizes", "levels")
+
+    def __init__(self, sign: int):
+        """
+        :param sign: 1 for asks, -1 for bids
+        """
+        self.sign = sign
+        self.keys: List[float] = []
+        self.sizes: List[float] = []
+        # Levels as received, [px, sz, 0, numOrders]
+        self.levels: List[List[str]] = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def load(self, levels: List[List[str]]):
+        sign = self.sign
+        keys = [sign * float(level[0]) for level in levels]
+        if any(keys[i] >= keys[i + 1] for i in range(len(keys) - 1)):
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            keys = [keys[i] for i in order]
+            levels = [levels[i] for i in order]
+        self.keys = keys
+        self.sizes = [float(level[1]) for level in levels]
+        self.levels = list(levels)
+
+    def update(self, level: List[str]):
+        """Set the size of a level, removing it when the size is 0"""
+        key = self.sign * float(level[0])
+        size = float(level[1])
+        keys = self.keys
+        i = bisect_left(keys, key)
+        found = i < len(keys) and keys[i] == key
+        if size == 0:
+            if found:
+                del keys[i]
+                del self.sizes[i]
+                del self.levels[i]
+        elif found:
+            self.sizes[i] = size
+            self.levels[i] = level
+        else:
+            keys.insert(i, key)
+            self.sizes.insert(i, size)
+            self.levels.insert(i, level)
+
+    def best(self) -> Optional[Level]:
+        return (self.sign * self.keys[0], self.sizes[0]) if self.keys else None
+
+    def top(self, n: int) -> List[Level]:
+        sign = self.sign
+        return [(sign * key, size) for key, size in zip(self.keys[:n], self.sizes[:n])]
+
+
+class OrderBook:
+    """Local order book of one instrument, rebuilt from a snapshot and kept current by incremental updates
+
+    Every update must continue the sequence of the previous one (`prevSeqId` equal to the last `seqId`) and
+    match the `checksum` sent with it, otherwise the book is out of sync until the next snapshot.
+    Snapshot only channels such as books5 and bbo-tbt replace the whole book on every push.
+    """
+
+    __slots__ = ("instId", "validate", "bids", "asks", "seqId", "ts", "synced")
+
+    def __init__(self, instId: str, validate=True):
+        """
+        :param instId: 产品ID
+        :param validate: verify the checksum of every push
+        """
+        self.instId = instId
+        self.validate = validate
+        self.bids = BookSide(-1)
+        self.asks = BookSide(1)
+        self.seqId: Optional[int] = None
+        self.ts: Optional[int] = None
+        self.synced = False
+
+    def __repr__(self):
+        return f"OrderBook({self.instId}, bid={self.best_bid}, ask={self.best_ask})"
+
+    def reset(self):
+        """Discard the levels until the next snapshot"""
+        self.bids = BookSide(-1)
+        self.asks = BookSide(1)
+        self.seqId = None
+        self.synced = False
+
+    def apply(self, data: dict, action="snapshot"):
+        """Apply a pushed book
+
+        :param data: an item of `data` of a book channel
+        :param action: snapshot：全量 update：增量
+        :raise OkexBookException: a gap in the sequence or a checksum mismatch, the book waits for a snapshot
+        """
+        if action == "update":
+            if not self.synced:
+                raise OkexBookException(f"{self.instId} update before snapshot", "gap")
+            prev = data.get("prevSeqId")
+            if prev is not None and self.seqId is not None and int(prev) != self.seqId:
+                message = f"{self.instId} expected prevSeqId {self.seqId}, got {prev}"
+                self.reset()
+                raise OkexBookException(message, "gap")
+            for level in data["bids"]:
+                self.bids.update(level)
+            for level in data["asks"]:
+                self.asks.update(level)
+        else:
+            self.bids.load(data["bids"])
+            self.asks.load(data["asks"])
+        seq = data.get("seqId")
+        self.seqId = int(seq) if seq is not None else None
+        self.ts = int(data["ts"])
+        self.synced = True
+        if self.validate and data.get("checksum") is not None:
+            expected = int(data["checksum"])
+            actual = self.checksum()
+            if actual != expected:
+                self.reset()
+                raise OkexBookException(f"{self.instId} checksum {actual} != {expected}", "checksum")
+
+    def checksum(self) -> int:
+        return checksum(self.bids.levels, self.asks.levels)
+
+    @property
+    def best_bid(self) -> Optional[Level]:
+        """(price, size) of the best bid"""
+        return self.bids.best()
+
+    @property
+    def best_ask(self) -> Optional[Level]:
+        """(price, size) of the best ask"""
+        return self.asks.best()
+
+    @property
+    def mid(self) -> Optional[float]:
+        if self.bids.keys and self.asks.keys:
+            return (self.asks.keys[0] - self.bids.keys[0]) / 2
+
+    @property
+    def spread(self) -> Optional[float]:
+        if self.bids.keys and self.asks.keys:
+            return self.asks.keys[0] + self.bids.keys[0]
+
+    def top(self, n=5) -> Tuple[List[Level], List[Level]]:
+        """Best `n` levels of each side as (bids, asks) of (price, size)"""
+        return self.bids.top(n), self.asks.top(n)
+
+
+class OrderBooks:
+    """Local order books of many instruments fed by one book channel on shared websocket connections
+
+    A book that misses an update, fails its checksum or receives updates without a snapshot is resubscribed in
+    the background to receive a fresh snapshot, and updates are skipped until it arrives. Books lost with a connection are rebuilt from the snapshots
+    sent after it reconnects.
+
+    Usage:
+        books = OrderBooks(WebsocketManager(WS_PUBLIC_URL), "books")
+        await books.subscribe(["BTC-USDT", "ETH-USDT"])
+        async for book in books:
+            print(book.instId, book.best_bid, book.best_ask)
+    """
+
+    logger = logging.getLogger("OrderBooks")
+    logger.setLevel(logging.DEBUG)
+
+    def __init__(self, manager: WebsocketManager, channel: BookChannelName = "books", validate=True):
+        """
+        :param manager: shared connections to the public websocket
+        :param channel: 深度频道
+        :param validate: verify the checksum of every push
+        """
+        self.manager = manager
+        self.channel = channel
+        self.validate = validate
+        self.books: Dict[str, OrderBook] = {}
+        self.subscriber: Optional[Subscriber] = None
+        self._resyncing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.updates = 0
+        self.skipped = 0
+        self.gaps = 0
+        self.checksum_errors = 0
+        self.resyncs = 0
+
+    def __repr__(self):
+        return f"OrderBooks({self.channel}, {len(self.books)} books)"
+
+    def __getitem__(self, instId: str) -> OrderBook:
+        return self.books[instId]
+
+    def _args(self, instIds: Sequence[str]) -> List[dict]:
+        return [{"channel": self.channel, "instId": instId} for instId in instIds]
+
+    async def subscribe(self, instIds: Sequence[str]):
+        for instId in instIds:
+            self.books.setdefault(instId, OrderBook(instId, self.validate))
+        if self.subscriber is None:
+            self.subscriber = await self.manager.subscribe(self._args(instIds))
+        else:
+            await self.subscriber.add(self._args(instIds))
+
+    async def unsubscribe(self, instIds: Sequence[str]):
+        await self.subscriber.remove(self._args(instIds))
+        for instId in instIds:
+            self.books.pop(instId, None)
+
+    def _resync(self, instId: str):
+        if instId in self._resyncing:
+            return
+        self._resyncing.add(instId)
+        self.resyncs += 1
+        task = asyncio.create_task(self.subscriber.resubscribe(self._args([instId])))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(functools.partial(self._resynced, instId))
+
+    def _resynced(self, instId: str, task: asyncio.Task):
+        if task.cancelled() or task.exception():
+            # No snapshot is coming, the next update asks again
+            self._resyncing.discard(instId)
+
+    def handle(self, message: dict) -> Optional[OrderBook]:
+        """Apply a message of the stream
+
+        :return: the book updated, None if nothing changed
+        """
+        event = message.get("event")
+        if event == "disconnect":
+            for arg in message["args"]:
+                book = self.books.get(arg["instId"])
+                if book:
+                    book.reset()
+            return
+        if event:
+            return
+        instId = message["arg"]["instId"]
+        book = self.books.get(instId)
+        if book is None:
+            return
+        action = message.get("action", "snapshot")
+        if action == "snapshot":
+            self._resyncing.discard(instId)
+        elif not book.synced:
+            # Waiting for a snapshot, requested unless one is already on its way
+            self.skipped += 1
+            self._resync(instId)
+            return
+        try:
+            for data in message["data"]:
+                book.apply(data, action)
+        except OkexBookException as exc:
+            if exc.reason == "checksum":
+                self.checksum_errors += 1
+            else:
+                self.gaps += 1
+            self.logger.warning(f"Resync {exc.message}")
+            self._resync(instId)
+            return
+        self.updates += 1
+        return book
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        """Books after each change, until the stream ends"""
+        async for message in self.subscriber:
+            book = self.handle(message)
+            if book:
+                yield book
+
+    async def run(self):
+        """Keep the books current without consuming changes"""
+        async for _ in self:
+            pass
+
+    def stats(self) -> dict:
+        return dict(
+            books=len(self.books),
+            synced=sum(book.synced for book in self.books.values()),
+            updates=self.updates,
+            skipped=self.skipped,
+            gaps=self.gaps,
+            checksum_errors=self.checksum_errors,
+            resyncs=self.resyncs,
+        )
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        if self.subscriber:
+            await self.subscriber.close()
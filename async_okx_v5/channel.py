@@ -75,6 +75,22 @@ class FundingRateChannel(PublicChannel):
     instId: str
 
 
+BookChannelName = Literal["books", "books5", "bbo-tbt", "books-l2-tbt", "books50-l2-tbt"]
+
+
+class OrderBookChannel(PublicChannel):
+    """深度频道
+    books：400档，首次推送全量，之后每100毫秒推送增量
+    books5：5档全量，每100毫秒推送
+    bbo-tbt：1档全量，每10毫秒推送
+    books-l2-tbt：400档，首次推送全量，之后逐笔推送增量，需登录VIP5及以上用户
+    books50-l2-tbt：50档，首次推送全量，之后逐笔推送增量，需登录VIP4及以上用户
+    """
+
+    channel: BookChannelName
+    instId: str
+
+
 class AccountChannel(PrivateChannel, total=False):
     channel: Literal["account"]
     ccy: str
@@ -1,58 +1,225 @@
 from . import utils, consts as c, exceptions
+from .clock import ClockSync, default_clock
+from .codec import JsonCodec, default_codec
+from .limits import LimiterRegistry, Priority, default_limits
+from .models import Decode, NUMBER_TYPES
+from .retry import NON_IDEMPOTENT, RetryPolicy, default_retry, detached
+from .transport import RequestTrace, Transport, default_transport
 import asyncio
-from aiohttp import ClientSession, ClientTimeout, ClientError
-from datetime import datetime
-import json
+import functools
+from aiohttp import ClientSession, ClientError, ClientConnectorError
 import logging
-
-MAX_RETRY = 100
-BACKOFF_MULTIPLIER = 1.1
+import time
+from typing import Optional
 
 
 class OkxClient:
     logger = logging.getLogger("OkxClient")
     logger.setLevel(logging.DEBUG)
-    client = ClientSession(base_url=c.API_URL, timeout=ClientTimeout(5))
+    clock = default_clock
+    codec = default_codec
+    limits = default_limits
+    retry = default_retry
+    flights: Optional[utils.SingleFlight] = utils.default_flights
+    transport = default_transport
 
-    def __init__(self, api_key, api_secret_key, passphrase, use_server_time=False, test=False, **kwargs):
-        if kwargs:
-            OkxClient.client = ClientSession(base_url=c.API_URL, **kwargs)
+    def __init__(
+        self,
+        api_key,
+        api_secret_key,
+        passphrase,
+        use_server_time=False,
+        test=False,
+        clock: ClockSync = None,
+        transport: Transport = None,
+        codec: JsonCodec = None,
+        decode: Decode = None,
+        limits: LimiterRegistry = None,
+        retry: RetryPolicy = None,
+        single_flight=True,
+        **kwargs,
+    ):
+        """
+        :param clock: server clock estimate, shared by default
+        :param transport: connection pool, shared by default
+        :param codec: JSON codec, the fastest one installed by default
+        :param decode: return `models` with numbers parsed into float or Decimal instead of raw strings
+        :param limits: rate limiters of endpoints, shared by default
+        :param retry: retry policy, shared by default
+        :param single_flight: concurrent identical GET requests share one request, every caller gets its own copy
+            of the response and of its records
+        :param kwargs: kwargs for a private `Transport` of this client
+        """
+        self._own_transport = not transport and bool(kwargs)
+        if transport:
+            self.transport = transport
+        elif kwargs:
+            self.transport = Transport(**kwargs)
         self.API_KEY = api_key
         self.API_SECRET_KEY = api_secret_key
         self.PASSPHRASE = passphrase
         self.use_server_time = use_server_time
         self.test = test
+        if clock:
+            self.clock = clock
+        if codec:
+            self.codec = codec
+        self.decode = decode
+        if limits:
+            self.limits = limits
+        if retry:
+            self.retry = retry
+        if not single_flight:
+            self.flights = None
+
+    def _parse(self, model, data: list) -> list:
+        """Decode raw records into `model` instances if a decode mode is set"""
+        if not self.decode:
+            return data
+        num = NUMBER_TYPES[self.decode]
+        return [model.parse(d, num) for d in data]
+
+    @classmethod
+    def share_rate_limits(cls, directory: str = None):
+        """Share rate limit budgets with other processes on this host
+
+        Call it in every worker process before sending requests, e.g. `OkxClient.share_rate_limits()`.
+
+        :param directory: directory of state files
+        """
+        cls.limits.share(directory)
+
+    @property
+    def client(self) -> ClientSession:
+        return self.transport.session
+
+    async def close(self):
+        """Close the connection pool if it is private to this client"""
+        if self._own_transport:
+            await self.transport.close()
+
+    async def warm_up(self, connections: int = None) -> int:
+        """Open pooled connections ahead of latency critical requests and keep them alive
+
+        :param connections: number of connections
+        :return: number of ready connections
+        """
+        return await self.transport.warm_up(connections)
 
-    async def _get_timestamp(self):
-        url = c.SERVER_TIMESTAMP_URL
-        async with self.client.get(url) as response:
-            res_json = await response.json()
-            if response.status == 200:
-                t = datetime.utcfromtimestamp(int(res_json["data"][0]["ts"]) / 1000)
-                t = t.isoformat("T", "milliseconds")
-                return f"{t}Z"
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def get_server_time(self, priority: Priority = Priority.QUERY) -> int:
+        """获取服务器时间，Unix时间戳的毫秒数
+
+        :param priority: 请求优先级，签名请求等待同步时使用该请求的优先级
+        """
+        limiter, weight = self.limits.resolve(c.GET, c.SERVER_TIMESTAMP_URL, {})
+        if limiter:
+            await limiter.acquire(weight, priority)
+        async with self.transport.slot(priority):
+            async with self.client.get(c.SERVER_TIMESTAMP_URL) as response:
+                res_json = self.codec.loads(await response.read())
+                return int(res_json["data"][0]["ts"])
+
+    async def _get_timestamp(self, priority: Priority = Priority.QUERY):
+        # Corrected by the estimated offset instead of querying server time for every request
+        await self.clock.ensure(functools.partial(self.get_server_time, priority))
+        return self.clock.timestamp()
+
+    async def _send(self, method, request_path, body, header, priority: Priority, trace: RequestTrace = None):
+        """Send a request on a connection granted by priority and read the response
+
+        :param trace: marked as sent once the request is written to the connection
+        :return: (status, headers, content, latency), latency is measured from the moment the connection is
+            granted, so it excludes the wait for a slot
+        """
+        async with self.transport.slot(priority):
+            sent = time.monotonic()
+            if method == c.GET:
+                request = self.client.get(request_path, headers=header, trace_request_ctx=trace)
+            elif method == c.POST:
+                request = self.client.post(request_path, data=body, headers=header, trace_request_ctx=trace)
+            elif method == c.DELETE:
+                request = self.client.delete(request_path, headers=header, trace_request_ctx=trace)
             else:
-                return ""
+                raise ValueError(method)
+            async with request as response:
+                return response.status, response.headers, await response.read(), time.monotonic() - sent
+
+    async def _request(self, method, request_path, params, priority: Priority = None, idempotent: bool = None):
+        """
+        :param priority: 请求优先级，默认按请求类型确定，撤单和只减仓订单优先于新订单，新订单优先于查询
+        :param idempotent: 请求可以安全重发，默认下单和划转之外的请求都可以
+        :raise OkexAmbiguousException: 不可重发的请求可能已生效
+        """
+        if method == c.GET and self.flights is not None:
+            # Concurrent identical queries of one retry policy share one request. It runs detached from the
+            # deadline of the caller that started it, and every caller waits within its own deadline.
+            key = (self.API_KEY, self.test, request_path, utils.parse_params_to_str(params), priority, self.retry)
+            expires = self.retry.expires()
+            try:
+                res = await self.flights.do(
+                    key,
+                    functools.partial(self._perform_detached, method, request_path, params, priority, idempotent),
+                    None if expires is None else expires - time.monotonic(),
+                )
+            except asyncio.TimeoutError as exc:
+                raise exceptions.OkexRetryException(
+                    f"deadline: {request_path} expired while waiting", reason="deadline"
+                ) from exc
+            return self._copy_response(res)
+        return await self._perform(method, request_path, params, priority, idempotent)
 
-    async def _request(self, method, request_path, params):
+    @staticmethod
+    def _copy_response(res: dict) -> dict:
+        # Results returned as-is stay private to each caller of a shared request
+        data = res.get("data")
+        if not isinstance(data, list):
+            return dict(res)
+        return dict(res, data=[dict(d) if isinstance(d, dict) else d for d in data])
+
+    async def _perform_detached(self, method, request_path, params, priority: Priority, idempotent: bool):
+        with detached():
+            return await self._perform(method, request_path, params, priority, idempotent)
+
+    async def _perform(self, method, request_path, params, priority: Priority, idempotent: bool):
+        if idempotent is None:
+            idempotent = (method, request_path) not in NON_IDEMPOTENT
+        # Rate limit rule of the endpoint, scoped by IP or API key and request parameters
+        limiter, weight = self.limits.resolve(method, request_path, params, self.API_KEY)
+        if priority is None:
+            priority = self.limits.priority(method, request_path, params)
         if method == c.GET:
             request_path += utils.parse_params_to_str(params)
 
-        success = False
-        retry = 0
-        backoff = 1
-        # 处理网络异常
-        while not success and retry < MAX_RETRY:
+        call = self.retry.call()
+
+        async def failed(error, detail, exc=None):
+            # A request that may have reached the exchange is only resent if that is harmless.
+            if not idempotent:
+                raise exceptions.OkexAmbiguousException(detail) from exc
+            await call.retry(error, detail)
+
+        while True:
+            trace = RequestTrace()
             try:
+                # Every attempt counts against the limit
+                if limiter:
+                    await call.bounded(limiter.acquire(weight, priority))
+
                 # sign & header
                 if self.use_server_time:
                     # 获取服务器时间
-                    timestamp = await self._get_timestamp()
+                    timestamp = await self._get_timestamp(priority)
                 else:
                     # 获取本地时间
                     timestamp = utils.get_timestamp()
 
-                body = json.dumps(params) if method == c.POST else ""
+                body = self.codec.dumps(params) if method == c.POST else ""
                 sign = utils.sign(utils.pre_hash(timestamp, method, request_path, str(body)), self.API_SECRET_KEY)
                 header = utils.get_header(self.API_KEY, sign.decode("utf8"), timestamp, self.PASSPHRASE)
 
@@ -60,66 +227,62 @@ class OkxClient:
                     header["x-simulated-trading"] = "1"
 
                 # send request
-                if method == c.GET:
-                    try:
-                        response = await self.client.get(request_path, headers=header)
-                    except (ClientError, asyncio.TimeoutError):
-                        retry += 1
-                        continue
-                elif method == c.POST:
-                    response = await self.client.post(request_path, data=body, headers=header)
-                elif method == c.DELETE:
-                    response = await self.client.delete(request_path, headers=header)
-                else:
-                    raise ValueError
+                try:
+                    status, headers, content, latency = await call.bounded(
+                        self._send(method, request_path, body, header, priority, trace)
+                    )
+                except exceptions.OkexRetryException as exc:
+                    if trace.sent:
+                        # The deadline passed with the request in flight
+                        await failed("network", f"{request_path} {exc.message}", exc)
+                    # The deadline passed waiting for a connection, nothing was sent
+                    raise
+            except ClientConnectorError as exc:
+                # Nothing was sent
+                await call.retry("network", f"{request_path} {exc!r}")
+                continue
             except (ClientError, asyncio.TimeoutError) as exc:
-                self.logger.debug("Network error", exc_info=exc)
-                await asyncio.sleep(backoff)
-                retry += 1
-                backoff *= BACKOFF_MULTIPLIER
+                if trace.sent:
+                    await failed("network", f"{request_path} {exc!r}", exc)
+                else:
+                    await call.retry("network", f"{request_path} {exc!r}")
                 continue
-            else:
-                async with response:
-                    status = response.status
-                    # Cloudflare error
-                    if str(status).startswith("5"):
-                        self.logger.debug(f"Cloudflare error {response}")
-                        await asyncio.sleep(backoff)
-                        retry += 1
-                        backoff *= BACKOFF_MULTIPLIER
-                        continue
-                    try:
-                        json_res = await response.json()
-                    except asyncio.TimeoutError:
-                        retry += 1
-                        continue
-                    except ValueError:
-                        text = await response.text()
-                        if "cloudflare" in text:
-                            await asyncio.sleep(backoff)
-                            retry += 1
-                            backoff *= BACKOFF_MULTIPLIER
-                            continue
-                        raise exceptions.OkexRequestException(f"Invalid Response: {text}")
-                    # Endpoint request timeout
-                    if json_res.get("code") == "50004":
-                        retry += 1
-                        await asyncio.sleep(2)
-                        continue
-                    # Requests too frequent
-                    if status == 429:
-                        retry += 1
-                        self.logger.debug(f"{request_path}, {json_res['msg']}")
-                        await asyncio.sleep(2)
-                        continue
-                    success = True
-
-                    # exception handle
-                    if not str(status).startswith("2"):
-                        self.logger.error(f"{json_res['code']}: {json_res['msg']}")
-                        self.logger.error(f"Client error {status}: {request_path}")
-                        raise exceptions.OkexAPIException(status, json_res)
-        return json_res
+
+            # Cloudflare error
+            if str(status).startswith("5"):
+                await failed("server", f"{request_path} HTTP {status}")
+                continue
+            try:
+                json_res = self.codec.loads(content)
+            except ValueError:
+                text = content.decode(errors="replace")
+                if "cloudflare" in text:
+                    await failed("server", f"{request_path} Cloudflare")
+                    continue
+                raise exceptions.OkexRequestException(f"Invalid Response: {text}")
+            # Endpoint request timeout
+            if json_res.get("code") == "50004":
+                await failed("busy", f"{request_path} {json_res['msg']}")
+                continue
+            # Requests too frequent
+            if status == 429 or json_res.get("code") == "50011":
+                detail = f"{request_path} {json_res['msg']}"
+                if limiter:
+                    # The limiter slows down and delays the retry itself.
+                    limiter.throttled(utils.retry_after(headers))
+                    await call.retry("throttle", detail, delay=0)
+                else:
+                    await call.retry("throttle", detail, delay=utils.retry_after(headers))
+                continue
+            if limiter:
+                limiter.succeeded(latency)
+
+            # exception handle
+            if not str(status).startswith("2"):
+                self.logger.error(f"{json_res['code']}: {json_res['msg']}")
+                self.logger.error(f"Client error {status}: {request_path}")
+                raise exceptions.OkexAPIException(status, json_res)
+            return json_res
 
     async def _request_without_params(self, method, request_path):
         return await self._request(method, request_path, {})
@@ -0,0 +1,209 @@
+import asyncio
+import collections
+import datetime
+import logging
+import time
+from typing import Awaitable, Callable, Deque, NamedTuple, Optional, TypedDict
+
+# OKX rejects signed requests whose timestamp differs from server time by more than 30 seconds.
+EXPIRY_WINDOW = 30.0
+
+
+class ClockSample(NamedTuple):
+    """一次服务器时间采样
+    :param offset: 服务器时间减去本地中点时间，单位秒
+    :param rtt: 往返时延，单位秒
+    :param t: 采样中点的本地时间
+    """
+
+    offset: float
+    rtt: float
+    t: float
+
+
+class ClockMetrics(TypedDict):
+    """时钟同步指标
+    :param offset: 当前估计的服务器时间偏移，单位秒
+    :param rtt: 最优样本的往返时延，单位秒
+    :param drift: 本地时钟漂移，单位 ppm
+    :param samples: 窗口内样本数
+    :param age: 距离上次同步的秒数
+    :param skew: 偏移占过期窗口的比例
+    """
+
+    offset: float
+    rtt: float
+    drift: float
+    samples: int
+    age: float
+    skew: float
+
+
+class ClockSync:
+    """Estimate server clock offset from periodic samples of `/api/v5/public/time`
+
+    The offset of the sample with the lowest round trip time in the window is trusted, as in NTP,
+    because its error is bounded by half of that round trip time.
+    """
+
+    logger = logging.getLogger("ClockSync")
+    logger.setLevel(logging.DEBUG)
+
+    def __init__(self, interval=60.0, window=8, burst=4, retry=1.0):
+        """
+        :param interval: seconds between background resynchronizations
+        :param window: number of samples kept for the min-RTT filter
+        :param burst: number of samples taken at each synchronization
+        :param retry: seconds before `ensure` retries a failed synchronization, doubled on every failure up to
+            `interval`
+        """
+        self.interval = interval
+        self.burst = burst
+        self.retry = retry
+        self._samples: Deque[ClockSample] = collections.deque(maxlen=window)
+        # Best estimate of each synchronization, used to measure drift
+        self._history: Deque[ClockSample] = collections.deque(maxlen=window)
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        # Server time source of the background refresh, from the latest `ensure`
+        self._fetch: Optional[Callable[[], Awaitable[int]]] = None
+        self.last_sync = 0.0
+        self.failures = 0
+        self._retry_at = 0.0
+
+    def __repr__(self):
+        return f"ClockSync(offset={self.offset * 1000:.1f}ms, rtt={self.rtt * 1000:.1f}ms)"
+
+    @property
+    def synced(self) -> bool:
+        return bool(self._samples)
+
+    @property
+    def best(self) -> Optional[ClockSample]:
+        """Sample with the lowest round trip time in the window"""
+        return min(self._samples, key=lambda s: s.rtt) if self._samples else None
+
+    @property
+    def offset(self) -> float:
+        best = self.best
+        return best.offset if best else 0.0
+
+    @property
+    def rtt(self) -> float:
+        best = self.best
+        return best.rtt if best else 0.0
+
+    @property
+    def drift(self) -> float:
+        """Least squares slope of the offset over time, in seconds per second"""
+        n = len(self._history)
+        if n < 2:
+            return 0.0
+        mean_t = sum(s.t for s in self._history) / n
+        mean_o = sum(s.offset for s in self._history) / n
+        var = sum((s.t - mean_t) ** 2 for s in self._history)
+        if var == 0:
+            return 0.0
+        return sum((s.t - mean_t) * (s.offset - mean_o) for s in self._history) / var
+
+    def time(self) -> float:
+        """Estimated server time in seconds since epoch"""
+        now = time.time()
+        best = self.best
+        if not best:
+            return now
+        return now + best.offset + self.drift * (now - best.t)
+
+    def timestamp(self) -> str:
+        """Estimated server time in the ISO format required by REST signatures"""
+        t = datetime.datetime.utcfromtimestamp(self.time()).isoformat("T", "milliseconds")
+        return f"{t}Z"
+
+    def unix_timestamp(self) -> int:
+        """Estimated server time in seconds, as required by websocket login"""
+        return int(self.time())
+
+    def metrics(self) -> ClockMetrics:
+        return ClockMetrics(
+            offset=self.offset,
+            rtt=self.rtt,
+            drift=self.drift * 1e6,
+            samples=len(self._samples),
+            age=time.monotonic() - self.last_sync if self.last_sync else float("inf"),
+            skew=abs(self.offset) / EXPIRY_WINDOW,
+        )
+
+    def near_expiry(self, margin=0.5) -> bool:
+        """Whether local clock skew has consumed `margin` of the expiry window"""
+        return abs(self.offset) + self.rtt / 2 >= EXPIRY_WINDOW * margin
+
+    async def sample(self, fetch: Callable[[], Awaitable[int]]) -> ClockSample:
+        """Take one sample
+
+        :param fetch: coroutine function returning server time in milliseconds
+        """
+        t0 = time.time()
+        p0 = time.perf_counter()
+        server_ms = await fetch()
+        rtt = time.perf_counter() - p0
+        mid = t0 + rtt / 2
+        sample = ClockSample(server_ms / 1000 - mid, rtt, mid)
+        self._samples.append(sample)
+        return sample
+
+    async def sync(self, fetch: Callable[[], Awaitable[int]]):
+        """Take a burst of samples and update the estimate"""
+        taken = 0
+        for _ in range(self.burst):
+            try:
+                await self.sample(fetch)
+                taken += 1
+            except Exception as exc:
+                self.logger.debug("Server time sample failed", exc_info=exc)
+        if not taken:
+            self.failures += 1
+            backoff = min(self.interval, self.retry * 2 ** (self.failures - 1))
+            self._retry_at = time.monotonic() + backoff
+            self.logger.warning(f"Clock synchronization failed, retrying in {backoff:.1f}s")
+            return
+        self.failures = 0
+        if self._samples:
+            self.last_sync = time.monotonic()
+            self._history.append(self.best)
+            if self.near_expiry():
+                self.logger.warning(f"Clock skew {self.offset:.3f}s is close to the {EXPIRY_WINDOW}s expiry window")
+
+    async def ensure(self, fetch: Callable[[], Awaitable[int]]):
+        """Synchronize once if never synchronized and keep refreshing in the background
+
+        After a failed synchronization the local clock is used until the retry backoff has passed, so callers
+        do not each wait for another burst of failing requests. The background refresh samples through the
+        `fetch` of the latest call, so a clock shared by many clients outlives the client that started it.
+        """
+        self._fetch = fetch
+        if not self.synced and time.monotonic() >= self._retry_at:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if not self.synced and time.monotonic() >= self._retry_at:
+                    await self.sync(fetch)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh())
+
+    async def _refresh(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.sync(self._fetch)
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Shared by REST clients and websocket logins unless another instance is supplied
+default_clock = ClockSync()
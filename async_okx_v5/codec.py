@@ -0,0 +1,78 @@
+import json
+from typing import Any, Union
+
+
+class JsonCodec:
+    """JSON codec of the standard library, always available"""
+
+    name = "json"
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+    def dumps(self, obj: Any) -> str:
+        return json.dumps(obj)
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        """Decode `bytes` directly or `str`
+
+        :raise ValueError: invalid JSON
+        """
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self._dumps = orjson.dumps
+        self._loads = orjson.loads
+
+    def dumps(self, obj: Any) -> str:
+        return self._dumps(obj).decode()
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        # orjson.JSONDecodeError is a subclass of ValueError
+        return self._loads(data)
+
+
+class MsgspecCodec(JsonCodec):
+    name = "msgspec"
+
+    def __init__(self):
+        import msgspec
+
+        self._encoder = msgspec.json.Encoder()
+        self._decoder = msgspec.json.Decoder()
+        self._error = msgspec.DecodeError
+
+    def dumps(self, obj: Any) -> str:
+        return self._encoder.encode(obj).decode()
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        try:
+            return self._decoder.decode(data)
+        except self._error as exc:
+            raise ValueError(str(exc)) from exc
+
+
+CODECS = {codec.name: codec for codec in (OrjsonCodec, MsgspecCodec, JsonCodec)}
+
+
+def get_codec(name: str = None) -> JsonCodec:
+    """JSON codec by name, or the fastest one installed
+
+    :param name: orjson, msgspec or json
+    """
+    if name:
+        return CODECS[name]()
+    for codec in CODECS.values():
+        try:
+            return codec()
+        except ImportError:
+            continue
+
+
+default_codec = get_codec()
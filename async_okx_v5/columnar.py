@@ -0,0 +1,85 @@
+from typing import Dict, List, Literal, Sequence, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+Columnar = Literal["numpy", "columns"]
+# Structured array, or a dict of column arrays
+ColumnarResult = Union["np.ndarray", Dict[str, "np.ndarray"]]
+
+CANDLE_FIELDS = ("ts", "o", "h", "l", "c", "vol", "volCcy", "volCcyQuote", "confirm")
+CANDLE_DTYPE = (
+    [("ts", "i8")] + [(name, "f8") for name in CANDLE_FIELDS[1:-1]] + [("confirm", "?")] if np is not None else None
+)
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("NumPy is required for columnar results: pip install numpy")
+
+
+class CandleBuffer:
+    """Preallocated structured array filled with raw candle pages as they arrive
+
+    Rows never become Python objects: each page is parsed column by column into its slice of the buffer.
+    """
+
+    def __init__(self, capacity: int):
+        _require_numpy()
+        self.array = np.empty(capacity, dtype=CANDLE_DTYPE)
+        # (offset, length) of pages written
+        self._spans: List[Tuple[int, int]] = []
+
+    def __len__(self):
+        return sum(n for _, n in self._spans)
+
+    def write(self, offset: int, rows: Sequence[Sequence[str]]):
+        """Parse a page of raw candles into the buffer at `offset`"""
+        n = len(rows)
+        if not n:
+            return
+        if offset + n > len(self.array):
+            self.array = np.resize(self.array, max(offset + n, 2 * len(self.array)))
+        raw = np.array(rows, dtype=str)
+        block = self.array[offset : offset + n]
+        block["ts"] = raw[:, 0].astype(np.int64)
+        for i, name in enumerate(CANDLE_FIELDS[1:-1], 1):
+            block[name] = raw[:, i].astype(np.float64)
+        block["confirm"] = raw[:, 8] == "1"
+        self._spans.append((offset, n))
+
+    def result(self, columnar: Columnar = "numpy") -> ColumnarResult:
+        """Written rows as a structured array, or a dict of column arrays
+
+        :param columnar: numpy: structured array; columns: dict of field name to array
+        """
+        spans = sorted(self._spans)
+        end = 0
+        contiguous = True
+        for offset, n in spans:
+            if offset != end:
+                contiguous = False
+                break
+            end += n
+        if contiguous:
+            array = self.array[:end]
+        else:
+            # Short pages left holes in the buffer
+            array = np.concatenate([self.array[offset : offset + n] for offset, n in spans])
+        if columnar == "columns":
+            return to_columns(array)
+        return array
+
+
+def to_columns(array) -> Dict[str, "np.ndarray"]:
+    """Views of each field of a structured array"""
+    return {name: array[name] for name in array.dtype.names}
+
+
+def candles_to_array(rows: Sequence[Sequence[str]], columnar: Columnar = "numpy") -> ColumnarResult:
+    """Raw candles as a structured array, or a dict of column arrays"""
+    buffer = CandleBuffer(len(rows))
+    buffer.write(0, rows)
+    return buffer.result(columnar)
@@ -30,6 +30,8 @@ TRADE_ORDER = "/api/v5/trade/order"
 BATCH_ORDER = "/api/v5/trade/batch-orders"
 CANCEL_ORDER = "/api/v5/trade/cancel-order"
 BATCH_CANCEL = "/api/v5/trade/cancel-batch-orders"
+AMEND_ORDER = "/api/v5/trade/amend-order"
+BATCH_AMEND = "/api/v5/trade/amend-batch-orders"
 PENDING_ORDER = "/api/v5/trade/orders-pending"
 ACCOUNT_CONFIG = "/api/v5/account/config"
 POSITION_MODE = "/api/v5/account/set-position-mode"
@@ -43,5 +45,6 @@ GET_ARCHIVE_LEDGER = "/api/v5/account/bills-archive"
 MARGIN_BALANCE = "/api/v5/account/position/margin-balance"
 ASSET_BALANCE = "/api/v5/asset/balances"
 ASSET_TRANSFER = "/api/v5/asset/transfer"
+ASSET_TRANSFER_STATE = "/api/v5/asset/transfer-state"
 
 SERVER_TIMESTAMP_URL = "/api/v5/public/time"
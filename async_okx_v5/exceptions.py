@@ -31,3 +31,43 @@ class OkexParamsException(OkexException):
 
     def __str__(self):
         return f"OkexParamsException: {self.message}"
+
+
+class OkexRetryException(OkexException):
+    """A request gave up retrying
+
+    :param reason: error class whose attempts ran out, "deadline" or "budget"
+    :param attempts: number of attempts made
+    """
+
+    def __init__(self, message, reason=None, attempts=0):
+        self.message = message
+        self.reason = reason
+        self.attempts = attempts
+
+    def __str__(self):
+        return f"OkexRetryException: {self.message}"
+
+
+class OkexAmbiguousException(OkexException):
+    """A request that must not be sent twice failed after it may have reached the exchange"""
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return f"OkexAmbiguousException: {self.message}"
+
+
+class OkexBookException(OkexException):
+    """A local order book is out of sync with the exchange
+
+    :param reason: "gap" for a missed update, "checksum" for a checksum mismatch
+    """
+
+    def __init__(self, message, reason=None):
+        self.message = message
+        self.reason = reason
+
+    def __str__(self):
+        return f"OkexBookException: {self.message}"
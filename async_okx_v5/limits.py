@@ -0,0 +1,167 @@
+import enum
+import hashlib
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+from .consts import *
+from .utils import RateLimiter, SharedRateLimiter
+
+
+class Priority(enum.IntEnum):
+    """请求优先级，数值越小越先获得限速额度和连接"""
+
+    # 撤单和只减仓订单
+    RISK = 0
+    # 新订单和其他写操作
+    ORDER = 1
+    # 只读查询
+    QUERY = 2
+
+
+RISK_PATHS = {CANCEL_ORDER, BATCH_CANCEL}
+
+
+class Rule(NamedTuple):
+    """限速规则
+    :param limit: 限速次数
+    :param interval: 限速周期，单位秒
+    :param user: 按 UserID 限速，否则按 IP 限速
+    :param keys: 限速规则中的请求参数，如 instType、instId、ccy
+    :param weighted: 批量请求按条目数计数
+    """
+
+    limit: int
+    interval: float
+    user: bool = False
+    keys: Tuple[str, ...] = ()
+    weighted: bool = False
+
+
+RATE_LIMITS: Dict[Tuple[str, str], Rule] = {
+    # IP
+    (GET, SERVER_TIMESTAMP_URL): Rule(10, 2),
+    (GET, GET_INSTRUMENTS): Rule(20, 2, keys=("instType",)),
+    (GET, FUNDING_RATE): Rule(20, 2, keys=("instId",)),
+    (GET, FUNDING_RATE_HISTORY): Rule(10, 2, keys=("instId",)),
+    (GET, GET_TICKERS): Rule(20, 2),
+    (GET, GET_TICKER): Rule(20, 2),
+    (GET, GET_CANDLES): Rule(40, 2),
+    (GET, HISTORY_CANDLES): Rule(20, 2),
+    # UserID
+    (POST, TRADE_ORDER): Rule(60, 2, user=True, keys=("instId",)),
+    (GET, TRADE_ORDER): Rule(60, 2, user=True, keys=("instId",)),
+    (POST, BATCH_ORDER): Rule(300, 2, user=True, weighted=True),
+    (POST, CANCEL_ORDER): Rule(60, 2, user=True, keys=("instId",)),
+    (POST, BATCH_CANCEL): Rule(300, 2, user=True, weighted=True),
+    (POST, AMEND_ORDER): Rule(60, 2, user=True, keys=("instId",)),
+    (POST, BATCH_AMEND): Rule(300, 2, user=True, weighted=True),
+    (GET, PENDING_ORDER): Rule(60, 2, user=True),
+    (GET, TRADE_FEE): Rule(5, 2, user=True),
+    (GET, ACCOUNT_CONFIG): Rule(5, 2, user=True),
+    (POST, POSITION_MODE): Rule(5, 2, user=True),
+    (GET, ACCOUNT_POSITION): Rule(10, 2, user=True),
+    (GET, ACCOUNT_BALANCE): Rule(10, 2, user=True),
+    (GET, GET_LEVERAGE): Rule(20, 2, user=True),
+    (POST, SET_LEVERAGE): Rule(20, 2, user=True),
+    (GET, MAX_SIZE): Rule(20, 2, user=True),
+    (GET, GET_LEDGER): Rule(5, 1, user=True),
+    (GET, GET_ARCHIVE_LEDGER): Rule(5, 2, user=True),
+    (POST, MARGIN_BALANCE): Rule(20, 2, user=True),
+    (GET, ASSET_BALANCE): Rule(6, 1, user=True),
+    (POST, ASSET_TRANSFER): Rule(1, 1, user=True, keys=("ccy",)),
+    (GET, ASSET_TRANSFER_STATE): Rule(10, 1, user=True),
+}
+
+
+def user_id(api_key: str) -> str:
+    """Short stable alias of an API key, so keys never appear in file names or metrics"""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12] if api_key else "public"
+
+
+def _reduce_only(order) -> bool:
+    return isinstance(order, dict) and str(order.get("reduceOnly", "")).lower() == "true"
+
+
+class LimiterRegistry:
+    """Rate limiters resolved from `RATE_LIMITS` by endpoint and scope, created on demand
+
+    Limiters scoped by UserID are keyed by API key, so sub-accounts get independent budgets.
+    """
+
+    def __init__(self, rules: Dict[Tuple[str, str], Rule] = None, shared=False, directory: str = None):
+        """
+        :param rules: limit rule of each (method, request_path)
+        :param shared: share budgets with other processes on this host
+        :param directory: directory of shared state files
+        """
+        self.rules = dict(RATE_LIMITS if rules is None else rules)
+        self.shared = shared
+        self.directory = directory
+        self._limiters: Dict[Tuple[str, ...], RateLimiter] = {}
+
+    def __repr__(self):
+        return f"LimiterRegistry({len(self.rules)} rules, {len(self._limiters)} limiters)"
+
+    def share(self, directory: str = None):
+        """Share budgets of limiters created from now on with other processes on this host
+
+        :raise OSError: shared budgets are not supported on this platform
+        """
+        if not SharedRateLimiter.available:
+            raise OSError("Shared rate limits require fcntl, which is not available on this platform")
+        self.shared = True
+        self.directory = directory
+        self._limiters.clear()
+
+    def scope(self, method, request_path, params: Union[dict, list], api_key="") -> Optional[Tuple[str, ...]]:
+        rule = self.rules.get((method, request_path))
+        if rule is None:
+            return None
+        scope = [method, request_path]
+        if rule.user:
+            scope.append(user_id(api_key))
+        if isinstance(params, dict):
+            scope.extend(str(params.get(key, "")) for key in rule.keys)
+        return tuple(scope)
+
+    def resolve(self, method, request_path, params: Union[dict, list], api_key="") -> Tuple[Optional[RateLimiter], int]:
+        """Limiter of a request and the weight it consumes
+
+        :return: (limiter, weight), limiter is None for endpoints without a rule
+        """
+        scope = self.scope(method, request_path, params, api_key)
+        if scope is None:
+            return None, 1
+        rule = self.rules[(method, request_path)]
+        limiter = self._limiters.get(scope)
+        if limiter is None:
+            if self.shared:
+                limiter = SharedRateLimiter(rule.limit, rule.interval, ":".join(scope), self.directory)
+            else:
+                limiter = RateLimiter(rule.limit, rule.interval)
+            self._limiters[scope] = limiter
+        weight = len(params) if rule.weighted and isinstance(params, list) else 1
+        return limiter, weight
+
+    @staticmethod
+    def priority(method, request_path, params: Union[dict, list]) -> Priority:
+        """Priority class of a request
+
+        Cancels and orders that only reduce positions are risk reducing, other writes are orders and reads are
+        queries. A batch is risk reducing only if every order in it is.
+        """
+        if method == GET:
+            return Priority.QUERY
+        if request_path in RISK_PATHS:
+            return Priority.RISK
+        if request_path in (TRADE_ORDER, BATCH_ORDER):
+            orders = params if isinstance(params, list) else [params]
+            if orders and all(_reduce_only(order) for order in orders):
+                return Priority.RISK
+        return Priority.ORDER
+
+    def stats(self) -> Dict[str, dict]:
+        """Statistics of every limiter in use"""
+        return {" ".join(scope): limiter.stats() for scope, limiter in self._limiters.items()}
+
+
+# Shared by all API clients unless another registry is supplied
+default_limits = LimiterRegistry()
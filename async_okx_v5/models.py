@@ -0,0 +1,129 @@
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Callable, Dict, Literal, Optional, Sequence, Union
+
+Num = Union[float, Decimal]
+Decode = Literal["float", "decimal"]
+NUMBER_TYPES: Dict[str, Callable[[str], Num]] = {"float": float, "decimal": Decimal}
+
+
+def _num(value: str, num) -> Optional[Num]:
+    # OKX sends "" for fields without a value
+    return num(value) if value else None
+
+
+def _int(value: str) -> Optional[int]:
+    return int(value) if value else None
+
+
+@dataclass(slots=True)
+class Ticker:
+    """产品行情，价格和数量已解析为数值，时间戳为毫秒整数，字段含义同 `TickerResponse`"""
+
+    instType: str
+    instId: str
+    last: Num
+    lastSz: Num
+    askPx: Optional[Num]
+    askSz: Optional[Num]
+    bidPx: Optional[Num]
+    bidSz: Optional[Num]
+    open24h: Num
+    high24h: Num
+    low24h: Num
+    volCcy24h: Num
+    vol24h: Num
+    sodUtc0: Num
+    sodUtc8: Num
+    ts: int
+
+    @classmethod
+    def parse(cls, d: dict, num=float) -> "Ticker":
+        return cls(
+            d["instType"],
+            d["instId"],
+            _num(d["last"], num),
+            _num(d["lastSz"], num),
+            _num(d["askPx"], num),
+            _num(d["askSz"], num),
+            _num(d["bidPx"], num),
+            _num(d["bidSz"], num),
+            _num(d["open24h"], num),
+            _num(d["high24h"], num),
+            _num(d["low24h"], num),
+            _num(d["volCcy24h"], num),
+            _num(d["vol24h"], num),
+            _num(d["sodUtc0"], num),
+            _num(d["sodUtc8"], num),
+            int(d["ts"]),
+        )
+
+
+@dataclass(slots=True)
+class FundingRate:
+    """资金费率，字段含义同 `FundingRateResponse`
+    :param realizedRate: 实际资金费率，仅适用于历史资金费率
+    """
+
+    instType: str
+    instId: str
+    fundingRate: Num
+    fundingTime: int
+    nextFundingRate: Optional[Num] = None
+    nextFundingTime: Optional[int] = None
+    realizedRate: Optional[Num] = None
+
+    @classmethod
+    def parse(cls, d: dict, num=float) -> "FundingRate":
+        return cls(
+            d["instType"],
+            d["instId"],
+            _num(d["fundingRate"], num),
+            int(d["fundingTime"]),
+            _num(d.get("nextFundingRate"), num),
+            _int(d.get("nextFundingTime")),
+            _num(d.get("realizedRate"), num),
+        )
+
+
+@dataclass(slots=True)
+class Candle:
+    """K线数据，字段含义同 `types.Candle`"""
+
+    ts: int
+    o: Num
+    h: Num
+    l: Num
+    c: Num
+    vol: Num
+    volCcy: Num
+    volCcyQuote: Num
+    confirm: bool
+
+    @classmethod
+    def parse(cls, row: Sequence[str], num=float) -> "Candle":
+        return cls(
+            int(row[0]),
+            num(row[1]),
+            num(row[2]),
+            num(row[3]),
+            num(row[4]),
+            num(row[5]),
+            num(row[6]),
+            num(row[7]),
+            row[8] == "1",
+        )
+
+
+@dataclass(slots=True)
+class AssetBalance:
+    """资金账户余额，字段含义同 `AssetBalanceResponse`"""
+
+    ccy: str
+    bal: Num
+    frozenBal: Num
+    availBal: Num
+
+    @classmethod
+    def parse(cls, d: dict, num=float) -> "AssetBalance":
+        return cls(d["ccy"], _num(d["bal"], num), _num(d["frozenBal"], num), _num(d["availBal"], num))
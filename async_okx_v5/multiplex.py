@@ -0,0 +1,717 @@
+import asyncio
+import itertools
+import logging
+import random
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Literal, Optional, Sequence, Set, Tuple
+from websockets import connect, WebSocketClientProtocol, ConnectionClosed, ConnectionClosedError, WebSocketException
+from .channel import Channel
+from .codec import JsonCodec, default_codec
+from .exceptions import OkexRequestException
+from .utils import RateLimiter
+
+Key = Tuple[Tuple[str, str], ...]
+
+# Channel arguments per subscribe or unsubscribe request
+ARGS_PER_REQUEST = 50
+
+
+def arg_key(arg: dict) -> Key:
+    """Routing key of a channel argument, equal for the argument subscribed and the one echoed in pushed frames
+
+    Private channels echo the UID of the account, which is not part of the subscription.
+    """
+    return tuple(sorted((k, str(v)) for k, v in arg.items() if k != "uid"))
+
+
+class _Closed:
+    """Marks the end of a subscriber's stream"""
+
+
+# How a subscriber buffers messages its consumer has not taken yet
+# block: the connection waits for room, pushing back on the exchange
+# drop_oldest: the oldest message is dropped for a new one
+# conflate: only the latest message of each channel and instrument is kept
+Policy = Literal["block", "drop_oldest", "conflate"]
+
+# Suggested policy of each channel, block for the others
+CHANNEL_POLICIES: Dict[str, Policy] = {
+    "tickers": "conflate",
+    "mark-price": "conflate",
+    "index-tickers": "conflate",
+    "funding-rate": "conflate",
+    "open-interest": "conflate",
+    "price-limit": "conflate",
+    "opt-summary": "conflate",
+    "books5": "conflate",
+    "bbo-tbt": "conflate",
+    "trades": "drop_oldest",
+    "trades-all": "drop_oldest",
+}
+
+
+def delivery_policy(channels: Iterable[Channel]) -> Policy:
+    """Policy suited to all of `channels`: conflate only if every channel can be conflated, dropping messages only
+    if every channel can lose them, otherwise block
+    """
+    policies = {CHANNEL_POLICIES.get(arg["channel"], "block") for arg in channels}
+    if policies <= {"conflate"}:
+        return "conflate"
+    if "block" in policies:
+        return "block"
+    return "drop_oldest"
+
+
+class Subscriber:
+    """Stream of messages of a set of channels, fed by the shared connections of a `WebsocketManager`
+
+    At most `maxsize` messages wait for the consumer, handled as set by `policy` when full. A blocking subscriber
+    stalls every channel on its connections until its consumer catches up, so it suits low rate channels such as
+    orders and positions. Events such as reconnects are never dropped or conflated.
+
+    The stream ends when the subscriber is closed, and raises the error of a connection that gave up reconnecting
+    once the messages before it are consumed.
+
+    Usage:
+        subscriber = await manager.subscribe(channels)
+        async for message in subscriber:
+            ...
+    """
+
+    def __init__(self, manager: "WebsocketManager", policy: Policy = "block", maxsize=10000):
+        """
+        :param policy: block, drop_oldest or conflate
+        :param maxsize: messages buffered at most
+        """
+        self.manager = manager
+        self.policy = policy
+        self.maxsize = maxsize
+        self.keys: Set[Key] = set()
+        # Keyed by channel and instrument when conflating, otherwise by arrival
+        self._buffer: OrderedDict = OrderedDict()
+        # Keys of the buffered messages that are never dropped
+        self._forced: Set[int] = set()
+        self._arrival = itertools.count()
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self.closed = False
+        self.error: Optional[Exception] = None
+        self.delivered = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.blocked = 0
+
+    def __repr__(self):
+        return f"Subscriber({len(self.keys)} channels, {self.policy})"
+
+    @property
+    def channels(self) -> List[dict]:
+        return [dict(key) for key in self.keys]
+
+    def _key(self, message: dict):
+        if self.policy == "conflate":
+            arg = message.get("arg")
+            data = message.get("data")
+            if arg is not None:
+                instId = data[0].get("instId") if data and isinstance(data[0], dict) else None
+                return arg_key(arg), instId
+        return next(self._arrival)
+
+    def _put(self, message, force=False) -> bool:
+        """Buffer a message
+
+        :param force: buffer it beyond `maxsize`
+        :return: False if it is not buffered because a blocking subscriber is full
+        """
+        if self.closed:
+            return True
+        buffer = self._buffer
+        key = self._key(message)
+        if key in buffer:
+            self.conflated += 1
+        elif len(buffer) >= self.maxsize and not force:
+            if self.policy == "block":
+                return False
+            # The oldest message that is not an event, or the new one if only events are buffered
+            oldest = next((k for k in buffer if k not in self._forced), None)
+            self.dropped += 1
+            if oldest is None:
+                return True
+            del buffer[oldest]
+        if force:
+            self._forced.add(key)
+        buffer[key] = message
+        self._ready.set()
+        return True
+
+    async def _wait(self):
+        """Wait for room in a blocking subscriber"""
+        self.blocked += 1
+        while len(self._buffer) >= self.maxsize and not self.closed:
+            self._space.clear()
+            await self._space.wait()
+
+    def _close(self, error: Exception = None):
+        """End the stream, with `error` raised to the consumer"""
+        if not self.closed:
+            self._buffer[next(self._arrival)] = _Closed
+            self.error = error
+            self.closed = True
+            self._ready.set()
+            self._space.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        while not self._buffer:
+            self._ready.clear()
+            await self._ready.wait()
+        key, message = self._buffer.popitem(last=False)
+        self._forced.discard(key)
+        self._space.set()
+        if message is _Closed:
+            self._buffer[next(self._arrival)] = _Closed
+            if self.error:
+                raise self.error
+            raise StopAsyncIteration
+        self.delivered += 1
+        return message
+
+    def stats(self) -> dict:
+        return dict(
+            policy=self.policy,
+            queued=len(self._buffer),
+            delivered=self.delivered,
+            dropped=self.dropped,
+            conflated=self.conflated,
+            blocked=self.blocked,
+        )
+
+    async def add(self, channels: Sequence[Channel]):
+        """Subscribe to more channels on the shared connections"""
+        await self.manager._add(self, channels)
+
+    async def remove(self, channels: Sequence[Channel]):
+        """Stop receiving messages of `channels`"""
+        await self.manager._remove(self, [arg_key(arg) for arg in channels])
+
+    async def resubscribe(self, channels: Sequence[Channel]):
+        """Unsubscribe and subscribe `channels` again, e.g. to receive a fresh snapshot of an order book
+
+        Every subscriber of the channels receives the snapshot.
+        """
+        await self.manager._resubscribe([arg_key(arg) for arg in channels])
+
+    async def close(self):
+        """Unsubscribe from every channel and end the stream"""
+        await self.manager.unsubscribe(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class Connection:
+    """A websocket connection carrying the channels of many subscribers
+
+    A reader task receives every frame and routes data by its `arg` to the subscribers of that channel, whose
+    queues buffer it for the consumers. A heartbeat task sends `ping` whenever no frame arrived for
+    `ping_interval` and matches the `pong` seen by the reader, measuring the round trip. A connection that does
+    not answer within `pong_timeout` is closed as dead. Neither depends on how fast the consumers are, except that
+    pongs are not read while the reader waits for a full blocking subscriber, so missing pongs only count once it
+    has waited for `max_blocked`.
+
+    With `reconnect`, a lost connection is reopened after a jittered exponential backoff, logged in again and
+    resubscribed to every channel. Subscribers receive `{"event": "disconnect"}` when it is lost and
+    `{"event": "reconnect", "downtime": seconds}` once it is back, so they can refetch state for the gap.
+    After `max_attempts` failed attempts, or a rejected login, it gives up and the streams it fed raise the error.
+    """
+
+    logger = logging.getLogger("WebsocketConnection")
+    logger.setLevel(logging.DEBUG)
+    # Subscribe, unsubscribe and login requests per connection
+    OPS_PER_HOUR = 480
+    LOGIN_LIMITER = RateLimiter(1, 1)
+    _ids = itertools.count(1)
+
+    def __init__(
+        self,
+        uri,
+        codec: JsonCodec = default_codec,
+        login: Callable[[], Awaitable[str]] = None,
+        ping_interval=25.0,
+        pong_timeout=10.0,
+        reconnect=True,
+        backoff=0.5,
+        max_backoff=30.0,
+        max_attempts: Optional[int] = 20,
+        max_blocked: Optional[float] = 60.0,
+        **ws_kwargs,
+    ):
+        """
+        :param uri: websocket URL
+        :param codec: JSON codec
+        :param login: coroutine function returning the login request of private channels
+        :param ping_interval: seconds without frames before sending `ping`
+        :param pong_timeout: seconds to wait for `pong` before treating the connection as lost
+        :param reconnect: reopen the connection when it is lost, otherwise the streams fed by it end
+        :param backoff: upper bound of the first reconnect delay in seconds, doubled on every failure
+        :param max_backoff: maximum reconnect delay in seconds
+        :param max_attempts: reconnect attempts before giving up, None to retry forever
+        :param max_blocked: seconds waiting for a full blocking subscriber after which a connection without pong is
+            closed as dead, None to never close it while waiting
+        :param ws_kwargs: kwargs for `websockets.connect`
+        """
+        self.id = next(self._ids)
+        self.uri = uri
+        self.codec = codec
+        self.login = login
+        self.ping_interval = ping_interval
+        self.pong_timeout = pong_timeout
+        self.reconnect = reconnect
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.max_blocked = max_blocked
+        self.ws_kwargs = ws_kwargs
+        self.ws: Optional[WebSocketClientProtocol] = None
+        # Arguments subscribed and the subscribers of each
+        self.args: Dict[Key, dict] = {}
+        self.routes: Dict[Key, Set[Subscriber]] = {}
+        self._ops = RateLimiter(self.OPS_PER_HOUR, 3600)
+        self._reader: Optional[asyncio.Task] = None
+        # Since when the reader waits for room in a blocking subscriber, pongs are not read meanwhile
+        self._blocked_since: Optional[float] = None
+        # Set by the heartbeat when it closes the websocket, ending a wait for room
+        self._dead = asyncio.Event()
+        self._closing = False
+        self.connected = False
+        self.received = 0
+        self.malformed = 0
+        self._last_received = 0.0
+        self._pong = asyncio.Event()
+        self.pings = 0
+        self.pong_timeouts = 0
+        self.rtt: Optional[float] = None
+        self._rtt_total = 0.0
+        self._rtt_count = 0
+        self.reconnects = 0
+        self.failures = 0
+        self.downtime = 0.0
+        self.last_error: Optional[str] = None
+
+    def __repr__(self):
+        return f"Connection#{self.id}({self.uri}, {len(self.args)} channels)"
+
+    @property
+    def open(self) -> bool:
+        """Serving its channels, though possibly reconnecting"""
+        return self._reader is not None and not self._reader.done()
+
+    async def connect(self):
+        """Open the websocket, log in if required and start reading
+
+        :raise OkexRequestException: login rejected
+        """
+        await self._connect()
+        self._reader = asyncio.create_task(self._run())
+        self.logger.debug(f"Opened {self}")
+
+    async def _connect(self):
+        self.ws = await connect(self.uri, **self.ws_kwargs)
+        self._last_received = time.monotonic()
+        if self.login:
+            await self._login()
+        self.connected = True
+
+    async def _login(self):
+        request = await self.login()
+        async with self.LOGIN_LIMITER:
+            await self._ops.acquire()
+            await self.ws.send(request)
+        res = self.codec.loads(await asyncio.wait_for(self.ws.recv(), self.ping_interval))
+        if res.get("event") != "login" or res.get("code", "0") != "0":
+            await self.ws.close()
+            raise OkexRequestException(f"Websocket login failed: {res}")
+
+    async def _op(self, op, args: List[dict]):
+        for i in range(0, len(args), ARGS_PER_REQUEST):
+            request = self.codec.dumps({"op": op, "args": args[i : i + ARGS_PER_REQUEST]})
+            await self._ops.acquire()
+            if not self.connected:
+                # Channels are resubscribed on reconnect.
+                return
+            try:
+                await self.ws.send(request)
+            except ConnectionClosed:
+                return
+            self.logger.debug(f"send: {request}")
+
+    async def subscribe(self, args: List[dict]):
+        await self._op("subscribe", args)
+
+    async def unsubscribe(self, args: List[dict]):
+        if self.open:
+            await self._op("unsubscribe", args)
+
+    async def _run(self):
+        error = None
+        try:
+            while True:
+                try:
+                    await self._session()
+                except (ConnectionClosed, OSError) as exc:
+                    self.last_error = repr(exc)
+                    if not self._closing:
+                        self.logger.warning(f"{self} lost: {exc}")
+                self.connected = False
+                if self._closing or not self.reconnect:
+                    break
+                lost = time.monotonic()
+                self._broadcast(
+                    lambda keys: {
+                        "event": "disconnect",
+                        "connection": self.id,
+                        "args": [self.args[key] for key in keys],
+                    }
+                )
+                await self._reopen()
+                downtime = time.monotonic() - lost
+                self.reconnects += 1
+                self.downtime += downtime
+                self.logger.info(f"{self} recovered in {downtime:.3f}s")
+                self._broadcast(
+                    lambda keys: {
+                        "event": "reconnect",
+                        "connection": self.id,
+                        "downtime": downtime,
+                        "args": [self.args[key] for key in keys],
+                    }
+                )
+        except OkexRequestException as exc:
+            error = exc
+            self.last_error = str(exc)
+            self.logger.error(f"{self} gave up: {exc}")
+        finally:
+            self.connected = False
+            self._closed(error)
+
+    async def _reopen(self):
+        """Reconnect, log in and resubscribe until it succeeds, with full jitter exponential backoff
+
+        :raise OkexRequestException: login rejected, or `max_attempts` attempts failed
+        """
+        attempt = 0
+        while self.max_attempts is None or attempt < self.max_attempts:
+            await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt)))
+            attempt += 1
+            try:
+                await self._connect()
+                await self._op("subscribe", list(self.args.values()))
+                return
+            except (OSError, asyncio.TimeoutError, WebSocketException) as exc:
+                self.failures += 1
+                self.last_error = repr(exc)
+                self.logger.debug(f"{self} reconnect #{attempt} failed: {exc!r}")
+        raise OkexRequestException(f"{self} not reconnected after {attempt} attempts: {self.last_error}")
+
+    async def _session(self):
+        """Read until the current websocket closes, with a heartbeat alongside"""
+        self._dead.clear()
+        heartbeat = asyncio.create_task(self._heartbeat(self.ws))
+        try:
+            await self._read()
+        finally:
+            heartbeat.cancel()
+
+    async def _read(self):
+        while True:
+            raw = await self.ws.recv()
+            self._last_received = time.monotonic()
+            if raw == "pong":
+                self._pong.set()
+                continue
+            self.received += 1
+            try:
+                message = self.codec.loads(raw)
+            except ValueError:
+                message = None
+            if not isinstance(message, dict):
+                # A bad frame is skipped rather than ending every stream of the connection.
+                self.malformed += 1
+                self.logger.warning(f"{self} skipped malformed frame: {raw[:200]!r}")
+                continue
+            for subscriber in self._dispatch(message):
+                await self._wait_room(subscriber)
+                subscriber._put(message)
+
+    async def _wait_room(self, subscriber: Subscriber):
+        """Wait for room in a blocking subscriber
+
+        :raise ConnectionClosedError: the heartbeat closed the connection as dead meanwhile
+        """
+        self._blocked_since = time.monotonic()
+        room = asyncio.ensure_future(subscriber._wait())
+        dead = asyncio.ensure_future(self._dead.wait())
+        try:
+            await asyncio.wait((room, dead), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            room.cancel()
+            dead.cancel()
+            self._blocked_since = None
+        if not room.done() or room.cancelled():
+            raise ConnectionClosedError(None, None)
+
+    async def _heartbeat(self, ws: WebSocketClientProtocol):
+        try:
+            while True:
+                idle = time.monotonic() - self._last_received
+                if idle < self.ping_interval:
+                    await asyncio.sleep(self.ping_interval - idle)
+                    continue
+                self._pong.clear()
+                sent = time.monotonic()
+                await ws.send("ping")
+                self.pings += 1
+                try:
+                    await asyncio.wait_for(self._pong.wait(), self.pong_timeout)
+                except asyncio.TimeoutError:
+                    blocked = self._blocked_since
+                    if blocked is not None and (
+                        self.max_blocked is None or time.monotonic() - blocked < self.max_blocked
+                    ):
+                        # The pong may be waiting behind a full subscriber
+                        continue
+                    self.pong_timeouts += 1
+                    self.logger.warning(f"{self} no pong in {self.pong_timeout}s")
+                    # The reader sees the connection closed.
+                    self._dead.set()
+                    await ws.close(1011, "pong timeout")
+                    return
+                self.rtt = time.monotonic() - sent
+                self._rtt_total += self.rtt
+                self._rtt_count += 1
+        except ConnectionClosed:
+            pass
+        except Exception as exc:
+            # Without a heartbeat a dead connection goes unnoticed, so it is closed for the reader to reconnect.
+            self.last_error = repr(exc)
+            self.logger.warning(f"{self} heartbeat failed: {exc!r}")
+            self._dead.set()
+            await ws.close(1011, "heartbeat failed")
+
+    def _dispatch(self, message: dict) -> List[Subscriber]:
+        """Route a message to its subscribers
+
+        :return: blocking subscribers without room for it
+        """
+        event = message.get("event")
+        if event:
+            if event == "error":
+                self.logger.error(f"{self}: {message}")
+            else:
+                self.logger.debug(f"{self}: {message}")
+            return []
+        arg = message.get("arg")
+        if arg is None:
+            return []
+        return [subscriber for subscriber in self.routes.get(arg_key(arg), ()) if not subscriber._put(message)]
+
+    def _broadcast(self, event: Callable[[List[Key]], dict]):
+        """Send every subscriber an event about the channels it receives from this connection"""
+        keys: Dict[Subscriber, List[Key]] = {}
+        for key, subscribers in self.routes.items():
+            for subscriber in subscribers:
+                keys.setdefault(subscriber, []).append(key)
+        for subscriber, subscribed in keys.items():
+            subscriber._put(event(subscribed), force=True)
+
+    def _closed(self, error: Exception = None):
+        # Streams fed by this connection end with it.
+        for subscribers in self.routes.values():
+            for subscriber in subscribers:
+                subscriber._close(error)
+
+    def metrics(self) -> dict:
+        """Heartbeat round trip, reconnects and mean time to recovery, times in seconds"""
+        return dict(
+            connected=self.connected,
+            channels=len(self.args),
+            received=self.received,
+            malformed=self.malformed,
+            pings=self.pings,
+            pong_timeouts=self.pong_timeouts,
+            rtt=self.rtt,
+            rtt_avg=self._rtt_total / self._rtt_count if self._rtt_count else None,
+            reconnects=self.reconnects,
+            failures=self.failures,
+            downtime=self.downtime,
+            mttr=self.downtime / self.reconnects if self.reconnects else 0.0,
+            last_error=self.last_error,
+        )
+
+    async def close(self):
+        self._closing = True
+        if self._reader:
+            self._reader.cancel()
+            await asyncio.wait([self._reader])
+        if self.ws:
+            # Frames still arriving are read, so the closing handshake does not wait behind them.
+            drain = asyncio.create_task(self._drain(self.ws))
+            await self.ws.close()
+            drain.cancel()
+
+    @staticmethod
+    async def _drain(ws: WebSocketClientProtocol):
+        try:
+            async for _ in ws:
+                pass
+        except ConnectionClosed:
+            pass
+
+
+class WebsocketManager:
+    """Packs the channels of many subscribers onto few shared connections to one websocket URL
+
+    A channel subscribed by several subscribers is subscribed once and its frames are fanned out. Channels can be
+    added and removed at runtime without reconnecting.
+
+    Usage:
+        manager = WebsocketManager(WS_PUBLIC_URL)
+        tickers = await manager.subscribe([{"channel": "tickers", "instId": "BTC-USDT"}])
+        await tickers.add([{"channel": "tickers", "instId": "ETH-USDT"}])
+    """
+
+    logger = logging.getLogger("WebsocketManager")
+    logger.setLevel(logging.DEBUG)
+
+    def __init__(
+        self,
+        uri,
+        codec: JsonCodec = default_codec,
+        login: Callable[[], Awaitable[str]] = None,
+        max_channels=100,
+        **connection_kwargs,
+    ):
+        """
+        :param uri: websocket URL
+        :param codec: JSON codec
+        :param login: coroutine function returning the login request of private channels
+        :param max_channels: channels per connection
+        :param connection_kwargs: other kwargs for `Connection`
+        """
+        self.uri = uri
+        self.codec = codec
+        self.login = login
+        self.max_channels = max_channels
+        self.connection_kwargs = connection_kwargs
+        self.connections: List[Connection] = []
+        self._lock = asyncio.Lock()
+
+    def __repr__(self):
+        return f"WebsocketManager({self.uri}, {len(self.connections)} connections)"
+
+    async def subscribe(self, channels: Sequence[Channel], policy: Policy = None, maxsize=10000) -> Subscriber:
+        """New stream of `channels`
+
+        :param policy: block, drop_oldest or conflate when `maxsize` messages are buffered, by default
+            `delivery_policy(channels)`
+        :param maxsize: messages buffered at most
+        """
+        subscriber = Subscriber(self, policy or delivery_policy(channels), maxsize)
+        await self._add(subscriber, channels)
+        return subscriber
+
+    async def unsubscribe(self, subscriber: Subscriber):
+        await self._remove(subscriber, list(subscriber.keys))
+        subscriber._close()
+
+    def _find(self, key: Key) -> Optional[Connection]:
+        for connection in self.connections:
+            if key in connection.args and connection.open:
+                return connection
+
+    async def _room(self) -> Connection:
+        for connection in self.connections:
+            if len(connection.args) < self.max_channels and connection.open:
+                return connection
+        connection = Connection(self.uri, self.codec, self.login, **self.connection_kwargs)
+        await connection.connect()
+        self.connections.append(connection)
+        return connection
+
+    async def _add(self, subscriber: Subscriber, channels: Iterable[Channel]):
+        async with self._lock:
+            # Connections lost are dropped with their streams.
+            self.connections = [connection for connection in self.connections if connection.open]
+            new: Dict[Connection, List[dict]] = {}
+            for arg in channels:
+                key = arg_key(arg)
+                subscriber.keys.add(key)
+                connection = self._find(key)
+                if connection is None:
+                    connection = await self._room()
+                    connection.args[key] = dict(arg)
+                    new.setdefault(connection, []).append(dict(arg))
+                connection.routes.setdefault(key, set()).add(subscriber)
+            for connection, args in new.items():
+                await connection.subscribe(args)
+
+    async def _remove(self, subscriber: Subscriber, keys: Iterable[Key]):
+        async with self._lock:
+            for connection in list(self.connections):
+                dropped = []
+                for key in keys:
+                    subscribers = connection.routes.get(key)
+                    if subscribers is None:
+                        continue
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del connection.routes[key]
+                        dropped.append(connection.args.pop(key))
+                if not connection.args:
+                    self.connections.remove(connection)
+                    await connection.close()
+                elif dropped:
+                    await connection.unsubscribe(dropped)
+            subscriber.keys.difference_update(keys)
+
+    async def _resubscribe(self, keys: Iterable[Key]):
+        async with self._lock:
+            args: Dict[Connection, List[dict]] = {}
+            for key in keys:
+                connection = self._find(key)
+                if connection:
+                    args.setdefault(connection, []).append(connection.args[key])
+            for connection, subscribed in args.items():
+                await connection.unsubscribe(subscribed)
+                await connection.subscribe(subscribed)
+
+    def stats(self) -> dict:
+        """Totals over connections, with the mean time to recovery of all reconnects"""
+        reconnects = sum(connection.reconnects for connection in self.connections)
+        downtime = sum(connection.downtime for connection in self.connections)
+        return dict(
+            connections=len(self.connections),
+            channels=sum(len(connection.args) for connection in self.connections),
+            received=sum(connection.received for connection in self.connections),
+            reconnects=reconnects,
+            mttr=downtime / reconnects if reconnects else 0.0,
+        )
+
+    async def close(self):
+        """Close every connection and end every stream"""
+        async with self._lock:
+            for connection in self.connections:
+                await connection.close()
+            self.connections.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
@@ -1,10 +1,14 @@
 import asyncio
+import functools
+from . import models
 from .client import OkxClient
+from .columnar import CandleBuffer, Columnar, ColumnarResult, candles_to_array
 from .consts import *
 from .exceptions import *
 from .types import *
-from .utils import RateLimiter, query_with_pagination
+from .utils import iter_with_pagination, query_with_pagination
 import logging
+from typing import Union
 
 
 class PublicAPI(OkxClient):
@@ -14,8 +18,6 @@ class PublicAPI(OkxClient):
     def __init__(self, use_server_time=False, test=False, **kwargs):
         super(PublicAPI, self).__init__("", "", "", use_server_time, test, **kwargs)
 
-    GET_INSTRUMENTS_SEMAPHORE = dict()
-
     async def get_instruments(self, instType: InstType, instFamily="") -> List[dict]:
         """获取所有可交易产品的信息列表
 
@@ -29,10 +31,7 @@ class PublicAPI(OkxClient):
         params = dict(instType=instType)
         if instFamily:
             params["instFamily"] = instFamily
-        if instType not in PublicAPI.GET_INSTRUMENTS_SEMAPHORE.keys():
-            PublicAPI.GET_INSTRUMENTS_SEMAPHORE[instType] = RateLimiter(20, 2)
-        async with PublicAPI.GET_INSTRUMENTS_SEMAPHORE[instType]:
-            res = await self._request_with_params(GET, GET_INSTRUMENTS, params)
+        res = await self._request_with_params(GET, GET_INSTRUMENTS, params)
         assert res["code"] == "0", f"{GET_INSTRUMENTS}, msg={res['msg']}"
         return res["data"]
 
@@ -48,15 +47,12 @@ class PublicAPI(OkxClient):
         params = dict(instType=instType, instId=instId)
         if uly:
             params["uly"] = uly
-        if instType not in PublicAPI.GET_INSTRUMENTS_SEMAPHORE.keys():
-            PublicAPI.GET_INSTRUMENTS_SEMAPHORE[instType] = RateLimiter(20, 2)
-        async with PublicAPI.GET_INSTRUMENTS_SEMAPHORE[instType]:
-            res = await self._request_with_params(GET, GET_INSTRUMENTS, params)
+        res = await self._request_with_params(GET, GET_INSTRUMENTS, params)
         if res["code"] == "51001":
             raise OkexRequestException(res["msg"])
         return res["data"][0]
 
-    async def get_funding_time(self, instId: str) -> FundingRateResponse:
+    async def get_funding_time(self, instId: str) -> Union[FundingRateResponse, models.FundingRate]:
         """获取当前资金费率
 
         GET /api/v5/public/funding-rate?instId=BTC-USD-SWAP
@@ -68,11 +64,11 @@ class PublicAPI(OkxClient):
         params = dict(instId=instId)
         res = await self._request_with_params(GET, FUNDING_RATE, params)
         assert res["code"] == "0", f"{FUNDING_RATE}, msg={res['msg']}"
-        return res["data"][0]
+        return self._parse(models.FundingRate, res["data"])[0]
 
     async def get_historical_funding_rate(
         self, instId: str, after="", before="", limit=""
-    ) -> List[FundingRateResponse]:
+    ) -> List[Union[FundingRateResponse, models.FundingRate]]:
         """获取最近3个月的历史资金费率
 
         GET /api/v5/public/funding-rate-history?instId=BTC-USD-SWAP
@@ -87,7 +83,29 @@ class PublicAPI(OkxClient):
         params = dict(instId=instId, after=after, before=before, limit=limit)
         res = await self._request_with_params(GET, FUNDING_RATE_HISTORY, params)
         assert res["code"] == "0", f"{FUNDING_RATE_HISTORY}, msg={res['msg']}"
-        return res["data"]
+        return self._parse(models.FundingRate, res["data"])
+
+    def iter_historical_funding_rate(self, instId: str, after="", prefetch=2, rows=False):
+        """逐页获取历史资金费率，后续页面在后台预取
+
+        Usage:
+            async for page in api.iter_historical_funding_rate("BTC-USDT-SWAP"):
+                ...
+
+        :param instId: 产品ID
+        :param after: 请求此时间戳之前
+        :param prefetch: 预取页数
+        :param rows: 逐条返回
+        """
+        return iter_with_pagination(
+            self.get_historical_funding_rate,
+            tag="fundingTime",
+            page_size=100,
+            prefetch=prefetch,
+            rows=rows,
+            instId=instId,
+            after=after,
+        )
 
     async def get_funding_history(self, instId, count=270):
         """下载最近3个月资金费率"""
@@ -100,9 +118,7 @@ class PublicAPI(OkxClient):
             instId=instId,
         )
 
-    GET_TICKERS_SEMAPHORE = RateLimiter(20, 2)
-
-    async def get_tickers(self, instType: InstType, uly="") -> List[TickerResponse]:
+    async def get_tickers(self, instType: InstType, uly="") -> List[Union[TickerResponse, models.Ticker]]:
         """获取所有产品行情信息
 
         GET /api/v5/market/tickers?instType=SWAP 限速： 20次/2s
@@ -115,14 +131,12 @@ class PublicAPI(OkxClient):
             params["uly"] = uly
         while True:
             try:
-                async with self.GET_TICKERS_SEMAPHORE:
-                    return (await self._request_with_params(GET, GET_TICKERS, params))["data"]
+                res = await self._request_with_params(GET, GET_TICKERS, params)
+                return self._parse(models.Ticker, res["data"])
             except OkexAPIException:
                 await asyncio.sleep(10)
 
-    GET_TICKER_SEMAPHORE = RateLimiter(20, 2)
-
-    async def get_specific_ticker(self, instId: str) -> TickerResponse:
+    async def get_specific_ticker(self, instId: str) -> Union[TickerResponse, models.Ticker]:
         """获取单个产品行情信息
 
         GET /api/v5/market/ticker?instId=BTC-USD-SWAP 限速： 20次/2s
@@ -132,14 +146,44 @@ class PublicAPI(OkxClient):
         params = dict(instId=instId)
         while True:
             try:
-                async with self.GET_TICKER_SEMAPHORE:
-                    return (await self._request_with_params(GET, GET_TICKER, params))["data"][0]
+                res = await self._request_with_params(GET, GET_TICKER, params)
+                return self._parse(models.Ticker, res["data"])[0]
             except OkexAPIException:
                 await asyncio.sleep(10)
 
-    GET_CANDLES_SEMAPHORE = RateLimiter(40, 2)
+    async def _query_candles(self, path, instId: str, bar: Bar, after="", before="", limit="") -> List[List[str]]:
+        """K线原始数据"""
+        params = dict(instId=instId, bar=bar, after=after, before=before, limit=limit)
+        res = await self._request_with_params(GET, path, params)
+        assert res["code"] == "0", f"{path}, msg={res['msg']}"
+        return res["data"]
+
+    async def get_raw_candles(
+        self, instId: str, bar: Bar = "4H", after="", before="", limit="", history=False
+    ) -> List[List[str]]:
+        """获取未解析的K线数据 [ts,o,h,l,c,vol,volCcy,volCcyQuote,confirm]
 
-    async def get_candles(self, instId: str, bar: Bar = "4H", after="", before="", limit="") -> List[Candle]:
+        :param instId: 产品ID
+        :param bar: 时间粒度, [1m/3m/5m/15m/30m/1H/2H/4H/6H/12H/1D/1W/1M/3M/6M/1Y]
+        :param after: 请求此时间戳之前
+        :param before: 请求此时间戳之后
+        :param limit: 分页返回的结果集数量
+        :param history: 从历史K线接口获取
+        """
+        return await self._query_candles(HISTORY_CANDLES if history else GET_CANDLES, instId, bar, after, before, limit)
+
+    def _candle_result(
+        self, data: List[List[str]], columnar: Columnar = None
+    ) -> Union[List[Candle], List[models.Candle], ColumnarResult]:
+        if columnar:
+            return candles_to_array(data, columnar)
+        if self.decode:
+            return self._parse(models.Candle, data)
+        return [Candle(*candle) for candle in data]
+
+    async def get_candles(
+        self, instId: str, bar: Bar = "4H", after="", before="", limit="", columnar: Columnar = None
+    ) -> Union[List[Candle], List[models.Candle], ColumnarResult]:
         """获取K线数据。K线数据按请求的粒度分组返回，K线数据每个粒度最多可获取最近1440条
 
         GET /api/v5/market/candles 限速： 40次/2s
@@ -149,16 +193,14 @@ class PublicAPI(OkxClient):
         :param after: 请求此时间戳之前
         :param before: 请求此时间戳之后
         :param limit: 分页返回的结果集数量，最大为300，不填默认返回100条
+        :param columnar: numpy：返回NumPy结构化数组 columns：返回各列数组的字典
         """
-        params = dict(instId=instId, bar=bar, after=after, before=before, limit=limit)
-        async with self.GET_CANDLES_SEMAPHORE:
-            res = await self._request_with_params(GET, GET_CANDLES, params)
-        assert res["code"] == "0", f"{GET_CANDLES}, msg={res['msg']}"
-        return [Candle(*candle) for candle in res["data"]]
+        data = await self._query_candles(GET_CANDLES, instId, bar, after, before, limit)
+        return self._candle_result(data, columnar)
 
-    HISTORY_CANDLES_SEMAPHORE = RateLimiter(20, 2)
-
-    async def history_candles(self, instId: str, bar: Bar = "4H", after="", before="", limit="") -> List[Candle]:
+    async def history_candles(
+        self, instId: str, bar: Bar = "4H", after="", before="", limit="", columnar: Columnar = None
+    ) -> Union[List[Candle], List[models.Candle], ColumnarResult]:
         """获取最近几年的历史k线数据
 
         GET /api/v5/market/history-candles 限速： 20次/2s
@@ -168,19 +210,66 @@ class PublicAPI(OkxClient):
         :param after: 请求此时间戳之前
         :param before: 请求此时间戳之后
         :param limit: 分页返回的结果集数量，最大为100，不填默认返回100条
+        :param columnar: numpy：返回NumPy结构化数组 columns：返回各列数组的字典
         """
-        params = dict(instId=instId, bar=bar, after=after, before=before, limit=limit)
-        async with self.HISTORY_CANDLES_SEMAPHORE:
-            res = await self._request_with_params(GET, HISTORY_CANDLES, params)
-        assert res["code"] == "0", f"{HISTORY_CANDLES}, msg={res['msg']}"
-        return [Candle(*candle) for candle in res["data"]]
+        data = await self._query_candles(HISTORY_CANDLES, instId, bar, after, before, limit)
+        return self._candle_result(data, columnar)
 
-    async def get_candles_for_days(self, instId: str, days: int, bar: Bar = "4H") -> List[Candle]:
+    def iter_candles(self, instId: str, bar: Bar = "4H", after="", prefetch=2, rows=False):
+        """逐页获取最近1440条K线，后续页面在后台预取
+
+        :param instId: 产品ID
+        :param bar: 时间粒度, [1m/3m/5m/15m/30m/1H/2H/4H/6H/12H/1D/1W/1M/3M/6M/1Y]
+        :param after: 请求此时间戳之前
+        :param prefetch: 预取页数
+        :param rows: 逐条返回
+        """
+        return iter_with_pagination(
+            self.get_candles,
+            tag=0,
+            page_size=300,
+            prefetch=prefetch,
+            rows=rows,
+            instId=instId,
+            bar=bar,
+            after=after,
+            limit=300,
+        )
+
+    def iter_history_candles(self, instId: str, bar: Bar = "4H", after="", prefetch=2, rows=False):
+        """逐页获取历史K线，后续页面在后台预取
+
+        Usage:
+            async for candle in api.iter_history_candles("BTC-USDT-SWAP", "1m", rows=True):
+                ...
+
+        :param instId: 产品ID
+        :param bar: 时间粒度, [1m/3m/5m/15m/30m/1H/2H/4H/6H/12H/1D/1W/1M/3M/6M/1Y]
+        :param after: 请求此时间戳之前
+        :param prefetch: 预取页数
+        :param rows: 逐条返回
+        """
+        return iter_with_pagination(
+            self.history_candles,
+            tag=0,
+            page_size=100,
+            prefetch=prefetch,
+            rows=rows,
+            instId=instId,
+            bar=bar,
+            after=after,
+            limit=100,
+        )
+
+    async def get_candles_for_days(
+        self, instId: str, days: int, bar: Bar = "4H", columnar: Columnar = None
+    ) -> Union[List[Candle], List[models.Candle], ColumnarResult]:
         """获取最近K线
 
         :param instId: 产品ID
         :param days: 最近几天
         :param bar: 时间粒度，默认值1m，如 [1m/3m/5m/15m/30m/1H/2H/4H/6H/12H/1D/1W/1M/3M/6M/1Y]
+        :param columnar: numpy：返回NumPy结构化数组 columns：返回各列数组的字典，分页结果直接写入预分配的数组
         """
         interval = 0
         if bar.endswith("m"):
@@ -200,16 +289,23 @@ class PublicAPI(OkxClient):
         else:
             count = days // 365 + 1
         if count > 1440:
-            return await query_with_pagination(
-                self.history_candles,
+            path, page_size = HISTORY_CANDLES, 100
+        else:
+            path, page_size = GET_CANDLES, 300
+        if columnar:
+            buffer = CandleBuffer(count)
+            await query_with_pagination(
+                functools.partial(self._query_candles, path),
                 tag=0,
-                page_size=100,
+                page_size=page_size,
                 count=count,
                 interval=interval,
+                sink=buffer.write,
                 instId=instId,
                 bar=bar,
             )
-        else:
-            return await query_with_pagination(
-                self.get_candles, tag=0, page_size=300, count=count, interval=interval, instId=instId, bar=bar
-            )
+            return buffer.result(columnar)
+        query_api = self.history_candles if path == HISTORY_CANDLES else self.get_candles
+        return await query_with_pagination(
+            query_api, tag=0, page_size=page_size, count=count, interval=interval, instId=instId, bar=bar
+        )
@@ -0,0 +1,205 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import logging
+import random
+import time
+from typing import Dict, Literal, NamedTuple, Optional
+from .consts import ASSET_TRANSFER, BATCH_ORDER, POST, TRADE_ORDER
+from .exceptions import OkexRetryException
+
+ErrorClass = Literal["network", "server", "busy", "throttle"]
+
+
+class RetryRule(NamedTuple):
+    """Retry rule of an error class
+    :param attempts: retries allowed per call
+    :param base: backoff of the first retry in seconds
+    :param cap: maximum backoff in seconds
+    """
+
+    attempts: int
+    base: float
+    cap: float
+
+
+RETRY_RULES: Dict[str, RetryRule] = {
+    # Connection errors and timeouts
+    "network": RetryRule(5, 0.1, 2.0),
+    # 5xx and Cloudflare errors
+    "server": RetryRule(5, 0.5, 8.0),
+    # 50004 Endpoint request timeout
+    "busy": RetryRule(3, 1.0, 4.0),
+    # 429 or 50011, delayed by the rate limiter of the endpoint if there is one
+    "throttle": RetryRule(20, 0.5, 4.0),
+}
+
+# Requests not resent after an ambiguous failure, since a second copy would take effect again
+NON_IDEMPOTENT = {(POST, TRADE_ORDER), (POST, BATCH_ORDER), (POST, ASSET_TRANSFER)}
+
+# Absolute `time.monotonic()` deadline of the calls in the current context
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+@contextlib.contextmanager
+def deadline(seconds: float):
+    """Give up every request in this context, retries included, after `seconds`
+
+    Nested deadlines never extend an outer one.
+
+    Usage:
+        with deadline(0.3):
+            await trade.take_swap_order(...)
+    """
+    expires = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(expires if outer is None else min(outer, expires))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextlib.contextmanager
+def detached():
+    """Ignore the deadlines of outer contexts, e.g. for a call shared by callers with different deadlines"""
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class RetryBudget:
+    """Token bucket bounding retries to a fraction of requests, shared by all calls of a policy
+
+    Every call deposits `ratio` tokens and every retry withdraws one, so an outage cannot multiply the load by
+    the number of attempts per call.
+    """
+
+    def __init__(self, ratio=0.2, capacity=20.0):
+        """
+        :param ratio: retries allowed per call in the long run
+        :param capacity: retries allowed in a burst
+        """
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = capacity
+        self.exhausted = 0
+
+    def __repr__(self):
+        return f"RetryBudget({self.tokens:.1f}/{self.capacity}, ratio={self.ratio})"
+
+    def deposit(self):
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RetryPolicy:
+    """How API calls retry: per error class rules, full jitter exponential backoff, a shared retry budget and
+    a deadline per call
+    """
+
+    logger = logging.getLogger("RetryPolicy")
+    logger.setLevel(logging.DEBUG)
+
+    def __init__(self, rules: Dict[str, RetryRule] = None, budget: RetryBudget = None, timeout: float = 30.0):
+        """
+        :param rules: rules overriding `RETRY_RULES` by error class
+        :param budget: retry budget, a new one by default
+        :param timeout: seconds a call may take including retries unless `deadline` is tighter, None for no limit
+        """
+        self.rules = {**RETRY_RULES, **(rules or {})}
+        self.budget = budget or RetryBudget()
+        self.timeout = timeout
+
+    def __repr__(self):
+        return f"RetryPolicy(timeout={self.timeout}, {self.budget})"
+
+    def backoff(self, error: ErrorClass, attempt: int) -> float:
+        """Full jitter: uniform between 0 and the exponential backoff of `attempt`"""
+        rule = self.rules[error]
+        return random.uniform(0, min(rule.cap, rule.base * 2**attempt))
+
+    def expires(self) -> Optional[float]:
+        """Absolute `time.monotonic()` deadline of a call starting now, None without one"""
+        expires = _deadline.get()
+        if self.timeout is not None:
+            own = time.monotonic() + self.timeout
+            expires = own if expires is None else min(expires, own)
+        return expires
+
+    def call(self) -> "RetryCall":
+        """Retry state of a new call"""
+        self.budget.deposit()
+        return RetryCall(self, self.expires())
+
+
+class RetryCall:
+    """Attempts and deadline of one call"""
+
+    def __init__(self, policy: RetryPolicy, expires: Optional[float]):
+        self.policy = policy
+        self.expires = expires
+        self.attempts: Dict[str, int] = collections.Counter()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds until the deadline, None without one"""
+        return None if self.expires is None else self.expires - time.monotonic()
+
+    def _give_up(self, reason: str, detail) -> OkexRetryException:
+        return OkexRetryException(f"{reason}: {detail}", reason=reason, attempts=sum(self.attempts.values()) + 1)
+
+    async def bounded(self, aw):
+        """Await `aw` within the deadline
+
+        :raise OkexRetryException: the deadline passed
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return await aw
+        if remaining <= 0:
+            if asyncio.iscoroutine(aw):
+                aw.close()
+            raise self._give_up("deadline", "expired before sending")
+        try:
+            return await asyncio.wait_for(aw, remaining)
+        except asyncio.TimeoutError as exc:
+            if self.remaining() > 0:
+                raise
+            raise self._give_up("deadline", "expired while waiting") from exc
+
+    async def retry(self, error: ErrorClass, detail, delay: float = None):
+        """Sleep before retrying after an error of class `error`
+
+        :param detail: description of the error
+        :param delay: seconds to wait instead of the backoff of the rule, e.g. 0 when the rate limiter delays
+        :raise OkexRetryException: no attempts, budget or time left for a retry
+        """
+        policy = self.policy
+        rule = policy.rules[error]
+        attempt = self.attempts[error]
+        if attempt >= rule.attempts:
+            raise self._give_up(error, detail)
+        if delay is None:
+            delay = policy.backoff(error, attempt)
+        remaining = self.remaining()
+        if remaining is not None and delay >= remaining:
+            raise self._give_up("deadline", detail)
+        if not policy.budget.withdraw():
+            raise self._give_up("budget", detail)
+        self.attempts[error] += 1
+        policy.logger.debug(f"Retry {error} #{attempt + 1} in {delay:.3f}s: {detail}")
+        if delay:
+            await asyncio.sleep(delay)
+
+
+# Used by API clients created without a retry policy
+default_retry = RetryPolicy()
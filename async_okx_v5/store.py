@@ -0,0 +1,203 @@
+import asyncio
+import functools
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+from . import models
+from .columnar import CANDLE_DTYPE, Columnar, np, to_columns, _require_numpy
+from .public import PublicAPI
+from .types import Bar
+
+BAR_UNITS = {"m": 60000, "H": 3600000, "D": 86400000, "W": 604800000}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS candles (
+    instId TEXT NOT NULL,
+    bar TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    o REAL, h REAL, l REAL, c REAL, vol REAL, volCcy REAL, volCcyQuote REAL,
+    PRIMARY KEY (instId, bar, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS coverage (
+    instId TEXT NOT NULL,
+    bar TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS coverage_key ON coverage (instId, bar, start);
+"""
+
+
+def bar_interval(bar: Bar) -> int:
+    """Length of a bar in milliseconds, the same for bars aligned to UTC such as 1Dutc
+
+    :raise ValueError: bars of variable length such as 1M are not supported
+    """
+    if bar.endswith("utc"):
+        bar = bar[:-3]
+    unit = BAR_UNITS.get(bar[-1])
+    if unit is None:
+        raise ValueError(f"Bar of variable length is not supported: {bar}")
+    return int(bar[:-1]) * unit
+
+
+def subtract(start: int, end: int, ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Parts of `[start, end)` not covered by sorted, disjoint `ranges`"""
+    missing = []
+    cursor = start
+    for a, b in ranges:
+        if b <= cursor:
+            continue
+        if a >= end:
+            break
+        if a > cursor:
+            missing.append((cursor, a))
+        cursor = max(cursor, b)
+    if cursor < end:
+        missing.append((cursor, end))
+    return missing
+
+
+class CandleStore:
+    """Incremental on-disk store of confirmed candles keyed by (instId, bar)
+
+    Confirmed candles never change, so the store records which time ranges it holds and `sync` only downloads
+    the missing ones. Time ranges are half-open `[start, end)` in milliseconds.
+
+    The coroutines run queries on a thread of their own, so the event loop is not blocked by the disk.
+
+    Usage:
+        store = CandleStore("candles.db")
+        candles = await store.get("BTC-USDT-SWAP", "1m", start, end, columnar="numpy")
+    """
+
+    logger = logging.getLogger("CandleStore")
+    logger.setLevel(logging.DEBUG)
+
+    def __init__(self, path=":memory:", api: PublicAPI = None):
+        """
+        :param path: SQLite database file
+        :param api: client used to download candles
+        """
+        self.path = path
+        self.api = api or PublicAPI()
+        # Used by one thread at a time, the executor's or the caller's
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self._locks = {}
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="CandleStore")
+
+    def __repr__(self):
+        return f"CandleStore({self.path})"
+
+    def close(self):
+        self._executor.shutdown()
+        self.db.close()
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args))
+
+    def coverage(self, instId: str, bar: Bar) -> List[Tuple[int, int]]:
+        """Time ranges held for (instId, bar)"""
+        cursor = self.db.execute(
+            "SELECT start, end FROM coverage WHERE instId = ? AND bar = ? ORDER BY start", (instId, bar)
+        )
+        return cursor.fetchall()
+
+    def missing(self, instId: str, bar: Bar, start: int, end: int) -> List[Tuple[int, int]]:
+        """Time ranges within `[start, end)` not held yet"""
+        return subtract(start, end, self.coverage(instId, bar))
+
+    def _add_coverage(self, instId: str, bar: Bar, start: int, end: int):
+        # Merge with overlapping or adjacent ranges
+        ranges = self.coverage(instId, bar)
+        merged = []
+        for a, b in ranges:
+            if b < start or a > end:
+                merged.append((a, b))
+            else:
+                start, end = min(start, a), max(end, b)
+        merged.append((start, end))
+        with self.db:
+            self.db.execute("DELETE FROM coverage WHERE instId = ? AND bar = ?", (instId, bar))
+            self.db.executemany(
+                "INSERT INTO coverage VALUES (?, ?, ?, ?)", [(instId, bar, a, b) for a, b in sorted(merged)]
+            )
+
+    def _insert(self, instId: str, bar: Bar, rows: List[List[str]]):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(instId, bar, int(row[0]), *map(float, row[1:8])) for row in rows if row[8] == "1"],
+            )
+
+    async def _download(self, instId: str, bar: Bar, start: int, end: int):
+        """Download candles in `[start, end)` from newest to oldest and record the confirmed part as covered"""
+        interval = bar_interval(bar)
+        recent = time.time() * 1000 - 1440 * interval
+        after = end
+        covered_end = end
+        while after > start:
+            # Recent candles come 300 at a time and under a higher rate limit
+            history = after - interval <= recent
+            limit = 100 if history else 300
+            rows = await self.api.get_raw_candles(instId, bar, after, start - 1, limit, history)
+            if not rows:
+                break
+            await self._run(self._insert, instId, bar, rows)
+            for row in rows:
+                if row[8] != "1":
+                    covered_end = min(covered_end, int(row[0]))
+            after = int(rows[-1][0])
+        if covered_end > start:
+            await self._run(self._add_coverage, instId, bar, start, covered_end)
+
+    async def sync(self, instId: str, bar: Bar, start: int, end: int = None) -> int:
+        """Download the missing ranges of `[start, end)`
+
+        :param instId: 产品ID
+        :param bar: 时间粒度, [1m/3m/5m/15m/30m/1H/2H/4H/6H/12H/1D/1W]
+        :param start: 开始时间，Unix时间戳的毫秒数
+        :param end: 结束时间，Unix时间戳的毫秒数，默认为当前时间
+        :return: number of ranges downloaded
+        """
+        interval = bar_interval(bar)
+        now = int(time.time() * 1000)
+        end = min(end or now, now // interval * interval)
+        start = start // interval * interval
+        key = (instId, bar)
+        if key not in self._locks:
+            self._locks[key] = asyncio.Lock()
+        async with self._locks[key]:
+            missing = await self._run(self.missing, instId, bar, start, end)
+            if missing:
+                self.logger.debug(f"{instId} {bar} missing {missing}")
+                await asyncio.gather(*(self._download(instId, bar, a, b) for a, b in missing))
+        return len(missing)
+
+    def read(self, instId: str, bar: Bar, start: int, end: int = None, columnar: Columnar = None):
+        """Stored candles in `[start, end)` in ascending time order
+
+        :param columnar: numpy：返回NumPy结构化数组 columns：返回各列数组的字典
+        :return: List[models.Candle], or columns
+        """
+        cursor = self.db.execute(
+            "SELECT ts, o, h, l, c, vol, volCcy, volCcyQuote, 1 FROM candles "
+            "WHERE instId = ? AND bar = ? AND ts >= ? AND ts < ? ORDER BY ts",
+            (instId, bar, start, end or 2**62),
+        )
+        if columnar:
+            _require_numpy()
+            # Rows are decoded by SQLite straight into the array without an intermediate list
+            array = np.fromiter(cursor, dtype=CANDLE_DTYPE)
+            return to_columns(array) if columnar == "columns" else array
+        return [models.Candle(*row[:8], True) for row in cursor]
+
+    async def get(self, instId: str, bar: Bar, start: int, end: int = None, columnar: Columnar = None):
+        """Sync then read `[start, end)`"""
+        await self.sync(instId, bar, start, end)
+        return await self._run(self.read, instId, bar, start, end, columnar)
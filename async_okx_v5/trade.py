@@ -1,19 +1,269 @@
 from .client import OkxClient
 from .consts import *
+from .exceptions import OkexAmbiguousException, OkexAPIException, OkexException
 from .types import *
-from .utils import RateLimiter
-import logging
+from .utils import MicroBatcher, client_order_id, iter_with_pagination
 import asyncio
+import itertools
+import logging
+from decimal import Decimal
+from typing import AsyncIterator, Callable, Hashable, Iterable, Iterator, Tuple
+
+# Order does not exist
+ORDER_NOT_EXIST = "51603"
+# Duplicated client order ID
+DUPLICATE_CLORDID = "51016"
+# sCode of orders whose request failed after it may have reached the exchange, their state is unknown
+STATE_UNKNOWN = "-2"
+
+
+# Orders per batch request
+BATCH_SIZE = 20
+
+
+def _validate_order(order: dict) -> dict:
+    for key in ("instId", "tdMode", "side", "ordType", "sz"):
+        assert key in order, f"{key} missing in {order}"
+    # Assigned before sending so that failed orders can be identified
+    return order if order.get("clOrdId") else dict(order, clOrdId=client_order_id())
+
+
+def _validate_cancel(order: dict) -> dict:
+    assert "instId" in order
+    assert "ordId" in order or "clOrdId" in order
+    return order
+
+
+def _chunks(orders: Iterable[dict], group: Callable[[dict], Hashable] = None) -> Iterator[List[dict]]:
+    """Chunks of at most BATCH_SIZE orders
+
+    :param group: orders of the same group, e.g. instrument, stay in one chunk unless the group alone is too large
+    """
+    if group is None:
+        orders = iter(orders)
+        while chunk := list(itertools.islice(orders, BATCH_SIZE)):
+            yield chunk
+        return
+    groups: Dict[Hashable, List[dict]] = {}
+    for order in orders:
+        groups.setdefault(group(order), []).append(order)
+    chunk = []
+    for members in groups.values():
+        if len(chunk) + len(members) > BATCH_SIZE and chunk:
+            yield chunk
+            chunk = []
+        while len(members) > BATCH_SIZE:
+            yield members[:BATCH_SIZE]
+            members = members[BATCH_SIZE:]
+        chunk.extend(members)
+    if chunk:
+        yield chunk
+
+
+def _validate_amend(order: dict) -> dict:
+    assert "instId" in order
+    assert "ordId" in order or "clOrdId" in order
+    assert "newSz" in order or "newPx" in order
+    return order
+
+
+def _instrument(order: dict) -> str:
+    return order["instId"]
+
+
+def _price(order: dict) -> Decimal:
+    return Decimal(str(order["px"]))
+
+
+def _size(order: dict) -> Decimal:
+    return Decimal(str(order["sz"]))
+
+
+def _order_key(order: dict) -> Tuple[str, str]:
+    """Key of an order in a batch request, by order ID if the request has one
+
+    Results carry both IDs, and orders placed by this client always have a client order ID, so a cancel or
+    amend by order ID must not be matched by client order ID.
+    """
+    if order.get("ordId"):
+        return "ordId", order["ordId"]
+    return "clOrdId", order.get("clOrdId", "")
+
+
+def _failure(order: dict, code, msg) -> dict:
+    """Result of an order that failed with its whole request"""
+    return dict(clOrdId=order.get("clOrdId", ""), ordId=order.get("ordId", ""), tag="", sCode=code, sMsg=msg)
 
 
 class TradeAPI(OkxClient):
     logger = logging.getLogger("TradeAPI")
     logger.setLevel(logging.DEBUG)
+    # Submissions of an order after ambiguous failures
+    SUBMIT_ATTEMPTS = 3
 
-    def __init__(self, api_key, api_secret_key, passphrase, use_server_time=False, test=False, **kwargs):
+    def __init__(
+        self, api_key, api_secret_key, passphrase, use_server_time=False, test=False, order_window=0.0, **kwargs
+    ):
+        """
+        :param order_window: seconds to collect concurrent single orders into one batch order of up to 20, 0 to send
+            each on its own. Reduce only orders are never delayed.
+        """
         super(TradeAPI, self).__init__(api_key, api_secret_key, passphrase, use_server_time, test, **kwargs)
+        self.order_window = order_window
+        if order_window:
+            self._order_batcher = MicroBatcher(self._send_orders, BATCH_SIZE, order_window)
+
+    async def _lookup_order(self, instId, clOrdId="", priority=None, ordId="") -> Optional[dict]:
+        """Order by client order ID or order ID, None if the exchange does not have it"""
+        params = dict(instId=instId, ordId=ordId) if ordId else dict(instId=instId, clOrdId=clOrdId)
+        try:
+            res = await self._request(GET, TRADE_ORDER, params, priority)
+        except OkexAPIException as exc:
+            if exc.code == ORDER_NOT_EXIST:
+                return None
+            raise
+        if res["code"] == ORDER_NOT_EXIST or (res["code"] == "0" and not res["data"]):
+            return None
+        if res["code"] != "0":
+            raise OkexAPIException(200, res)
+        return res["data"][0]
 
-    SPOT_MARGIN_SEMAPHORE = RateLimiter(60, 2)
+    async def _submit(self, request_path, orders: List[dict]) -> dict:
+        """Submit orders at most once each, however often they are retried
+
+        Orders without `clOrdId` are given one. After an ambiguous failure every order is looked up by `clOrdId`
+        and only the ones the exchange does not have are submitted again.
+
+        :param request_path: TRADE_ORDER for one order or BATCH_ORDER
+        :return: response of the exchange, or one assembled from submissions and lookups
+        """
+        orders = [order if order.get("clOrdId") else dict(order, clOrdId=client_order_id()) for order in orders]
+        priority = self.limits.priority(POST, request_path, orders)
+        results: Dict[str, dict] = {}
+        pending = orders
+        error = None
+        for attempt in range(self.SUBMIT_ATTEMPTS):
+            body = pending[0] if request_path == TRADE_ORDER else pending
+            try:
+                res = await self._request(POST, request_path, body, priority)
+            except OkexAmbiguousException as exc:
+                self.logger.debug(f"Checking {len(pending)} orders after {exc}")
+                error = exc
+                try:
+                    found = await asyncio.gather(
+                        *(self._lookup_order(order["instId"], order["clOrdId"], priority) for order in pending)
+                    )
+                except OkexException:
+                    # State of the orders stays unknown
+                    raise exc
+                for order, info in zip(pending, found):
+                    if info:
+                        results[order["clOrdId"]] = dict(
+                            clOrdId=info["clOrdId"], ordId=info["ordId"], tag=info.get("tag", ""), sCode="0", sMsg=""
+                        )
+            else:
+                if attempt == 0 and len(res["data"]) == len(orders):
+                    return res
+                items = {item.get("clOrdId"): item for item in res["data"]}
+                for order in pending:
+                    item = items.get(order["clOrdId"], dict(clOrdId=order["clOrdId"], ordId="", sCode=res["code"]))
+                    item.setdefault("sMsg", res["msg"])
+                    if attempt and item["sCode"] == DUPLICATE_CLORDID:
+                        # Accepted by an earlier attempt
+                        info = await self._lookup_order(order["instId"], order["clOrdId"], priority)
+                        if info:
+                            item = dict(clOrdId=info["clOrdId"], ordId=info["ordId"], tag="", sCode="0", sMsg="")
+                    results[order["clOrdId"]] = item
+            pending = [order for order in orders if order["clOrdId"] not in results]
+            if not pending:
+                break
+        else:
+            raise error
+        data = [results[order["clOrdId"]] for order in orders]
+        failed = sum(1 for item in data if item["sCode"] != "0")
+        code = "0" if not failed else "1" if failed == len(data) else "2"
+        return dict(code=code, msg="", data=data)
+
+    @staticmethod
+    def _applied(request_path, order: dict, info: Optional[dict]) -> bool:
+        """Whether the state of an order shows that a cancel or amend of it took effect"""
+        if info is None:
+            return False
+        if request_path == BATCH_CANCEL:
+            return info["state"] in ("canceled", "mmp_canceled")
+        if info["state"] not in ("live", "partially_filled"):
+            return False
+        if "newPx" in order and Decimal(str(info["px"])) != Decimal(str(order["newPx"])):
+            return False
+        return "newSz" not in order or Decimal(str(info["sz"])) == Decimal(str(order["newSz"]))
+
+    async def _modify(self, request_path, orders: List[dict]) -> dict:
+        """Send a batch cancel or amend, resending it after ambiguous failures
+
+        Resending is harmless, but a resent request fails for the orders an earlier attempt already cancelled or
+        amended, so after a resend those failures are checked against the state of each order.
+
+        :param request_path: BATCH_CANCEL or BATCH_AMEND
+        :return: response of the exchange, with the orders found cancelled or amended as successes
+        """
+        priority = self.limits.priority(POST, request_path, orders)
+        for attempt in range(self.SUBMIT_ATTEMPTS):
+            try:
+                res = await self._request(POST, request_path, orders, priority, idempotent=False)
+                break
+            except OkexAmbiguousException as exc:
+                self.logger.debug(f"Resending {len(orders)} orders after {exc}")
+                error = exc
+        else:
+            raise error
+        data = res["data"]
+        if attempt == 0 or len(data) != len(orders):
+            return res
+        failed = [(i, order) for i, (order, item) in enumerate(zip(orders, data)) if item.get("sCode") != "0"]
+        found = await asyncio.gather(
+            *(
+                self._lookup_order(order["instId"], order.get("clOrdId", ""), priority, order.get("ordId", ""))
+                for _, order in failed
+            )
+        )
+        data = list(data)
+        for (i, order), info in zip(failed, found):
+            if self._applied(request_path, order, info):
+                # Done by an earlier attempt
+                data[i] = dict(data[i], ordId=info["ordId"], clOrdId=info["clOrdId"], sCode="0", sMsg="")
+        failures = sum(1 for item in data if item["sCode"] != "0")
+        code = "0" if not failures else "1" if failures == len(data) else "2"
+        return dict(code=code, msg=res["msg"] if failures else "", data=data)
+
+    async def _send_orders(self, keys: List[tuple]) -> Dict[tuple, dict]:
+        # Keys are the items of each order
+        res = await self._submit(BATCH_ORDER, [dict(key) for key in keys])
+        items = {item.get("clOrdId"): item for item in res["data"]}
+        results = {}
+        for key in keys:
+            clOrdId = dict(key)["clOrdId"]
+            results[key] = items.get(clOrdId) or dict(clOrdId=clOrdId, ordId="", sCode=res["code"], sMsg=res["msg"])
+        return results
+
+    async def _place_order(self, params: dict) -> dict:
+        """Submit one order, through a batch order if `order_window` is set
+
+        Success is judged by the `sCode` of the order rather than the `code` of the response, which describes a
+        whole batch. For a request of one order both are "0" together, so results are the same as before.
+
+        :return: result of the order, ordId is "-1" if it failed
+        """
+        if self.order_window and not params.get("reduceOnly"):
+            if not params.get("clOrdId"):
+                params["clOrdId"] = client_order_id()
+            order = await self._order_batcher.get(tuple(params.items()))
+        else:
+            res = await self._submit(TRADE_ORDER, [params])
+            order = res["data"][0]
+        if order["sCode"] == "0":
+            return order
+        else:
+            return dict(ordId="-1", code=order["sCode"], msg=order["sMsg"])
 
     async def take_spot_order(self, instId, side, order_type, size, price="", tgtCcy="", client_oid="") -> dict:
         """币币下单
@@ -29,7 +279,7 @@ class TradeAPI(OkxClient):
         :param size: 委托数量
         :param price: 委托价格
         :param tgtCcy: 市价单委托数量的类型 base_ccy: 交易货币 ；quote_ccy：计价货币
-        :param client_oid: 客户自定义订单ID
+        :param client_oid: 客户自定义订单ID，默认自动生成
         """
         params = dict(
             instId=instId,
@@ -41,13 +291,7 @@ class TradeAPI(OkxClient):
             tgtCcy=tgtCcy,
             clOrdId=client_oid,
         )
-        async with self.SPOT_MARGIN_SEMAPHORE:
-            res = await self._request_with_params(POST, TRADE_ORDER, params)
-        order = res["data"][0]
-        if res["code"] == "0":
-            return order
-        else:
-            return dict(ordId="-1", code=order["sCode"], msg=order["sMsg"])
+        return await self._place_order(params)
 
     async def take_margin_order(
         self, instId, side, order_type, size, price="", client_oid="", reduceOnly=False
@@ -64,7 +308,7 @@ class TradeAPI(OkxClient):
         :param order_type: market：市价单 limit：限价单 post_only：只做maker单 fok：全部成交或立即取消 ioc：立即成交并取消剩余
         :param size: 委托数量
         :param price: 委托价格
-        :param client_oid: 客户自定义订单ID
+        :param client_oid: 客户自定义订单ID，默认自动生成
         :param reduceOnly: 只减仓
         """
         params = dict(
@@ -78,15 +322,7 @@ class TradeAPI(OkxClient):
             clOrdId=client_oid,
             reduceOnly=reduceOnly,
         )
-        async with self.SPOT_MARGIN_SEMAPHORE:
-            res = await self._request_with_params(POST, TRADE_ORDER, params)
-        order = res["data"][0]
-        if res["code"] == "0":
-            return order
-        else:
-            return dict(ordId="-1", code=order["sCode"], msg=order["sMsg"])
-
-    DERIVATIVE_SEMAPHORE = RateLimiter(60, 2)
+        return await self._place_order(params)
 
     async def take_swap_order(self, instId, side, order_type, size, price="", client_oid="", reduceOnly=False) -> dict:
         """合约下单
@@ -101,7 +337,7 @@ class TradeAPI(OkxClient):
         :param order_type: market：市价单 limit：限价单 post_only：只做maker单 fok：全部成交或立即取消 ioc：立即成交并取消剩余
         :param size: 委托数量
         :param price: 委托价格
-        :param client_oid: 客户自定义订单ID
+        :param client_oid: 客户自定义订单ID，默认自动生成
         :param reduceOnly: 只减仓
         """
         params = dict(
@@ -115,20 +351,88 @@ class TradeAPI(OkxClient):
             clOrdId=client_oid,
             reduceOnly=reduceOnly,
         )
-        async with self.DERIVATIVE_SEMAPHORE:
-            res = await self._request_with_params(POST, TRADE_ORDER, params)
-        order = res["data"][0]
-        if res["code"] == "0":
-            return order
-        else:
-            return dict(ordId="-1", code=order["sCode"], msg=order["sMsg"])
+        return await self._place_order(params)
+
+    async def _send_chunk(self, request_path, chunk: List[dict]) -> List[dict]:
+        """Send a chunk of a batch request and return the result of each order, failures included
+
+        Orders of a request that failed after it may have reached the exchange get sCode STATE_UNKNOWN.
+        """
+        try:
+            if request_path == BATCH_ORDER:
+                res = await self._submit(BATCH_ORDER, chunk)
+            else:
+                res = await self._modify(request_path, chunk)
+        except OkexAmbiguousException as exc:
+            self.logger.warning(f"{request_path}, state of {len(chunk)} orders unknown: {exc}")
+            return [_failure(order, STATE_UNKNOWN, exc.message) for order in chunk]
+        except OkexException as exc:
+            self.logger.warning(f"{request_path}, {len(chunk)} orders failed: {exc}")
+            code = getattr(exc, "code", "-1")
+            return [_failure(order, code, getattr(exc, "message", str(exc))) for order in chunk]
+        data = res["data"]
+        if len(data) == len(chunk):
+            return data
+        items = {}
+        for item in data:
+            for field in ("ordId", "clOrdId"):
+                if item.get(field):
+                    items[field, item[field]] = item
+        return [items.get(_order_key(order)) or _failure(order, res["code"], res["msg"]) for order in chunk]
+
+    async def _iter_chunks(
+        self, request_path, chunks: Iterable[List[dict]], concurrency: int
+    ) -> AsyncIterator[Tuple[List[dict], List[dict]]]:
+        """Send chunks of orders with at most `concurrency` chunks in flight
+
+        A chunk is only sent once a slot is free, so it is throttled by the rate limiter when it is actually sent.
+
+        :return: (chunk, results of its orders) as chunks complete
+        """
+        in_flight = {}
+        chunks = iter(chunks)
+        try:
+            while True:
+                while len(in_flight) < concurrency:
+                    chunk = next(chunks, None)
+                    if not chunk:
+                        break
+                    task = asyncio.create_task(self._send_chunk(request_path, chunk))
+                    in_flight[task] = chunk
+                if not in_flight:
+                    break
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield in_flight.pop(task), task.result()
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    async def iter_batch_order(self, orders: Iterable[dict], concurrency=4) -> AsyncIterator[dict]:
+        """批量下单，订单数量不限，每20个一批发送，逐个返回每个订单的结果
+
+        POST /api/v5/trade/batch-orders 限速： 300个/2s
+
+        Usage:
+            async for order in api.iter_batch_order(orders):
+                if order["sCode"] != "0":
+                    ...
+
+        :param orders: 订单参数，同 batch_order
+        :param concurrency: 同时发送的批次数
+        :return: 每个订单的 clOrdId, ordId, sCode, sMsg，按批次完成顺序返回
+        """
+        async for _, results in self._iter_chunks(BATCH_ORDER, _chunks(map(_validate_order, orders)), concurrency):
+            for result in results:
+                yield result
 
-    BATCH_ORDER_SEMAPHORE = RateLimiter(15, 2)
+    async def batch_order(self, orders: List[dict], concurrency=4) -> List[dict]:
+        """批量下单，订单数量不限，每20个一批发送。请求参数应该按数组格式传递。
 
-    async def batch_order(self, orders: List[dict]) -> List[dict]:
-        """每次最多可以批量提交20个新订单。请求参数应该按数组格式传递。
+        POST /api/v5/trade/batch-orders 限速： 300个/2s
 
-        POST /api/v5/trade/batch-orders 限速： 300次/2s
+        :param concurrency: 同时发送的批次数
+        :return: 每个订单的结果，顺序同 orders，失败的订单 sCode 不为 "0"，为 "-2" 时订单状态未知
         """
         # :param instId: 产品ID
         # :param tdMode: 交易模式 保证金模式：isolated：逐仓 ；cross：全仓 非保证金模式：cash：非保证金
@@ -137,40 +441,18 @@ class TradeAPI(OkxClient):
         # :param sz: 委托数量
         # :param px: 委托价格
         # :param tgtCcy: 市价单委托数量的类型 base_ccy: 交易货币 ；quote_ccy：计价货币
-        # :param clOrdId: 客户自定义订单ID
+        # :param clOrdId: 客户自定义订单ID，默认自动生成
         # :param reduceOnly: 只减仓
-        for order in orders:
-            assert "instId" in order
-            assert "tdMode" in order
-            assert "side" in order
-            assert "ordType" in order
-            assert "sz" in order
-        n = len(orders) // 20 + 1
-        batches = []
-        for i in range(n):
-            if i < n - 1:
-                batch = self._request_with_params(POST, BATCH_ORDER, orders[i * 20 : (i + 1) * 20])
-            else:
-                if i * 20 < len(orders):
-                    batch = self._request_with_params(POST, BATCH_ORDER, orders[i * 20 :])
-                else:
-                    break
-            batches.append(batch)
-        tasks = []
-        for batch in batches:
-            async with self.BATCH_ORDER_SEMAPHORE:
-                tasks.append(asyncio.create_task(batch))
-        orders = []
-        for task in tasks:
-            batch = await task
-            assert batch["code"] == "0", f"{BATCH_ORDER}, msg={batch['msg']}"
-            # if batch['code'] != '0':
-            #     for order in batch['data']:
-            #         print(order)
-            orders.extend(batch["data"])
-        return orders
-
-    ORDER_INFO_SEMAPHORE = RateLimiter(60, 2)
+        return await self._collect(BATCH_ORDER, [_validate_order(order) for order in orders], concurrency)
+
+    async def _collect(self, request_path, orders: List[dict], concurrency: int, group=None) -> List[dict]:
+        """Results of a batch request in the order of `orders`"""
+        index = {id(order): i for i, order in enumerate(orders)}
+        results = [None] * len(orders)
+        async for chunk, chunk_results in self._iter_chunks(request_path, _chunks(orders, group), concurrency):
+            for order, result in zip(chunk, chunk_results):
+                results[index[id(order)]] = result
+        return results
 
     async def get_order_info(self, instId, order_id="", client_oid="") -> dict:
         """获取订单信息
@@ -183,13 +465,10 @@ class TradeAPI(OkxClient):
         """
         assert order_id or client_oid
         params = dict(ordId=order_id, instId=instId) if order_id else dict(clOrdId=client_oid, instId=instId)
-        async with self.ORDER_INFO_SEMAPHORE:
-            res = await self._request_with_params(GET, TRADE_ORDER, params)
+        res = await self._request_with_params(GET, TRADE_ORDER, params)
         assert res["code"] == "0", f"{TRADE_ORDER}, msg={res['msg']}"
         return res["data"][0]
 
-    CANCEL_ORDER_SEMAPHORE = RateLimiter(60, 2)
-
     async def cancel_order(self, instId, order_id="", client_oid="") -> dict:
         """撤销之前下的未完成订单
 
@@ -201,48 +480,203 @@ class TradeAPI(OkxClient):
         """
         assert order_id or client_oid
         params = dict(ordId=order_id, instId=instId) if order_id else dict(clOrdId=client_oid, instId=instId)
-        async with self.CANCEL_ORDER_SEMAPHORE:
-            res = await self._request_with_params(POST, CANCEL_ORDER, params)
+        res = await self._request_with_params(POST, CANCEL_ORDER, params)
         order = res["data"][0]
         if res["code"] == "0":
             return order
         else:
             return dict(ordId="-1", code=order["sCode"], msg=order["sMsg"])
 
-    BATCH_CANCEL_SEMAPHORE = RateLimiter(15, 2)
+    async def amend_order(
+        self, instId, order_id="", client_oid="", newSz="", newPx="", cxlOnFail=False, reqId=""
+    ) -> dict:
+        """修改当前未成交的挂单
 
-    async def batch_cancel(self, orders: List[dict]) -> List[dict]:
-        """撤销未完成的订单，每次最多可以撤销20个订单。请求参数应该按数组格式传递。
+        POST /api/v5/trade/amend-order 限速： 60次/2s
 
-        POST /api/v5/trade/cancel-batch-orders 限速： 300次/2s
+        :param instId: 产品ID
+        :param order_id: 订单ID
+        :param client_oid: 用户自定义ID
+        :param newSz: 修改的新数量，包含已成交数量
+        :param newPx: 修改的新价格
+        :param cxlOnFail: 修改失败时是否自动撤单
+        :param reqId: 用户自定义修改事件ID
         """
-        assert len(orders) <= 300
-        for order in orders:
-            assert "instId" in order
-            assert "ordId" in order or "clOrdId" in order
-        n = len(orders) // 20 + 1
-        batches = []
-        for i in range(n):
-            if i < n - 1:
-                batch = self._request_with_params(POST, BATCH_CANCEL, orders[i * 20 : (i + 1) * 20])
-            else:
-                if i * 20 < len(orders):
-                    batch = self._request_with_params(POST, BATCH_CANCEL, orders[i * 20 :])
+        assert order_id or client_oid
+        assert newSz or newPx
+        params = dict(instId=instId, cxlOnFail=cxlOnFail)
+        params.update(dict(ordId=order_id) if order_id else dict(clOrdId=client_oid))
+        if newSz:
+            params["newSz"] = newSz
+        if newPx:
+            params["newPx"] = newPx
+        if reqId:
+            params["reqId"] = reqId
+        res = await self._request_with_params(POST, AMEND_ORDER, params)
+        order = res["data"][0]
+        if res["code"] == "0":
+            return order
+        else:
+            return dict(ordId="-1", code=order["sCode"], msg=order["sMsg"])
+
+    async def iter_batch_cancel(self, orders: Iterable[dict], concurrency=4) -> AsyncIterator[dict]:
+        """批量撤单，订单数量不限，每20个一批发送，逐个返回每个订单的结果
+
+        POST /api/v5/trade/cancel-batch-orders 限速： 300个/2s
+
+        :param orders: 订单，包含 instId 和 ordId 或 clOrdId
+        :param concurrency: 同时发送的批次数
+        :return: 每个订单的 clOrdId, ordId, sCode, sMsg，按批次完成顺序返回
+        """
+        async for _, results in self._iter_chunks(BATCH_CANCEL, _chunks(map(_validate_cancel, orders)), concurrency):
+            for result in results:
+                yield result
+
+    async def batch_cancel(self, orders: List[dict], concurrency=4) -> List[dict]:
+        """撤销未完成的订单，订单数量不限，每20个一批发送。请求参数应该按数组格式传递。
+
+        POST /api/v5/trade/cancel-batch-orders 限速： 300个/2s
+
+        :param concurrency: 同时发送的批次数
+        :return: 每个订单的结果，顺序同 orders，失败的订单 sCode 不为 "0"，为 "-2" 时订单状态未知
+        """
+        return await self._collect(BATCH_CANCEL, [_validate_cancel(order) for order in orders], concurrency)
+
+    async def iter_batch_amend(self, orders: Iterable[dict], concurrency=4) -> AsyncIterator[dict]:
+        """批量修改订单，订单数量不限，每20个一批发送，同一产品的订单尽量在同一批中，逐个返回每个订单的结果
+
+        POST /api/v5/trade/amend-batch-orders 限速： 300个/2s
+
+        :param orders: 订单，包含 instId、ordId 或 clOrdId，以及 newSz 或 newPx
+        :param concurrency: 同时发送的批次数
+        :return: 每个订单的 clOrdId, ordId, reqId, sCode, sMsg，按批次完成顺序返回
+        """
+        chunks = _chunks([_validate_amend(order) for order in orders], group=_instrument)
+        async for _, results in self._iter_chunks(BATCH_AMEND, chunks, concurrency):
+            for result in results:
+                yield result
+
+    async def batch_amend(self, orders: List[dict], concurrency=4) -> List[dict]:
+        """批量修改订单，订单数量不限，每20个一批发送，同一产品的订单尽量在同一批中
+
+        POST /api/v5/trade/amend-batch-orders 限速： 300个/2s
+
+        :param concurrency: 同时发送的批次数
+        :return: 每个订单的结果，顺序同 orders，失败的订单 sCode 不为 "0"，为 "-2" 时订单状态未知
+        """
+        # :param instId: 产品ID
+        # :param ordId: 订单ID
+        # :param clOrdId: 用户自定义ID
+        # :param newSz: 修改的新数量，包含已成交数量
+        # :param newPx: 修改的新价格
+        # :param cxlOnFail: 修改失败时是否自动撤单
+        # :param reqId: 用户自定义修改事件ID
+        orders = [_validate_amend(order) for order in orders]
+        return await self._collect(BATCH_AMEND, orders, concurrency, group=_instrument)
+
+    async def requote(
+        self, instId, quotes: List[dict], live: List[dict] = None, tdMode="cash", ordType="limit", concurrency=4
+    ) -> Dict[str, List[dict]]:
+        """以最少的修改、撤单和下单把一个产品的挂单调整为目标报价
+
+        同方向的挂单优先按价格匹配，价格相同只改数量，其余按价格顺序配对改价，多余的挂单撤销，不足的报价新下单。
+
+        :param instId: 产品ID
+        :param quotes: 目标报价，包含 side, px, sz，以及新下单所需的其他参数
+        :param live: 当前挂单，默认查询未成交订单
+        :param tdMode: 新订单的交易模式
+        :param ordType: 新订单的订单类型
+        :param concurrency: 同时发送的批次数
+        :return: kept：无需修改的挂单 amended：修改结果 cancelled：撤单结果 placed：下单结果
+        """
+        if live is None:
+            live = await self.pending_order(instId=instId)
+        kept, amends, cancels, new = [], [], [], []
+        for side in ("buy", "sell"):
+            # Best prices first, so the remaining orders pair up in ladder order
+            reverse = side == "buy"
+            orders = sorted((o for o in live if o["side"] == side), key=_price, reverse=reverse)
+            targets = sorted((q for q in quotes if q["side"] == side), key=_price, reverse=reverse)
+            unmatched = []
+            for quote in targets:
+                match = next((o for o in orders if _price(o) == _price(quote)), None)
+                if match is None:
+                    unmatched.append(quote)
+                    continue
+                orders.remove(match)
+                if _size(match) == _size(quote):
+                    kept.append(match)
                 else:
-                    break
-            batches.append(batch)
-        tasks = []
-        for batch in batches:
-            async with self.BATCH_CANCEL_SEMAPHORE:
-                tasks.append(asyncio.create_task(batch))
-        orders = []
-        for task in tasks:
-            batch = await task
-            assert batch["code"] == "0", f"{BATCH_CANCEL}, msg={batch['msg']}"
-            orders.extend(batch["data"])
-        return orders
-
-    PENDING_ORDER_SEMAPHORE = RateLimiter(60, 2)
+                    amends.append(dict(instId=instId, ordId=match["ordId"], newSz=str(quote["sz"])))
+            for order, quote in zip(orders, unmatched):
+                amend = dict(instId=instId, ordId=order["ordId"], newPx=str(quote["px"]))
+                if _size(order) != _size(quote):
+                    amend["newSz"] = str(quote["sz"])
+                amends.append(amend)
+            cancels.extend(dict(instId=instId, ordId=order["ordId"]) for order in orders[len(unmatched) :])
+            new.extend(
+                {
+                    **dict(instId=instId, tdMode=tdMode, ordType=ordType),
+                    **quote,
+                    "px": str(quote["px"]),
+                    "sz": str(quote["sz"]),
+                }
+                for quote in unmatched[len(orders) :]
+            )
+        amended, cancelled, placed = await asyncio.gather(
+            self.batch_amend(amends, concurrency),
+            self.batch_cancel(cancels, concurrency),
+            self.batch_order(new, concurrency),
+        )
+        return dict(kept=kept, amended=amended, cancelled=cancelled, placed=placed)
+
+    async def get_pending_order_page(
+        self, instType="", uly="", instId="", ordType="", state="", after="", limit=""
+    ) -> List[dict]:
+        """获取未成交订单列表的一页
+
+        GET /api/v5/trade/orders-pending 限速： 60次/2s
+
+        :param instType: 产品类型 SPOT：币币 MARGIN：币币杠杆 SWAP：永续合约 FUTURES：交割合约 OPTION：期权
+        :param uly: 标的指数
+        :param instId: 产品ID
+        :param ordType: 订单类型
+        :param state: 订单状态 live：等待成交 partially_filled：部分成交
+        :param after: 请求此ID之前（更旧的数据）的分页内容，传的值为对应接口的ordId
+        :param limit: 返回结果的数量，最大为100，默认100条
+        """
+        params = dict(instType=instType, uly=uly, instId=instId, ordType=ordType, state=state, after=after, limit=limit)
+        res = await self._request_with_params(GET, PENDING_ORDER, params)
+        assert res["code"] == "0", f"{PENDING_ORDER}, msg={res['msg']}"
+        return res["data"]
+
+    def iter_pending_order(self, instType="", uly="", instId="", ordType="", state="", prefetch=2, rows=False):
+        """逐页获取未成交订单信息，后续页面在后台预取
+
+        Usage:
+            async for order in api.iter_pending_order("SWAP", rows=True):
+                ...
+
+        :param instType: 产品类型 SPOT：币币 MARGIN：币币杠杆 SWAP：永续合约 FUTURES：交割合约 OPTION：期权
+        :param uly: 标的指数
+        :param instId: 产品ID
+        :param ordType: 订单类型
+        :param state: 订单状态 live：等待成交 partially_filled：部分成交
+        :param prefetch: 预取页数
+        :param rows: 逐条返回
+        """
+        return iter_with_pagination(
+            self.get_pending_order_page,
+            tag="ordId",
+            page_size=100,
+            prefetch=prefetch,
+            rows=rows,
+            instType=instType,
+            uly=uly,
+            instId=instId,
+            ordType=ordType,
+            state=state,
+        )
 
     async def pending_order(self, instType="", uly="", instId="", ordType="", state="") -> List[dict]:
         """获取当前账户下所有未成交订单信息
@@ -256,20 +690,7 @@ class TradeAPI(OkxClient):
                         optimal_limit_ioc：市价委托立即成交并取消剩余（仅适用交割、永续）
         :param state: 订单状态 live：等待成交 partially_filled：部分成交
         """
-        # :param after: 请求此ID之前（更旧的数据）的分页内容，传的值为对应接口的ordId
-        # :param before: 请求此ID之后（更新的数据）的分页内容，传的值为对应接口的ordId
-        # :param limit: 返回结果的数量，默认100条
-        params = dict(instType=instType, uly=uly, instId=instId, ordType=ordType, state=state)
-        async with self.PENDING_ORDER_SEMAPHORE:
-            temp = await self._request_with_params(GET, PENDING_ORDER, params)
-        assert temp["code"] == "0", f"{PENDING_ORDER}, msg={temp['msg']}"
-        res = temp["data"]
-        while len(temp) == 100:
-            params = dict(
-                instType=instType, uly=uly, instId=instId, ordType=ordType, state=state, after=temp[100 - 1]["ordId"]
-            )
-            async with self.PENDING_ORDER_SEMAPHORE:
-                temp = await self._request_with_params(GET, PENDING_ORDER, params)
-            assert temp["code"] == "0", f"{PENDING_ORDER}, msg={temp['msg']}"
-            res.extend(temp["data"])
+        res = []
+        async for page in self.iter_pending_order(instType, uly, instId, ordType, state):
+            res.extend(page)
         return res
@@ -0,0 +1,293 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import os
+import ssl
+import weakref
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
+from . import consts as c
+from .limits import LimiterRegistry, Priority, default_limits
+
+
+class PriorityGate:
+    """Connection slots handed out by priority
+
+    A request of priority `p` only takes a slot while fewer than `capacity - reserved * p` are in use, so the
+    last slots are always left to more urgent requests, and waiters are woken by priority.
+    """
+
+    def __init__(self, capacity: int, reserved: int):
+        """
+        :param capacity: number of slots
+        :param reserved: slots kept free from each lower priority class
+        """
+        self.capacity = capacity
+        self.reserved = reserved
+        self.in_use = 0
+        self._waiters = []
+        self._arrival = itertools.count()
+
+    def __repr__(self):
+        return f"PriorityGate({self.in_use}/{self.capacity}, reserved={self.reserved})"
+
+    def _available(self, priority: int) -> bool:
+        return self.in_use < max(1, self.capacity - self.reserved * priority)
+
+    async def acquire(self, priority: int = 0):
+        if not self._waiters and self._available(priority):
+            self.in_use += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrival), future))
+        # Lower priority waiters may be queued for slots still open to this one
+        self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just before cancellation
+                self.release()
+            raise
+
+    def release(self):
+        self.in_use -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._available(priority):
+                break
+            heapq.heappop(self._waiters)
+            self.in_use += 1
+            future.set_result(None)
+
+
+class RequestTrace:
+    """Progress of one request, passed to aiohttp as `trace_request_ctx`"""
+
+    __slots__ = ("sent",)
+
+    def __init__(self):
+        # The request line and headers were written to the connection
+        self.sent = False
+
+
+async def _on_request_headers_sent(session, context, params):
+    trace = context.trace_request_ctx
+    if isinstance(trace, RequestTrace):
+        trace.sent = True
+
+
+class Transport:
+    """Pooled HTTP connections to OKX REST API
+
+    The session is opened lazily in the running event loop, one per loop, and discarded after a fork,
+    so a transport can be shared deliberately between `PublicAPI`, `TradeAPI`, `AccountAPI` and `AssetAPI`.
+    """
+
+    logger = logging.getLogger("Transport")
+    logger.setLevel(logging.DEBUG)
+
+    def __init__(
+        self,
+        base_url=c.API_URL,
+        limit=100,
+        limit_per_host=0,
+        keepalive_timeout=30.0,
+        ttl_dns_cache=300,
+        timeout=5,
+        ssl_context: ssl.SSLContext = None,
+        warm_connections=0,
+        warm_interval: float = None,
+        reserved: int = None,
+        limits: LimiterRegistry = None,
+        **session_kwargs,
+    ):
+        """
+        :param base_url: REST API root
+        :param limit: total number of pooled connections, 0 for unlimited
+        :param limit_per_host: connections per host, 0 for unlimited
+        :param keepalive_timeout: seconds an idle connection is kept open
+        :param ttl_dns_cache: seconds DNS lookups are cached
+        :param timeout: seconds or `ClientTimeout` for a request
+        :param ssl_context: SSL context shared by all connections
+        :param warm_connections: number of connections opened with the session and kept alive, 0 to disable
+        :param warm_interval: seconds between keep-alive requests, half of `keepalive_timeout` by default
+        :param reserved: connections kept free from each lower priority class, a tenth of `limit` by default
+        :param limits: rate limiters the keep-alive requests count against, shared by default
+        :param session_kwargs: other kwargs for `aiohttp.ClientSession`
+        """
+        self.base_url = base_url
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self.timeout = timeout if isinstance(timeout, ClientTimeout) else ClientTimeout(timeout)
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self.warm_connections = warm_connections
+        self.warm_interval = warm_interval or keepalive_timeout / 2
+        self.reserved = max(1, limit // 10) if reserved is None else reserved
+        self.limits = limits or default_limits
+        self.session_kwargs = session_kwargs
+        self._gates: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, PriorityGate] = weakref.WeakKeyDictionary()
+        self._warm_tasks: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Task] = (
+            weakref.WeakKeyDictionary()
+        )
+        self._sessions: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ClientSession] = (
+            weakref.WeakKeyDictionary()
+        )
+        self._pid = os.getpid()
+
+    def __repr__(self):
+        return f"Transport({self.base_url}, limit={self.limit}, limit_per_host={self.limit_per_host})"
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            # Connections inherited from the parent process must not be reused
+            self._sessions = weakref.WeakKeyDictionary()
+            self._warm_tasks = weakref.WeakKeyDictionary()
+            self._gates = weakref.WeakKeyDictionary()
+            self._pid = os.getpid()
+
+    @property
+    def session(self) -> ClientSession:
+        """Session bound to the running event loop, opened on first use"""
+        loop = asyncio.get_running_loop()
+        self._check_fork()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.ttl_dns_cache,
+                use_dns_cache=True,
+                ssl=self.ssl_context,
+            )
+            # Tells requests that failed before reaching the exchange from ones that may have reached it
+            trace_config = TraceConfig()
+            trace_config.on_request_headers_sent.append(_on_request_headers_sent)
+            kwargs = dict(self.session_kwargs)
+            kwargs["trace_configs"] = [*kwargs.get("trace_configs", ()), trace_config]
+            session = ClientSession(base_url=self.base_url, connector=connector, timeout=self.timeout, **kwargs)
+            self._sessions[loop] = session
+            self.logger.debug(f"Opened session {self}")
+            if self.warm_connections:
+                self._start_keep_warm(loop, delay=0)
+        return session
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int = 0):
+        """Hold one of the pooled connections, granted to urgent requests first
+
+        Without a limit on the pool every request gets a connection at once.
+
+        :param priority: requests of lower value are served first
+        """
+        if not self.limit:
+            yield
+            return
+        loop = asyncio.get_running_loop()
+        self._check_fork()
+        gate = self._gates.get(loop)
+        if gate is None:
+            gate = self._gates[loop] = PriorityGate(self.limit, self.reserved)
+        await gate.acquire(priority)
+        try:
+            yield
+        finally:
+            gate.release()
+
+    @property
+    def opened(self) -> bool:
+        try:
+            session = self._sessions.get(asyncio.get_running_loop())
+        except RuntimeError:
+            return False
+        return session is not None and not session.closed
+
+    @property
+    def ready_connections(self) -> int:
+        """Number of idle pooled connections that can be used without a handshake"""
+        try:
+            session = self._sessions.get(asyncio.get_running_loop())
+        except RuntimeError:
+            return 0
+        if session is None or session.closed:
+            return 0
+        # aiohttp does not expose the idle pool publicly, its private layout may change between versions
+        conns = getattr(session.connector, "_conns", None)
+        if not isinstance(conns, dict):
+            return 0
+        try:
+            return sum(1 for pool in conns.values() for proto, _ in pool if proto.is_connected())
+        except (AttributeError, TypeError, ValueError):
+            return 0
+
+    async def warm_up(self, connections: int = None, path=c.SERVER_TIMESTAMP_URL) -> int:
+        """Open connections now and keep them alive in the background
+
+        :param connections: number of connections, `warm_connections` or 4 by default
+        :param path: cheap endpoint used to open and refresh connections
+        :return: number of ready connections
+        """
+        if connections:
+            self.warm_connections = connections
+        elif not self.warm_connections:
+            self.warm_connections = 4
+        self._start_keep_warm(asyncio.get_running_loop(), path=path)
+        await self._touch(self.warm_connections, path)
+        return self.ready_connections
+
+    def _start_keep_warm(self, loop, delay: float = None, path=c.SERVER_TIMESTAMP_URL):
+        task = self._warm_tasks.get(loop)
+        if task is None or task.done():
+            delay = self.warm_interval if delay is None else delay
+            self._warm_tasks[loop] = loop.create_task(self._keep_warm(delay, path))
+
+    async def _keep_warm(self, delay, path):
+        await asyncio.sleep(delay)
+        while True:
+            await self._touch(self.warm_connections, path)
+            await asyncio.sleep(self.warm_interval)
+
+    async def _touch(self, connections, path):
+        # Concurrent requests take every idle connection and open the missing ones.
+        results = await asyncio.gather(*(self._ping(path) for _ in range(connections)), return_exceptions=True)
+        failed = sum(1 for res in results if isinstance(res, BaseException))
+        if failed:
+            self.logger.debug(f"{failed}/{connections} keep-alive requests failed")
+
+    async def _ping(self, path):
+        # Keep-alive requests share the rate limit of the endpoint and the connection slots with other requests
+        limiter, weight = self.limits.resolve(c.GET, path, {})
+        if limiter:
+            await limiter.acquire(weight, Priority.QUERY)
+        async with self.slot(Priority.QUERY):
+            async with self.session.get(path) as response:
+                await response.read()
+
+    async def close(self):
+        """Close the session of the running event loop"""
+        task = self._warm_tasks.pop(asyncio.get_running_loop(), None)
+        if task:
+            task.cancel()
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session and not session.closed:
+            await session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+# Used by API clients created without a transport or session kwargs
+default_transport = Transport()
@@ -1,46 +1,419 @@
 import asyncio
 import base64
 import collections
+import contextlib
 import datetime
+import functools
+import heapq
 import hmac
+import itertools
+import mmap
+import os
+import re
+import struct
+import tempfile
 import time
+import uuid
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
 from . import consts as c
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
 
-class RateLimiter(asyncio.Semaphore):
-    """A custom semaphore to be used with REST API with velocity limit under asyncio"""
 
-    def __init__(self, concurrency: int, interval: int):
+class RateLimiter:
+    """Rate limiter for REST API with velocity limit under asyncio, based on a sliding log of admissions
+
+    At most `concurrency` units are admitted within any window of `interval` seconds, counted when a request
+    is admitted rather than when it returns. The admission times of the last `concurrency` units are kept in a
+    ring, and a unit conforms once the unit admitted `concurrency` units before it has left the window.
+    Waiters are admitted by priority, then in order of arrival, each woken by a timer exactly when it conforms.
+
+    The effective rate adapts to feedback: it is halved when the exchange throttles a request and recovers
+    additively on success while latency stays close to its floor.
+    """
+
+    # Additive increase of the rate factor per successful request
+    INCREASE = 0.02
+    # Multiplicative decrease of the rate factor per throttle
+    DECREASE = 0.5
+    MIN_FACTOR = 0.1
+    # Latency above this multiple of the best observed latency is treated as congestion
+    CONGESTION = 4.0
+
+    def __init__(self, concurrency: int, interval: float):
         """控制REST API访问速率
 
         :param concurrency: API limit
         :param interval: Reset interval
         """
-        super().__init__(concurrency)
-        # Queue of inquiry timestamps
-        self._inquiries = collections.deque(maxlen=concurrency)
-        self._loop = asyncio.get_event_loop()
         self._concurrency = concurrency
         self._interval = interval
-        self._count = concurrency
+        # Admission times of the last `concurrency` units, oldest at `_head`
+        self._log: List[float] = [-float("inf")] * concurrency
+        self._head = 0
+        # Nothing is admitted before this time after a throttle
+        self._blocked_until = 0.0
+        # Heap of (priority, arrival, weight, future)
+        self._waiters: List[Tuple[int, int, int, asyncio.Future]] = []
+        self._arrival = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.acquired = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # Fraction of the documented rate currently allowed
+        self.rate_factor = 1.0
+        self.throttles = 0
+        self._last_throttle = -float("inf")
+        self.latency: Optional[float] = None
+        self.min_latency: Optional[float] = None
 
     def __repr__(self):
         return f"Rate limit: {self._concurrency} inquiries/{self._interval}s"
 
-    async def acquire(self):
-        await super().acquire()
-        if self._count > 0:
-            self._count -= 1
-        else:
-            timelapse = time.monotonic() - self._inquiries.popleft()
-            # Wait until interval has passed since the first inquiry in queue returned.
-            if timelapse < self._interval:
-                await asyncio.sleep(self._interval - timelapse)
+    _now = staticmethod(time.monotonic)
+
+    @property
+    def limit(self) -> int:
+        """Units admitted per window at the current effective rate"""
+        return max(1, int(self._concurrency * self.rate_factor))
+
+    @property
+    def emission_interval(self) -> float:
+        """Seconds per unit at the current effective rate"""
+        return self._interval / self.limit
+
+    @contextlib.contextmanager
+    def _state(self):
+        """Exclusive access to the admission log"""
+        yield
+
+    def _try_admit(self, weight: int, now: float) -> float:
+        """Admit `weight` units if they conform
+
+        :return: 0 if admitted, otherwise seconds until they conform
+        """
+        with self._state():
+            if self._blocked_until - now > 1e-6:
+                return self._blocked_until - now
+            limit = self.limit
+            # A weight above the limit is admitted once the window is empty and counted as a full window.
+            units = min(weight, limit)
+            # At most `limit - units` earlier units may remain in the window.
+            oldest = self._log[(self._head - (limit - units) - 1) % self._concurrency]
+            delay = oldest + self._interval - now
+            if delay > 1e-6:
+                return delay
+            for _ in range(units):
+                self._log[self._head] = now
+                self._head = (self._head + 1) % self._concurrency
+            return 0.0
+
+    def throttled(self, retry_after: float = None):
+        """Feedback that the exchange rejected a request as too frequent
+
+        :param retry_after: seconds the exchange asked to wait
+        """
+        now = self._now()
+        self.throttles += 1
+        with self._state():
+            # Throttles of requests already in flight belong to the same congestion event.
+            if now - self._last_throttle > self._interval:
+                self.rate_factor = max(self.MIN_FACTOR, self.rate_factor * self.DECREASE)
+                self._last_throttle = now
+            # Nothing is admitted before `retry_after`, or one emission interval
+            wait = retry_after if retry_after else self.emission_interval
+            self._blocked_until = max(self._blocked_until, now + wait)
+
+    def succeeded(self, latency: float):
+        """Feedback that a request was accepted
+
+        :param latency: seconds from send to response
+        """
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        self.min_latency = latency if self.min_latency is None else min(self.min_latency, latency)
+        if self.latency < self.CONGESTION * self.min_latency:
+            with self._state():
+                self.rate_factor = min(1.0, self.rate_factor + self.INCREASE)
+
+    async def acquire(self, weight: int = 1, priority: int = 0):
+        """Wait until `weight` units are admitted
+
+        :param weight: units consumed, e.g. number of orders in a batch
+        :param priority: waiters of lower value are admitted first
+        """
+        start = self._now()
+        if not self._waiters and not self._try_admit(weight, start):
+            self.acquired += 1
+            return True
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrival), weight, future))
+        self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The cancelled entry is discarded when it reaches the head of the queue
+            self._wake()
+            raise
+        wait = self._now() - start
+        self.acquired += 1
+        self.waited += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
         return True
 
     def release(self):
-        self._inquiries.append(time.monotonic())
-        super().release()
+        """Nothing to release, units are counted at admission"""
+
+    def _wake(self):
+        """Admit conforming waiters by priority and set a timer for the next one"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        now = self._now()
+        while self._waiters:
+            _, _, weight, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            delay = self._try_admit(weight, now)
+            if delay:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._wake)
+                break
+            heapq.heappop(self._waiters)
+            future.set_result(True)
+
+    @contextlib.asynccontextmanager
+    async def weighted(self, weight: int, priority: int = 0):
+        """Context manager acquiring `weight` units"""
+        await self.acquire(weight, priority)
+        yield
+
+    def stats(self) -> dict:
+        """Wait time statistics"""
+        return dict(
+            limit=self._concurrency,
+            interval=self._interval,
+            acquired=self.acquired,
+            waited=self.waited,
+            queued=sum(1 for *_, future in self._waiters if not future.done()),
+            total_wait=self.total_wait,
+            mean_wait=self.total_wait / self.waited if self.waited else 0.0,
+            max_wait=self.max_wait,
+            rate_factor=self.rate_factor,
+            effective_rate=self._concurrency * self.rate_factor / self._interval,
+            throttles=self.throttles,
+            latency=self.latency,
+        )
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class SharedRateLimiter(RateLimiter):
+    """Rate limiter whose budget is shared by every process on this host using the same `name`
+
+    The admission log and the rate factor live in a memory-mapped file and are updated under an exclusive file
+    lock, so several worker processes behind one IP or one UserID stay within a single limit and back off together.
+    Requires `fcntl`, which is not available on Windows.
+    """
+
+    available = fcntl is not None
+
+    def __init__(self, concurrency: int, interval: float, name: str, directory: str = None):
+        """
+        :param concurrency: API limit
+        :param interval: Reset interval
+        :param name: key of the shared budget
+        :param directory: directory of state files, a temporary directory by default
+        """
+        if not self.available:
+            raise OSError("SharedRateLimiter requires fcntl, which is not available on this platform")
+        super().__init__(concurrency, interval)
+        self.name = name
+        directory = directory or os.path.join(tempfile.gettempdir(), "async_okx_v5")
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, re.sub(r"[^\w.-]", "_", name))
+        # Time until which admissions are blocked, rate factor, time of the last decrease, index of the oldest
+        # entry, admission log
+        self._layout = struct.Struct(f"dddq{concurrency}d")
+        self._pid = None
+        self._open()
+
+    def __repr__(self):
+        return f"Shared rate limit {self.name}: {self._concurrency} inquiries/{self._interval}s"
+
+    # Wall clock, because the state outlives processes and reboots.
+    _now = staticmethod(time.time)
+
+    def _open(self):
+        # File locks are held per open file, so a forked child must not reuse the parent's.
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = self._layout.size
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._mmap = mmap.mmap(self._fd, size)
+        self._pid = os.getpid()
+
+    @contextlib.contextmanager
+    def _state(self):
+        if self._pid != os.getpid():
+            self._open()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            self._blocked_until, factor, self._last_throttle, head, *self._log = self._layout.unpack_from(self._mmap)
+            # A new file is zeroed
+            self.rate_factor = factor if self.MIN_FACTOR <= factor <= 1.0 else 1.0
+            self._head = head % self._concurrency
+            yield
+            self._layout.pack_into(
+                self._mmap, 0, self._blocked_until, self.rate_factor, self._last_throttle, self._head, *self._log
+            )
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class SingleFlight:
+    """Identical concurrent calls share one execution and its result
+
+    The first caller of a key starts the call in a task, later callers of the same key wait for that task
+    instead of calling again. Results are shared between callers and must not be modified in place.
+    Cancelling a caller never cancels a call other callers wait for.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"SingleFlight({len(self._calls)} in flight, hits={self.hits}, misses={self.misses})"
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable], timeout: float = None):
+        """Result of `fn()`, shared with concurrent calls of the same `key` in this event loop
+
+        :param timeout: seconds this caller waits, the call goes on for the others
+        :raise asyncio.TimeoutError: the call did not complete within `timeout`
+        """
+        key = (asyncio.get_running_loop(), key)
+        task = self._calls.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(functools.partial(self._done, key))
+        else:
+            self.hits += 1
+        if timeout is None:
+            return await asyncio.shield(task)
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+
+    def _done(self, key, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Retrieved even if every caller was cancelled
+            task.exception()
+
+    def stats(self) -> dict:
+        """Calls saved by sharing"""
+        total = self.hits + self.misses
+        return dict(
+            in_flight=len(self._calls),
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / total if total else 0.0,
+        )
+
+
+# Shared by all API clients unless single flight is disabled
+default_flights = SingleFlight()
+
+
+class MicroBatcher:
+    """Concurrent single key calls collected for `window` seconds and sent as one call of up to `max_size` keys
+
+    `fn` receives a list of distinct keys and returns a dict of key to result, keys missing from it resolve to
+    `missing`. Every caller of a batch fails with the exception of the batch call.
+
+    Usage:
+        batcher = MicroBatcher(fetch_positions, max_size=10, window=0.005)
+        positions = await batcher.get("BTC-USDT-SWAP")
+    """
+
+    def __init__(self, fn: Callable[[List[Hashable]], Awaitable[dict]], max_size: int, window: float, missing=None):
+        """
+        :param fn: batch call
+        :param max_size: keys per batch call
+        :param window: seconds to wait for more keys after the first one
+        :param missing: result of keys absent from the result of `fn`
+        """
+        self.fn = fn
+        self.max_size = max_size
+        self.window = window
+        self.missing = missing
+        self._pending: Dict[Hashable, List[asyncio.Future]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.calls = 0
+        self.batches = 0
+
+    def __repr__(self):
+        return f"MicroBatcher(max_size={self.max_size}, window={self.window}, pending={len(self._pending)})"
+
+    async def get(self, key: Hashable):
+        """Result of `key` from the next batch call"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(key, []).append(future)
+        self.calls += 1
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            keys = list(itertools.islice(self._pending, self.max_size))
+            batch = {key: self._pending.pop(key) for key in keys}
+            task = asyncio.get_running_loop().create_task(self._send(batch))
+            # Keep a reference until the batch is done
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: Dict[Hashable, List[asyncio.Future]]):
+        self.batches += 1
+        try:
+            results = await self.fn(list(batch))
+        except asyncio.CancelledError:
+            for futures in batch.values():
+                for future in futures:
+                    future.cancel()
+            raise
+        except Exception as exc:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(exc)
+            return
+        for key, futures in batch.items():
+            result = results.get(key, self.missing)
+            for future in futures:
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self) -> dict:
+        """Calls merged into batch calls"""
+        return dict(calls=self.calls, batches=self.batches, ratio=self.calls / self.batches if self.batches else 0.0)
 
 
 def sign(message, secret_key):
@@ -63,10 +436,24 @@ def get_header(api_key, header_sign, timestamp, passphrase):
     }
 
 
+def retry_after(headers) -> Optional[float]:
+    """Seconds to wait from a `Retry-After` header, if any"""
+    value = headers.get("Retry-After")
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
 def parse_params_to_str(params):
     return "" if not params else "?" + "&".join([f"{key}={value}" for key, value in params.items()])
 
 
+def client_order_id() -> str:
+    """Unique client order ID, 32 alphanumeric characters"""
+    return uuid.uuid4().hex
+
+
 def get_timestamp():
     now = datetime.datetime.utcnow()
     t = now.isoformat("T", "milliseconds")
@@ -82,7 +469,14 @@ def signature(timestamp, method, request_path, body, secret_key):
     return base64.b64encode(d)
 
 
-async def query_with_pagination(query_api, tag, page_size, count=0, interval=0, **kwargs):
+def get_field(row, tag):
+    """Field `tag` of a raw record or a decoded model"""
+    if isinstance(row, (dict, list, tuple)):
+        return row[tag]
+    return getattr(row, tag if isinstance(tag, str) else row.__slots__[tag])
+
+
+async def query_with_pagination(query_api, tag, page_size, count=0, interval=0, sink=None, **kwargs):
     """Loop `api` until `limit` is reached
 
     :param query_api: api coroutine with `after` and `limit` keyword arguments
@@ -90,43 +484,125 @@ async def query_with_pagination(query_api, tag, page_size, count=0, interval=0,
     :param page_size: max number of results in a single request
     :param count: number of entries
     :param interval: time interval between entries in milliseconds
+    :param sink: callable receiving `(offset, page)` as pages arrive, instead of accumulating them
     :param kwargs: other arguments
-    :return: List
+    :return: List, or number of entries passed to `sink`
     """
+    res = []
+    received = 0
+
+    def emit(offset, page):
+        nonlocal received
+        received += len(page)
+        if sink:
+            sink(offset, page)
+        else:
+            res.extend(page)
+        return page
+
+    async def fetch(offset, **params):
+        # Pages go to the sink as soon as they arrive and are not kept.
+        emit(offset, await query_api(**kwargs, **params))
+
     # Number of entries is known.
     if count > 0:
         # First time
         if count < page_size:
-            return await query_api(**kwargs, limit=count)
+            emit(0, await query_api(**kwargs, limit=count))
+            return received if sink else res
         else:
-            res = temp = await query_api(**kwargs, limit=page_size)
+            temp = emit(0, await query_api(**kwargs, limit=page_size))
             count -= page_size
         # Parallelize if time interval is known
         if interval:
-            after = int(temp[-1][tag])
+            after = int(get_field(temp[-1], tag))
+            offset = page_size
             tasks = []
             while count > 0:
-                if count < page_size:
-                    tasks.append(query_api(**kwargs, after=after, limit=count))
+                limit = min(count, page_size)
+                if sink:
+                    tasks.append(fetch(offset, after=after, limit=limit))
                 else:
-                    tasks.append(query_api(**kwargs, after=after, limit=page_size))
+                    tasks.append(query_api(**kwargs, after=after, limit=limit))
                 after -= page_size * interval
+                offset += page_size
                 count -= page_size
             for temp in await asyncio.gather(*tasks):
-                res.extend(temp)
+                if temp is not None:
+                    emit(0, temp)
         else:
             while count > 0:
-                if count < page_size:
-                    temp = await query_api(**kwargs, after=temp[page_size - 1][tag], limit=count)
-                else:
-                    temp = await query_api(**kwargs, after=temp[page_size - 1][tag], limit=page_size)
-                res.extend(temp)
+                limit = min(count, page_size)
+                temp = emit(received, await query_api(**kwargs, after=get_field(temp[page_size - 1], tag), limit=limit))
                 count -= page_size
     else:
         # First time
-        res = temp = await query_api(**kwargs)
+        temp = emit(0, await query_api(**kwargs))
         # Results not exhausted
         while len(temp) == page_size:
-            temp = await query_api(**kwargs, after=temp[page_size - 1][tag])
-            res.extend(temp)
-    return res
+            temp = emit(received, await query_api(**kwargs, after=get_field(temp[page_size - 1], tag)))
+    return received if sink else res
+
+
+async def iter_with_pagination(query_api, tag, page_size, prefetch=2, rows=False, **kwargs):
+    """Iterate `api` page by page from newest to oldest while later pages are fetched in the background
+
+    Usage:
+        async for page in iter_with_pagination(api.get_ledger, "billId", 100, instType="SWAP", ccy="USDT"):
+            ...
+
+    :param query_api: api coroutine with `after` keyword argument
+    :param tag: tag used by `after` argument
+    :param page_size: max number of results in a single request, a shorter page is the last one
+    :param prefetch: max number of pages fetched ahead of the consumer, 0 to fetch each page when it is consumed
+    :param rows: yield entries instead of pages
+    :param kwargs: other arguments
+    :return: AsyncGenerator of pages or entries
+    :raise ValueError: negative `prefetch`
+    """
+    if prefetch < 0:
+        raise ValueError(f"prefetch must not be negative: {prefetch}")
+    if not prefetch:
+        params = dict(kwargs)
+        while True:
+            page = await query_api(**params)
+            if rows:
+                for row in page:
+                    yield row
+            elif page:
+                yield page
+            if len(page) < page_size:
+                return
+            params["after"] = get_field(page[-1], tag)
+
+    queue = asyncio.Queue(maxsize=prefetch)
+
+    async def produce():
+        params = dict(kwargs)
+        try:
+            while True:
+                page = await query_api(**params)
+                if page:
+                    await queue.put(page)
+                if len(page) < page_size:
+                    break
+                params["after"] = get_field(page[-1], tag)
+            await queue.put(None)
+        except Exception as exc:
+            await queue.put(exc)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            page = await queue.get()
+            if page is None:
+                break
+            if isinstance(page, Exception):
+                raise page
+            if rows:
+                for row in page:
+                    yield row
+            else:
+                yield page
+    finally:
+        producer.cancel()
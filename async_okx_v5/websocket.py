@@ -1,9 +1,13 @@
-import json
-from websockets import connect, WebSocketClientProtocol, ConnectionClosed, InvalidStatusCode
 from .channel import *
+from .clock import ClockSync, default_clock
+from .codec import JsonCodec, default_codec
+from .public import PublicAPI
+from .multiplex import Policy, Subscriber, WebsocketManager, delivery_policy
 from .types import *
 from .utils import *
+import functools
 import logging
+from typing import Awaitable, Callable
 
 TEST_WS_PUBLIC_URL = "wss://wspap.okx.com:8443/ws/v5/public?brokerId=9999"
 TEST_WS_PRIVATE_URL = "wss://wspap.okx.com:8443/ws/v5/private?brokerId=9999"
@@ -19,119 +23,171 @@ def get_local_timestamp():
     return int(time.time())
 
 
+def login_params(api_key, api_secret_key, passphrase, clock: Optional[ClockSync], codec: JsonCodec) -> str:
+    """Login request of private channels"""
+    # Server time estimated by the shared clock, no extra request needed
+    timestamp = clock.unix_timestamp() if clock else get_local_timestamp()
+    sign = signature(timestamp, "GET", "/users/self/verify", "", api_secret_key)
+    login_params = {
+        "op": "login",
+        "args": [
+            {
+                "apiKey": api_key,
+                "passphrase": passphrase,
+                "timestamp": timestamp,
+                "sign": sign.decode("utf-8"),
+            }
+        ],
+    }
+    return codec.dumps(login_params)
+
+
+async def server_time(test=False) -> int:
+    """服务器时间，Unix时间戳的毫秒数"""
+    return await PublicAPI(test=test).get_server_time()
+
+
+async def signed_login(
+    api_key, api_secret_key, passphrase, clock: Optional[ClockSync], codec: JsonCodec, test=False
+) -> str:
+    """Login request of private channels, signed after the clock is synchronized
+
+    A process that only uses websockets would otherwise sign with an unsynchronized clock.
+    """
+    if clock:
+        await clock.ensure(functools.partial(server_time, test))
+    return login_params(api_key, api_secret_key, passphrase, clock, codec)
+
+
 class PublicSubscription:
-    """PublicSubscription is an async generator of websocket stream on specific channels"""
+    """PublicSubscription is an async generator of websocket stream on specific channels
+
+    Without `reconnect` the stream ends when the connection is lost. With `reconnect` the connection is reopened
+    after a jittered backoff, logged in again and resubscribed, and the stream yields
+    `{"event": "disconnect", ...}` and `{"event": "reconnect", "downtime": seconds, ...}` around the gap. It raises
+    `OkexRequestException` if the connection cannot be reopened within `max_attempts`, see `Connection`.
 
-    def __init__(self, uri, channels: Sequence[Channel], **ws_kwargs):
+    Messages the consumer has not taken yet are buffered up to `maxsize` and handled by `policy` beyond, see
+    `Subscriber`.
+    """
+
+    def __init__(
+        self,
+        uri,
+        channels: Sequence[Channel],
+        codec: JsonCodec = default_codec,
+        reconnect=False,
+        ping_interval=25.0,
+        policy: Policy = None,
+        maxsize=10000,
+        **ws_kwargs,
+    ):
         self.uri = uri
         self.channels = channels
-        self.ws: Optional[WebSocketClientProtocol] = None
+        self.codec = codec
+        self.reconnect = reconnect
+        self.ping_interval = ping_interval
+        self.policy = policy or delivery_policy(channels)
+        self.maxsize = maxsize
         self.ws_kwargs = ws_kwargs
-        self.ping_interval = 25
+        # All channels on one connection of its own
+        self.manager = WebsocketManager(
+            uri,
+            codec,
+            self.login,
+            max_channels=max(1, len(channels)),
+            ping_interval=ping_interval,
+            reconnect=reconnect,
+            **ws_kwargs,
+        )
+        self.subscriber: Optional[Subscriber] = None
         self.logger = logging.getLogger(",".join([c["channel"] for c in channels]))
         self.logger.setLevel(logging.DEBUG)
 
-    SUBSCRIPTION_SEMAPHORE = RateLimiter(240, 3600)
+    login: Optional[Callable[[], Awaitable[str]]] = None
 
     async def subscribe(self):
-        try:
-            self.ws = await connect(self.uri, **self.ws_kwargs)
-            sub_params = {"op": "subscribe", "args": self.channels}
-            sub_str = json.dumps(sub_params)
-            async with self.SUBSCRIPTION_SEMAPHORE:
-                await self.ws.send(sub_str)
-            self.logger.debug(f"send: {sub_str}")
-        except Exception as exc:
-            self.logger.error(f"Websocket subscribe error", exc_info=exc)
+        """Connect and subscribe
+
+        :raise OkexRequestException: login rejected
+        :raise OSError: connection failed
+        :raise websockets.WebSocketException: handshake failed
+        """
+        self.subscriber = await self.manager.subscribe(self.channels, self.policy, self.maxsize)
 
     async def unsubscribe(self):
-        sub_params = {"op": "unsubscribe", "args": self.channels}
-        sub_str = json.dumps(sub_params)
-        await self.ws.send(sub_str)
-        self.logger.debug(f"send: {sub_str}")
-        for _ in range(len(self.channels)):
-            res = await self.ws.recv()
-            self.logger.debug(f"recv: {res}")
-        await self.ws.close()
+        await self.manager.close()
 
     async def __aiter__(self):
         """AsyncGenerator of Websocket stream"""
-        while True:
-            try:
-                res = await asyncio.wait_for(self.ws.recv(), timeout=self.ping_interval)
+        try:
+            async for res in self.subscriber:
                 res = self.process_result(res)
                 if res:
                     yield res
-            except (asyncio.TimeoutError, ConnectionClosed):
-                try:
-                    await self.ws.send("ping")
-                    res = await self.ws.recv()
-                    self.logger.debug(res)
-                except Exception as exc:
-                    self.logger.debug("Connection closed", exc_info=exc)
-                    break
-        await self.unsubscribe()
-
-    @staticmethod
-    def process_result(res):
-        jres = json.loads(res)
-        if "event" not in jres:
-            return jres
+        finally:
+            await self.unsubscribe()
+
+    def process_result(self, res: dict):
+        return res
+
+    def metrics(self) -> dict:
+        """Messages received, reconnects, mean time to recovery in seconds, and messages dropped or conflated"""
+        stats = self.manager.stats()
+        if self.subscriber:
+            stats.update(self.subscriber.stats())
+        return stats
 
 
 class PrivateSubscription(PublicSubscription):
-    def __init__(self, uri, channels: Sequence[Channel], api_key, api_secret_key, passphrase, **ws_kwargs):
-        super().__init__(uri, channels, **ws_kwargs)
+    def __init__(
+        self,
+        uri,
+        channels: Sequence[Channel],
+        api_key,
+        api_secret_key,
+        passphrase,
+        clock: Optional[ClockSync] = None,
+        codec: JsonCodec = default_codec,
+        reconnect=False,
+        test=False,
+        **ws_kwargs,
+    ):
+        super().__init__(uri, channels, codec, reconnect, **ws_kwargs)
         self.api_key = api_key
         self.api_secret_key = api_secret_key
         self.passphrase = passphrase
+        self.clock = clock
+        self.test = test
 
     def login_params(self):
-        timestamp = get_local_timestamp()
-        sign = signature(timestamp, "GET", "/users/self/verify", "", self.api_secret_key)
-        login_params = {
-            "op": "login",
-            "args": [
-                {
-                    "apiKey": self.api_key,
-                    "passphrase": self.passphrase,
-                    "timestamp": timestamp,
-                    "sign": sign.decode("utf-8"),
-                }
-            ],
-        }
-        login_str = json.dumps(login_params)
-        return login_str
-
-    LOGIN_SEMAPHORE = RateLimiter(1, 1)
+        return login_params(self.api_key, self.api_secret_key, self.passphrase, self.clock, self.codec)
 
-    async def subscribe(self):
-        try:
-            self.ws = await connect(self.uri, **self.ws_kwargs)
-            login_str = self.login_params()
-            async with self.LOGIN_SEMAPHORE:
-                await self.ws.send(login_str)
-            self.logger.debug(f"send: {login_str}")
-            res = await self.ws.recv()
-            self.logger.debug(res)
-            sub_params = {"op": "subscribe", "args": self.channels}
-            sub_str = json.dumps(sub_params)
-            async with self.SUBSCRIPTION_SEMAPHORE:
-                await self.ws.send(sub_str)
-            self.logger.debug(f"send: {sub_str}")
-        except Exception as exc:
-            self.logger.error(f"Websocket subscribe error", exc_info=exc)
+    async def login(self) -> str:
+        # Signed again on every reconnect
+        return await signed_login(self.api_key, self.api_secret_key, self.passphrase, self.clock, self.codec, self.test)
 
 
 class OkxWebsocket:
     logger = logging.getLogger("OkxWebsocket")
     logger.setLevel(logging.DEBUG)
 
-    def __init__(self, api_key, api_secret_key, passphrase, test=False):
+    def __init__(
+        self,
+        api_key,
+        api_secret_key,
+        passphrase,
+        test=False,
+        clock: ClockSync = default_clock,
+        codec: JsonCodec = default_codec,
+    ):
         self.api_key = api_key
         self.api_secret_key = api_secret_key
         self.passphrase = passphrase
         self.test = test
+        self.clock = clock
+        self.codec = codec
+        self._managers: Dict[str, WebsocketManager] = {}
 
     def public_uri(self, channels: Sequence[PublicChannel]) -> str:
         public_uri = TEST_WS_PUBLIC_URL if self.test else WS_PUBLIC_URL
@@ -143,31 +199,102 @@ class OkxWebsocket:
         biz_url = TEST_WS_BIZ_URL if self.test else WS_BIZ_URL
         return biz_url if any(channel["channel"] in BUSINESS_CHANNELS for channel in channels) else private_uri
 
-    async def subscribe_public(self, channels: Sequence[PublicChannel], **ws_kwargs) -> PublicSubscription:
+    async def subscribe_public(
+        self, channels: Sequence[PublicChannel], reconnect=False, **ws_kwargs
+    ) -> PublicSubscription:
         """Subscribe to public channels
 
         Usage:
             async for res in await okx_ws.subscribe_public(channels):
                 print(res)
         :param channels: list of channels to subscribe
+        :param reconnect: reconnect and resubscribe when the connection is lost instead of ending the stream
         :param ws_kwargs: kwargs for `websockets.connect`
         :return: WebsocketSubscription `AsyncGenerator` of websocket stream
         """
         uri = self.public_uri(channels)
-        ps = PublicSubscription(uri, channels, **ws_kwargs)
+        ps = PublicSubscription(uri, channels, self.codec, reconnect, **ws_kwargs)
         await ps.subscribe()
         return ps
 
-    async def subscribe_private(self, channels: Sequence[PrivateChannel], **ws_kwargs) -> PrivateSubscription:
+    async def subscribe_private(
+        self, channels: Sequence[PrivateChannel], reconnect=False, **ws_kwargs
+    ) -> PrivateSubscription:
         """Subscribe to private channels
 
         Usage:
             async for res in await okx_ws.subscribe_private(channels):
                 print(res)
         :param channels: list of channels to subscribe
+        :param reconnect: reconnect, log in and resubscribe when the connection is lost instead of ending the stream
         :return: WebsocketSubscription `AsyncGenerator` of websocket stream
         """
         uri = self.private_uri(channels)
-        ps = PrivateSubscription(uri, channels, self.api_key, self.api_secret_key, self.passphrase, **ws_kwargs)
+        ps = PrivateSubscription(
+            uri,
+            channels,
+            self.api_key,
+            self.api_secret_key,
+            self.passphrase,
+            clock=self.clock,
+            codec=self.codec,
+            reconnect=reconnect,
+            test=self.test,
+            **ws_kwargs,
+        )
         await ps.subscribe()
         return ps
+
+    def manager(self, uri: str, private=False, **connection_kwargs) -> WebsocketManager:
+        """Manager of the shared connections to `uri`, created on first use
+
+        :param private: log in on every connection
+        :param connection_kwargs: kwargs for the first use, see `WebsocketManager` and `Connection`
+        """
+        manager = self._managers.get(uri)
+        if manager is None:
+            login = None
+            if private:
+                login = functools.partial(
+                    signed_login, self.api_key, self.api_secret_key, self.passphrase, self.clock, self.codec, self.test
+                )
+            manager = self._managers[uri] = WebsocketManager(uri, self.codec, login, **connection_kwargs)
+        return manager
+
+    async def stream_public(
+        self, channels: Sequence[PublicChannel], policy: Policy = None, maxsize=10000, **connection_kwargs
+    ) -> Subscriber:
+        """Subscribe to public channels on shared connections
+
+        Usage:
+            tickers = await okx_ws.stream_public(channels)
+            async for res in tickers:
+                print(res)
+            await tickers.add(more_channels)
+        :param channels: list of channels to subscribe
+        :param policy: block, drop_oldest or conflate when the consumer falls `maxsize` messages behind, by default
+            the one suited to the channels
+        :param maxsize: messages buffered at most
+        :return: `Subscriber` stream of the channels, including data of channels added later
+        """
+        manager = self.manager(self.public_uri(channels), **connection_kwargs)
+        return await manager.subscribe(channels, policy, maxsize)
+
+    async def stream_private(
+        self, channels: Sequence[PrivateChannel], policy: Policy = None, maxsize=10000, **connection_kwargs
+    ) -> Subscriber:
+        """Subscribe to private channels on shared, logged in connections
+
+        :param channels: list of channels to subscribe
+        :param policy: block, drop_oldest or conflate when the consumer falls `maxsize` messages behind
+        :param maxsize: messages buffered at most
+        :return: `Subscriber` stream of the channels
+        """
+        manager = self.manager(self.private_uri(channels), private=True, **connection_kwargs)
+        return await manager.subscribe(channels, policy, maxsize)
+
+    async def close(self):
+        """Close the shared connections"""
+        for manager in self._managers.values():
+            await manager.close()
+        self._managers.clear()
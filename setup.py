@@ -17,4 +17,8 @@ setup(
         "python-dotenv~=1.0.0",
         "websockets~=11.0.3",
     ],
+    extras_require={
+        "fast": ["orjson"],
+        "numpy": ["numpy"],
+    },
 )
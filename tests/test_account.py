@@ -0,0 +1,94 @@
+import asyncio
+import json
+import pytest
+from urllib.parse import parse_qsl, urlsplit
+from async_okx_v5 import consts as c
+from async_okx_v5.account import AccountAPI
+from async_okx_v5.asset import AssetAPI
+from async_okx_v5.limits import LimiterRegistry
+
+POSITIONS = [
+    dict(instId="BTC-USDT-SWAP", posId="1", pos="1"),
+    dict(instId="BTC-USDT-SWAP", posId="2", pos="-2"),
+    dict(instId="ETH-USDT-SWAP", posId="3", pos="5"),
+]
+DETAILS = [dict(ccy="USDT", eq="100"), dict(ccy="BTC", eq="1")]
+FUNDS = [dict(ccy="USDT", bal="10", frozenBal="0", availBal="10")]
+
+
+def mocked(api, requests):
+    """Answer account and asset queries from the records above, filtered by the comma separated parameter"""
+
+    async def send(method, request_path, body, header, priority, trace):
+        trace.sent = True
+        url = urlsplit(request_path)
+        params = dict(parse_qsl(url.query))
+        requests.append((url.path, params))
+        if url.path == c.ACCOUNT_POSITION:
+            field = "instId" if "instId" in params else "posId"
+            data = [p for p in POSITIONS if p[field] in params[field].split(",")]
+        elif url.path == c.ACCOUNT_BALANCE:
+            data = [dict(totalEq="200", details=[d for d in DETAILS if d["ccy"] in params["ccy"].split(",")])]
+        else:
+            data = [b for b in FUNDS if b["ccy"] in params["ccy"].split(",")]
+        return 200, {}, json.dumps(dict(code="0", msg="", data=data)).encode(), 0.01
+
+    api._send = send
+    return api
+
+
+def account_api(requests, **kwargs) -> AccountAPI:
+    return mocked(AccountAPI("key", "secret", "pass", limits=LimiterRegistry({}), **kwargs), requests)
+
+
+def asset_api(requests, **kwargs) -> AssetAPI:
+    return mocked(AssetAPI("key", "secret", "pass", limits=LimiterRegistry({}), **kwargs), requests)
+
+
+@pytest.mark.asyncio
+async def test_positions_batched_by_instrument_and_id():
+    requests = []
+    api = account_api(requests, batch_window=0.01)
+    btc, eth, sol = await asyncio.gather(
+        *(api.get_specific_position(instId) for instId in ("BTC-USDT-SWAP", "ETH-USDT-SWAP", "SOL-USDT-SWAP"))
+    )
+    assert [p["posId"] for p in btc] == ["1", "2"] and [p["posId"] for p in eth] == ["3"] and sol == []
+    assert requests == [(c.ACCOUNT_POSITION, dict(instId="BTC-USDT-SWAP,ETH-USDT-SWAP,SOL-USDT-SWAP"))]
+    first, missing = await asyncio.gather(api.get_specific_position(posId="1"), api.get_specific_position(posId="9"))
+    assert first == [POSITIONS[0]] and missing == []
+    assert requests[-1] == (c.ACCOUNT_POSITION, dict(posId="1,9"))
+
+
+@pytest.mark.asyncio
+async def test_missing_positions_are_separate_lists():
+    api = account_api([], batch_window=0.01)
+    sol, doge = await asyncio.gather(api.get_specific_position("SOL-USDT-SWAP"), api.get_specific_position("DOGE"))
+    sol.append("changed")
+    assert doge == [] and await api.get_specific_position("SOL-USDT-SWAP") == []
+
+
+@pytest.mark.asyncio
+async def test_coin_balances_batched():
+    requests = []
+    api = account_api(requests, batch_window=0.01)
+    usdt, eth = await asyncio.gather(api.get_coin_balance("USDT"), api.get_coin_balance("ETH"))
+    assert requests == [(c.ACCOUNT_BALANCE, dict(ccy="USDT,ETH"))]
+    # Each currency gets only its own details
+    assert usdt["totalEq"] == "200" and usdt["details"] == [DETAILS[0]]
+    assert eth["details"] == []
+    # Same result without batching
+    assert await account_api([]).get_coin_balance("USDT") == usdt
+    assert await account_api([]).get_coin_balance("ETH") == eth
+
+
+@pytest.mark.asyncio
+async def test_funding_balances_agree_with_and_without_batch():
+    requests = []
+    api = asset_api(requests, batch_window=0.01)
+    usdt, btc = await asyncio.gather(api.get_balance("USDT"), api.get_balance("BTC"))
+    assert requests == [(c.ASSET_BALANCE, dict(ccy="USDT,BTC"))]
+    assert usdt == FUNDS[0] and btc is None
+    single = asset_api([])
+    assert await single.get_balance("USDT") == usdt
+    assert await single.get_balance("BTC") is None
+    assert await api.get_balance("BTC", batch=False) is None
@@ -0,0 +1,131 @@
+import asyncio
+import zlib
+import pytest
+from async_okx_v5.book import OrderBook, OrderBooks, checksum
+from async_okx_v5.exceptions import OkexBookException
+
+
+def test_checksum_interleaves_levels():
+    bids = [["3366.1", "7", "0", "3"], ["3366", "6", "3", "4"], ["3365", "1", "0", "1"]]
+    asks = [["3366.8", "9", "10", "3"], ["3368", "8", "3", "4"]]
+    crc = zlib.crc32(b"3366.1:7:3366.8:9:3366:6:3368:8:3365:1")
+    assert checksum(bids, asks) == (crc - (1 << 32) if crc >= 1 << 31 else crc)
+    assert -(1 << 31) <= checksum(bids * 20, asks * 20) < 1 << 31
+
+
+def test_snapshot_and_updates():
+    book = OrderBook("BTC-USDT")
+    bids = [["100", "1", "0", "1"], ["99", "2", "0", "1"]]
+    asks = [["101", "1", "0", "1"], ["102", "3", "0", "1"]]
+    book.apply(dict(bids=bids, asks=asks, ts="1", seqId=10, prevSeqId=-1, checksum=checksum(bids, asks)))
+    assert book.best_bid == (100, 1) and book.best_ask == (101, 1)
+    assert book.spread == 1 and book.mid == 100.5
+    update = dict(bids=[["100.5", "4", "0", "1"], ["100", "0", "0", "0"]], asks=[["102", "5", "0", "2"]])
+    book.apply(dict(update, ts="2", seqId=11, prevSeqId=10), "update")
+    assert book.top(5) == ([(100.5, 4), (99, 2)], [(101, 1), (102, 5)])
+    assert book.checksum() == checksum(
+        [["100.5", "4", "0", "1"], ["99", "2", "0", "1"]], [["101", "1", "0", "1"], ["102", "5", "0", "2"]]
+    )
+
+
+def test_gap_and_checksum_mismatch_need_snapshot():
+    book = OrderBook("BTC-USDT")
+    snapshot = dict(bids=[["100", "1", "0", "1"]], asks=[["101", "1", "0", "1"]], ts="1", seqId=10, prevSeqId=-1)
+    book.apply(snapshot)
+    with pytest.raises(OkexBookException) as info:
+        book.apply(dict(bids=[], asks=[], ts="2", seqId=13, prevSeqId=12), "update")
+    assert info.value.reason == "gap" and not book.synced
+    with pytest.raises(OkexBookException):
+        book.apply(dict(bids=[], asks=[], ts="2", seqId=14, prevSeqId=13), "update")
+    book.apply(snapshot)
+    with pytest.raises(OkexBookException) as info:
+        book.apply(dict(bids=[["100", "2", "0", "1"]], asks=[], ts="2", seqId=11, prevSeqId=10, checksum=1), "update")
+    assert info.value.reason == "checksum" and book.best_bid is None
+
+
+class FakeSubscriber:
+    """Records the resubscriptions of `OrderBooks`"""
+
+    def __init__(self, fail=False):
+        self.resubscribed = []
+        self.fail = fail
+
+    async def resubscribe(self, channels):
+        self.resubscribed.append([arg["instId"] for arg in channels])
+        if self.fail:
+            raise ConnectionError("closed")
+
+
+def books_of(*instIds, subscriber=None) -> OrderBooks:
+    books = OrderBooks(None, "books")
+    books.books = {instId: OrderBook(instId) for instId in instIds}
+    books.subscriber = subscriber or FakeSubscriber()
+    return books
+
+
+def push(instId, seqId, prevSeqId, bids=(), asks=(), action="update", **kwargs):
+    data = dict(bids=list(bids), asks=list(asks), ts="1", seqId=seqId, prevSeqId=prevSeqId, **kwargs)
+    return dict(arg=dict(channel="books", instId=instId), action=action, data=[data])
+
+
+def snapshot(instId, seqId=10):
+    return push(instId, seqId, -1, [["100", "1", "0", "1"]], [["101", "1", "0", "1"]], "snapshot")
+
+
+@pytest.mark.asyncio
+async def test_books_resync_on_gap():
+    books = books_of("BTC-USDT", "ETH-USDT")
+    assert books.handle(snapshot("BTC-USDT")) is books["BTC-USDT"]
+    assert books.handle(push("BTC-USDT", 13, 12)) is None
+    # Requested once until the snapshot arrives
+    assert books.handle(push("BTC-USDT", 14, 13)) is None
+    await asyncio.sleep(0)
+    assert books.subscriber.resubscribed == [["BTC-USDT"]]
+    assert books.handle(snapshot("BTC-USDT", 20)).synced
+    assert books.handle(push("BTC-USDT", 21, 20, [["100", "2", "0", "1"]])).best_bid == (100, 2)
+    assert books.stats()["gaps"] == 1 and books.stats()["resyncs"] == 1 and books.stats()["skipped"] == 1
+
+
+@pytest.mark.asyncio
+async def test_books_resync_on_checksum_error():
+    books = books_of("BTC-USDT")
+    books.handle(snapshot("BTC-USDT"))
+    assert books.handle(push("BTC-USDT", 11, 10, [["100", "2", "0", "1"]], checksum=1)) is None
+    await asyncio.sleep(0)
+    assert books.subscriber.resubscribed == [["BTC-USDT"]]
+    assert not books["BTC-USDT"].synced and books.stats()["checksum_errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_books_skip_updates_until_snapshot():
+    # The snapshot went to another subscriber of the channel or was dropped
+    books = books_of("BTC-USDT")
+    assert books.handle(push("BTC-USDT", 11, 10)) is None
+    assert books.handle(push("BTC-USDT", 12, 11)) is None
+    await asyncio.sleep(0)
+    assert books.subscriber.resubscribed == [["BTC-USDT"]]
+    assert books.stats()["skipped"] == 2 and books.stats()["updates"] == 0
+    assert books.handle(snapshot("BTC-USDT", 12)).synced
+    assert books.handle(push("BTC-USDT", 13, 12)) is books["BTC-USDT"]
+
+
+@pytest.mark.asyncio
+async def test_books_request_again_after_failed_resync():
+    books = books_of("BTC-USDT", subscriber=FakeSubscriber(fail=True))
+    books.handle(push("BTC-USDT", 11, 10))
+    await asyncio.sleep(0.01)
+    books.handle(push("BTC-USDT", 12, 11))
+    await asyncio.sleep(0)
+    assert books.subscriber.resubscribed == [["BTC-USDT"], ["BTC-USDT"]]
+
+
+@pytest.mark.asyncio
+async def test_books_reset_on_disconnect():
+    books = books_of("BTC-USDT", "ETH-USDT")
+    books.handle(snapshot("BTC-USDT"))
+    books.handle(snapshot("ETH-USDT"))
+    books.handle(dict(event="disconnect", args=[dict(channel="books", instId="BTC-USDT")]))
+    assert not books["BTC-USDT"].synced and books["BTC-USDT"].best_bid is None
+    assert books["ETH-USDT"].synced
+    # Rebuilt from the snapshot sent after reconnecting
+    assert books.handle(snapshot("BTC-USDT", 30)).best_bid == (100, 1)
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import pytest
+from async_okx_v5 import consts as c
+from async_okx_v5.asset import AssetAPI
+from async_okx_v5.exceptions import OkexAmbiguousException, OkexRetryException
+from async_okx_v5.limits import LimiterRegistry
+from async_okx_v5.retry import deadline
+from async_okx_v5.trade import TradeAPI
+
+
+def response(data, code="0"):
+    return 200, {}, json.dumps(dict(code=code, msg="", data=data)).encode(), 0.01
+
+
+@pytest.mark.asyncio
+async def test_deadline_in_gate_is_not_ambiguous():
+    api = TradeAPI("key", "secret", "pass", limits=LimiterRegistry({}))
+
+    async def send(method, request_path, body, header, priority, trace):
+        # Still waiting for a connection
+        await asyncio.sleep(1)
+
+    api._send = send
+    with pytest.raises(OkexRetryException), deadline(0.02):
+        await api._request(c.POST, c.TRADE_ORDER, dict(instId="BTC-USDT"))
+
+
+@pytest.mark.asyncio
+async def test_deadline_in_flight_is_ambiguous():
+    api = TradeAPI("key", "secret", "pass", limits=LimiterRegistry({}))
+
+    async def send(method, request_path, body, header, priority, trace):
+        trace.sent = True
+        await asyncio.sleep(1)
+
+    api._send = send
+    with pytest.raises(OkexAmbiguousException), deadline(0.02):
+        await api._request(c.POST, c.TRADE_ORDER, dict(instId="BTC-USDT"))
+
+
+@pytest.mark.asyncio
+async def test_ambiguous_transfer_is_looked_up():
+    api = AssetAPI("key", "secret", "pass", limits=LimiterRegistry({}))
+    transfers = {}
+    sent = []
+
+    async def request(method, request_path, params, priority=None, idempotent=None):
+        if method == c.GET:
+            info = transfers.get(params["clientId"])
+            return dict(code="0", msg="", data=[info] if info else [])
+        sent.append(params["clientId"])
+        if len(sent) == 1:
+            # Lost before it reached the exchange
+            raise OkexAmbiguousException("timeout")
+        transfers[params["clientId"]] = dict(params, transId="1", state="success")
+        raise OkexAmbiguousException("timeout")
+
+    api._request = request
+    res = await api.transfer("USDT", "1", "6", "18")
+    assert res["transId"] == "1" and res["clientId"] == sent[0]
+    # Resubmitted once with the same client ID
+    assert sent == [sent[0]] * 2
+
+
+@pytest.mark.asyncio
+async def test_failed_transfer_lookup_keeps_it_ambiguous():
+    api = AssetAPI("key", "secret", "pass", limits=LimiterRegistry({}))
+    sent = []
+
+    async def request(method, request_path, params, priority=None, idempotent=None):
+        if method == c.GET:
+            return dict(code="50113", msg="Invalid sign", data=[])
+        sent.append(params["clientId"])
+        raise OkexAmbiguousException("timeout")
+
+    api._request = request
+    with pytest.raises(OkexAmbiguousException):
+        await api.transfer("USDT", "1", "6", "18")
+    # Not resubmitted without knowing whether the exchange has it
+    assert len(sent) == 1
+
+
+@pytest.mark.asyncio
+async def test_shared_query_keeps_deadline_of_each_caller():
+    api = TradeAPI("key", "secret", "pass", limits=LimiterRegistry({}))
+    calls = []
+
+    async def send(method, request_path, body, header, priority, trace):
+        calls.append(request_path)
+        trace.sent = True
+        await asyncio.sleep(0.05)
+        return response([{"ordId": "1"}])
+
+    api._send = send
+
+    async def hurried():
+        with deadline(0.01):
+            return await api._request(c.GET, c.TRADE_ORDER, dict(instId="BTC-USDT", ordId="1"))
+
+    first = asyncio.create_task(hurried())
+    await asyncio.sleep(0)
+    second = asyncio.create_task(api._request(c.GET, c.TRADE_ORDER, dict(instId="BTC-USDT", ordId="1")))
+    third = asyncio.create_task(api._request(c.GET, c.TRADE_ORDER, dict(instId="BTC-USDT", ordId="1")))
+    with pytest.raises(OkexRetryException):
+        await first
+    # The request outlives the deadline of the caller that started it
+    res = await second
+    assert res["data"] == [{"ordId": "1"}]
+    # Callers get their own copies of one response
+    other = await third
+    assert other == res and other is not res
+    assert other["data"] is not res["data"] and other["data"][0] is not res["data"][0]
+    res["data"].append({"ordId": "2"})
+    res["data"][0]["ordId"] = "3"
+    assert other["data"] == [{"ordId": "1"}]
+    assert len(calls) == 1
@@ -0,0 +1,100 @@
+import asyncio
+import time
+import pytest
+from async_okx_v5.clock import ClockSync
+
+
+def fake_server(offset, delays):
+    """Server time source `offset` seconds ahead of local time with given one-way delays"""
+    delays = iter(delays)
+
+    async def fetch():
+        delay = next(delays)
+        await asyncio.sleep(delay)
+        ts = int((time.time() + offset) * 1000)
+        await asyncio.sleep(delay)
+        return ts
+
+    return fetch
+
+
+@pytest.mark.asyncio
+async def test_min_rtt_sample_is_trusted():
+    clock = ClockSync(burst=3)
+    await clock.sync(fake_server(5.0, [0.05, 0.001, 0.03]))
+    assert clock.synced
+    assert clock.rtt < 0.02
+    assert abs(clock.offset - 5.0) < 0.02
+    assert abs(clock.time() - time.time() - 5.0) < 0.02
+
+
+@pytest.mark.asyncio
+async def test_metrics_and_expiry():
+    clock = ClockSync(burst=2)
+    assert clock.timestamp().endswith("Z")
+    await clock.sync(fake_server(20.0, [0.001, 0.001]))
+    metrics = clock.metrics()
+    assert metrics["samples"] == 2
+    assert abs(metrics["skew"] - 20.0 / 30) < 0.01
+    assert clock.near_expiry()
+    assert not clock.near_expiry(margin=0.9)
+
+
+@pytest.mark.asyncio
+async def test_ensure_syncs_once():
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        return int(time.time() * 1000)
+
+    clock = ClockSync(burst=2)
+    await asyncio.gather(clock.ensure(fetch), clock.ensure(fetch))
+    await clock.ensure(fetch)
+    assert calls == 2
+    await clock.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_sync_backs_off():
+    calls = []
+
+    async def down():
+        calls.append(1)
+        raise OSError("unreachable")
+
+    clock = ClockSync(burst=2, retry=0.05)
+    await clock.ensure(down)
+    await clock.ensure(down)
+    assert len(calls) == 2 and clock.failures == 1
+    await asyncio.sleep(0.06)
+    await clock.ensure(fake_server(1.0, [0.001, 0.001]))
+    assert clock.synced and clock.failures == 0
+    await clock.close()
+
+
+@pytest.mark.asyncio
+async def test_refresh_uses_latest_fetch():
+    calls = []
+    closed = False
+
+    async def first():
+        calls.append("first")
+        if closed:
+            raise RuntimeError("Session is closed")
+        return int(time.time() * 1000)
+
+    async def second():
+        calls.append("second")
+        return int(time.time() * 1000)
+
+    clock = ClockSync(interval=0.02, burst=1)
+    await clock.ensure(first)
+    # The client that started the refresh is closed, another one keeps using the clock
+    closed = True
+    await clock.ensure(second)
+    await asyncio.sleep(0.05)
+    assert calls[0] == "first" and set(calls[1:]) == {"second"}
+    assert clock.failures == 0 and clock.metrics()["age"] < 0.03
+    await clock.close()
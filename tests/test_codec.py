@@ -0,0 +1,89 @@
+import builtins
+import json
+import pytest
+from async_okx_v5 import consts as c
+from async_okx_v5.codec import CODECS, JsonCodec, get_codec
+from async_okx_v5.limits import LimiterRegistry
+from async_okx_v5.multiplex import WebsocketManager
+from async_okx_v5.trade import TradeAPI
+from tests.test_multiplex import FakeExchange, receive, tickers
+
+
+class RecordingCodec(JsonCodec):
+    """Standard library codec counting its calls"""
+
+    def __init__(self):
+        self.dumped = 0
+        self.loaded = 0
+
+    def dumps(self, obj):
+        self.dumped += 1
+        return super().dumps(obj)
+
+    def loads(self, data):
+        self.loaded += 1
+        return super().loads(data)
+
+
+@pytest.fixture(params=sorted(CODECS))
+def codec(request) -> JsonCodec:
+    # Codecs are named after their modules
+    pytest.importorskip(request.param)
+    return get_codec(request.param)
+
+
+def test_loads_bytes_and_str(codec):
+    message = {"code": "0", "msg": "", "data": [{"instId": "BTC-USDT", "last": "100.5", "n": 1}]}
+    assert codec.loads(json.dumps(message).encode()) == message
+    assert codec.loads(json.dumps(message)) == message
+    assert codec.loads(codec.dumps(message)) == message
+    assert isinstance(codec.dumps(message), str)
+
+
+def test_decode_error_is_value_error(codec):
+    for data in (b"<html>cloudflare</html>", "{", b""):
+        with pytest.raises(ValueError):
+            codec.loads(data)
+
+
+def test_fallback_without_optional_codecs(monkeypatch):
+    real_import = builtins.__import__
+
+    def without(name, *args, **kwargs):
+        if name in ("orjson", "msgspec"):
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "__import__", without)
+    assert type(get_codec()) is JsonCodec
+    assert get_codec().loads(b'{"a": 1}') == {"a": 1}
+    with pytest.raises(ImportError):
+        get_codec("orjson")
+
+
+@pytest.mark.asyncio
+async def test_client_uses_its_codec():
+    codec = RecordingCodec()
+    api = TradeAPI("key", "secret", "pass", limits=LimiterRegistry({}), codec=codec)
+
+    async def send(method, request_path, body, header, priority, trace):
+        trace.sent = True
+        return 200, {}, json.dumps(dict(code="0", msg="", data=[{"ordId": "1"}])).encode(), 0.01
+
+    api._send = send
+    res = await api._request(c.POST, c.TRADE_ORDER, dict(instId="BTC-USDT"))
+    assert res["data"] == [{"ordId": "1"}]
+    assert codec.dumped == 1 and codec.loaded == 1
+
+
+@pytest.mark.asyncio
+async def test_websocket_uses_its_codec(monkeypatch):
+    exchange = FakeExchange(monkeypatch)
+    codec = RecordingCodec()
+    async with WebsocketManager("wss://fake", codec=codec) as manager:
+        subscriber = await manager.subscribe(tickers("BTC-USDT"))
+        assert codec.dumped == 1
+        exchange.publish(tickers("BTC-USDT")[0], 1)
+        assert (await receive(subscriber))["data"][0]["n"] == 1
+        # The subscribe answer and the push
+        assert codec.loaded == 2
@@ -0,0 +1,48 @@
+import pytest
+from async_okx_v5.columnar import CandleBuffer, candles_to_array
+from async_okx_v5.public import PublicAPI
+
+np = pytest.importorskip("numpy")
+
+MINUTE = 60000
+
+
+def candle(ts, confirm="1"):
+    return [str(ts), "1.5", "2", "1", "1.75", "10", "20", "30", confirm]
+
+
+def test_candles_to_array():
+    rows = [candle(3 * MINUTE), candle(2 * MINUTE, "0")]
+    array = candles_to_array(rows)
+    assert array["ts"].tolist() == [3 * MINUTE, 2 * MINUTE]
+    assert array["c"].tolist() == [1.75, 1.75]
+    assert array["confirm"].tolist() == [True, False]
+    columns = candles_to_array(rows, "columns")
+    assert set(columns) == {"ts", "o", "h", "l", "c", "vol", "volCcy", "volCcyQuote", "confirm"}
+
+
+def test_buffer_pages_out_of_order_with_holes():
+    buffer = CandleBuffer(6)
+    buffer.write(3, [candle(3), candle(2)])
+    buffer.write(0, [candle(6), candle(5), candle(4)])
+    assert buffer.result()["ts"].tolist() == [6, 5, 4, 3, 2]
+    # A short page leaves a hole before the next one
+    buffer = CandleBuffer(4)
+    buffer.write(0, [candle(9)])
+    buffer.write(2, [candle(7), candle(6), candle(5)])
+    assert buffer.result()["ts"].tolist() == [9, 7, 6, 5]
+
+
+@pytest.mark.asyncio
+async def test_candles_for_days_stream_into_buffer():
+    api = PublicAPI()
+    end = 10000 * MINUTE
+
+    async def query(path, instId, bar, after="", before="", limit=""):
+        after = int(after) if after else end
+        return [candle(after - (i + 1) * MINUTE) for i in range(int(limit))]
+
+    api._query_candles = query
+    array = await api.get_candles_for_days("BTC-USDT", 1, "1m", columnar="numpy")
+    assert len(array) == 1441
+    assert (np.diff(array["ts"]) == -MINUTE).all()
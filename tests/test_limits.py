@@ -0,0 +1,74 @@
+import os
+import pytest
+from async_okx_v5 import consts as c
+from async_okx_v5.limits import LimiterRegistry, Priority, user_id
+from async_okx_v5.utils import RateLimiter, SharedRateLimiter
+
+
+def order(**kwargs):
+    return dict(instId="BTC-USDT", tdMode="cross", side="sell", ordType="market", sz="1", **kwargs)
+
+
+def test_user_and_ip_scopes():
+    limits = LimiterRegistry()
+    # IP limits are shared by every API key
+    public, _ = limits.resolve(c.GET, c.GET_TICKERS, {}, "first")
+    assert limits.resolve(c.GET, c.GET_TICKERS, {}, "second")[0] is public
+    # UserID limits are per API key
+    first, _ = limits.resolve(c.GET, c.ACCOUNT_BALANCE, {}, "first")
+    second, _ = limits.resolve(c.GET, c.ACCOUNT_BALANCE, {}, "second")
+    assert first is not second
+    assert limits.resolve(c.GET, c.ACCOUNT_BALANCE, {}, "first")[0] is first
+    assert "first" not in " ".join(limits.stats()) and user_id("first") in " ".join(limits.stats())
+    # Endpoints without a rule are not limited
+    assert limits.resolve(c.GET, "/api/v5/unknown", {}) == (None, 1)
+
+
+def test_parameter_keys():
+    limits = LimiterRegistry()
+    btc, _ = limits.resolve(c.POST, c.TRADE_ORDER, order(), "key")
+    eth, _ = limits.resolve(c.POST, c.TRADE_ORDER, dict(order(), instId="ETH-USDT"), "key")
+    assert btc is not eth and limits.resolve(c.POST, c.TRADE_ORDER, order(px="1"), "key")[0] is btc
+    spot, _ = limits.resolve(c.GET, c.GET_INSTRUMENTS, dict(instType="SPOT"))
+    assert spot is not limits.resolve(c.GET, c.GET_INSTRUMENTS, dict(instType="SWAP"))[0]
+    usdt, _ = limits.resolve(c.POST, c.ASSET_TRANSFER, dict(ccy="USDT", amt="1"), "key")
+    assert usdt is not limits.resolve(c.POST, c.ASSET_TRANSFER, dict(ccy="BTC", amt="1"), "key")[0]
+    assert usdt.limit == 1 and btc.limit == 60
+
+
+def test_weighted_batches():
+    limits = LimiterRegistry()
+    limiter, weight = limits.resolve(c.POST, c.BATCH_ORDER, [order(), order(), order()], "key")
+    assert weight == 3 and limiter.limit == 300
+    assert limits.resolve(c.POST, c.BATCH_CANCEL, [dict(instId="BTC-USDT", ordId="1")] * 5, "key")[1] == 5
+    # Single requests weigh one whatever their parameters
+    assert limits.resolve(c.POST, c.TRADE_ORDER, order(), "key")[1] == 1
+
+
+def test_priority_classes():
+    priority = LimiterRegistry.priority
+    assert priority(c.GET, c.TRADE_ORDER, dict(instId="BTC-USDT")) == Priority.QUERY
+    assert priority(c.POST, c.CANCEL_ORDER, dict(instId="BTC-USDT", ordId="1")) == Priority.RISK
+    assert priority(c.POST, c.BATCH_CANCEL, [dict(instId="BTC-USDT", ordId="1")]) == Priority.RISK
+    assert priority(c.POST, c.TRADE_ORDER, order()) == Priority.ORDER
+    assert priority(c.POST, c.TRADE_ORDER, order(reduceOnly=True)) == Priority.RISK
+    assert priority(c.POST, c.TRADE_ORDER, order(reduceOnly="true")) == Priority.RISK
+    assert priority(c.POST, c.BATCH_ORDER, [order(reduceOnly=True)] * 2) == Priority.RISK
+    # A batch is risk reducing only if every order is
+    assert priority(c.POST, c.BATCH_ORDER, [order(reduceOnly=True), order()]) == Priority.ORDER
+    assert priority(c.POST, c.BATCH_ORDER, []) == Priority.ORDER
+    assert priority(c.POST, c.AMEND_ORDER, dict(instId="BTC-USDT", ordId="1")) == Priority.ORDER
+
+
+@pytest.mark.skipif(not SharedRateLimiter.available, reason="requires fcntl")
+def test_share_replaces_limiters(tmp_path):
+    limits = LimiterRegistry()
+    local, _ = limits.resolve(c.GET, c.ACCOUNT_BALANCE, {}, "key")
+    assert type(local) is RateLimiter
+    limits.share(str(tmp_path))
+    shared, _ = limits.resolve(c.GET, c.ACCOUNT_BALANCE, {}, "key")
+    assert isinstance(shared, SharedRateLimiter) and shared is not local
+    assert os.path.dirname(shared.path) == str(tmp_path)
+    # Another process resolves the same budget
+    other = LimiterRegistry(shared=True, directory=str(tmp_path))
+    assert other.resolve(c.GET, c.ACCOUNT_BALANCE, {}, "key")[0].path == shared.path
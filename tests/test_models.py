@@ -0,0 +1,105 @@
+import json
+import pytest
+from decimal import Decimal
+from urllib.parse import parse_qsl, urlsplit
+from async_okx_v5 import models
+from async_okx_v5.limits import LimiterRegistry
+from async_okx_v5.public import PublicAPI
+from async_okx_v5.types import Candle
+from async_okx_v5.utils import get_field, query_with_pagination
+
+TICKER = dict(
+    instType="SPOT",
+    instId="BTC-USDT",
+    last="100.1",
+    lastSz="0.5",
+    askPx="",
+    askSz="",
+    bidPx="100",
+    bidSz="2",
+    open24h="99",
+    high24h="101",
+    low24h="98",
+    volCcy24h="1000",
+    vol24h="10",
+    sodUtc0="99.5",
+    sodUtc8="99.6",
+    ts="1700000000000",
+)
+
+
+def candle_rows(start, n, confirm="1"):
+    """Raw candles a minute apart, newest first"""
+    return [[str(start - i * 60000), "1.1", "2", "1", "1.5", "3", "4", "5", confirm] for i in range(n)]
+
+
+def public_api(data=None, **kwargs) -> PublicAPI:
+    """Client answering with `data`, or with candles before the `after` of the request"""
+    api = PublicAPI(limits=LimiterRegistry({}), **kwargs)
+
+    async def send(method, request_path, body, header, priority, trace):
+        trace.sent = True
+        if data is not None:
+            rows = data
+        else:
+            params = dict(parse_qsl(urlsplit(request_path).query))
+            after = int(params.get("after", 1700000000000 + 60000))
+            rows = candle_rows(after - 60000, int(params.get("limit", 100)))
+        return 200, {}, json.dumps(dict(code="0", msg="", data=rows)).encode(), 0.01
+
+    api._send = send
+    return api
+
+
+def test_ticker_numbers_float_and_decimal():
+    ticker = models.Ticker.parse(TICKER)
+    assert ticker.last == 100.1 and isinstance(ticker.last, float)
+    assert ticker.ts == 1700000000000
+    exact = models.Ticker.parse(TICKER, Decimal)
+    assert exact.last == Decimal("100.1") and exact.sodUtc8 == Decimal("99.6")
+
+
+def test_empty_fields_are_none():
+    ticker = models.Ticker.parse(TICKER)
+    assert ticker.askPx is None and ticker.askSz is None and ticker.bidPx == 100
+    rate = models.FundingRate.parse(
+        dict(instType="SWAP", instId="BTC-USD-SWAP", fundingRate="0.0001", fundingTime="1", nextFundingRate="")
+    )
+    assert rate.nextFundingRate is None and rate.nextFundingTime is None and rate.realizedRate is None
+    balance = models.AssetBalance.parse(dict(ccy="USDT", bal="1", frozenBal="", availBal="1"), Decimal)
+    assert balance.frozenBal is None and balance.availBal == Decimal("1")
+
+
+def test_candle_confirm():
+    assert models.Candle.parse(candle_rows(60000, 1)[0]).confirm is True
+    candle = models.Candle.parse(candle_rows(60000, 1, "0")[0], Decimal)
+    assert candle.confirm is False and candle.o == Decimal("1.1") and candle.ts == 60000
+
+
+@pytest.mark.asyncio
+async def test_client_decodes_responses():
+    assert await public_api([TICKER]).get_specific_ticker("BTC-USDT") == TICKER
+    ticker = await public_api([TICKER], decode="decimal").get_specific_ticker("BTC-USDT")
+    assert isinstance(ticker, models.Ticker) and ticker.high24h == Decimal("101") and ticker.askPx is None
+    candles = await public_api(decode="float").get_candles("BTC-USDT", limit="2")
+    assert [type(candle) for candle in candles] == [models.Candle] * 2 and candles[0].c == 1.5
+    assert type((await public_api().get_candles("BTC-USDT", limit="2"))[0]) is Candle
+
+
+def test_get_field_of_records_and_models():
+    row = candle_rows(60000, 1)[0]
+    candle = models.Candle.parse(row)
+    assert get_field(row, 0) == "60000" and get_field(candle, 0) == 60000
+    assert get_field(TICKER, "ts") == "1700000000000"
+    assert get_field(models.Ticker.parse(TICKER), "ts") == 1700000000000
+
+
+@pytest.mark.asyncio
+async def test_pagination_over_decoded_models():
+    api = public_api(decode="decimal")
+    candles = await query_with_pagination(api.get_candles, 0, 100, count=250, instId="BTC-USDT")
+    assert len(candles) == 250 and all(type(candle) is models.Candle for candle in candles)
+    # Pages continue after the timestamp of the last model
+    assert [candle.ts for candle in candles] == [1700000000000 - i * 60000 for i in range(250)]
+    candles = await query_with_pagination(api.get_candles, 0, 100, count=250, interval=60000, instId="BTC-USDT")
+    assert sorted(candle.ts for candle in candles) == sorted(1700000000000 - i * 60000 for i in range(250))
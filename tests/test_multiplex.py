@@ -0,0 +1,318 @@
+import asyncio
+import json
+import pytest
+from websockets import ConnectionClosedError
+from async_okx_v5 import multiplex
+from async_okx_v5.exceptions import OkexRequestException
+from async_okx_v5.multiplex import Subscriber, WebsocketManager, arg_key, delivery_policy
+from async_okx_v5.websocket import PrivateSubscription, PublicSubscription
+
+
+class FakeSocket:
+    """Client side of a websocket to `FakeExchange`"""
+
+    def __init__(self, exchange: "FakeExchange"):
+        self.exchange = exchange
+        self.inbox = asyncio.Queue()
+        self.args = {}
+        self.closed = False
+
+    def push(self, frame):
+        self.inbox.put_nowait(frame)
+
+    def drop(self):
+        """Lose the connection"""
+        self.push(None)
+
+    async def send(self, data):
+        if self.closed:
+            raise ConnectionClosedError(None, None)
+        self.exchange.handle(self, data)
+
+    async def recv(self):
+        frame = await self.inbox.get()
+        if frame is None:
+            self.closed = True
+            raise ConnectionClosedError(None, None)
+        return frame
+
+    async def close(self, code=1000, reason=""):
+        if not self.closed:
+            self.closed = True
+            self.push(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.recv()
+        except ConnectionClosedError:
+            raise StopAsyncIteration
+
+
+class FakeExchange:
+    """Websocket server answering pings, logins and subscriptions, replacing `connect` of the multiplexer"""
+
+    def __init__(self, monkeypatch):
+        self.sockets = []
+        self.ops = []
+        # Connection attempts to refuse
+        self.refuse = 0
+        self.attempts = 0
+        self.pong = True
+        # Sending a ping raises OSError
+        self.broken = False
+        monkeypatch.setattr(multiplex, "connect", self.connect)
+
+    async def connect(self, uri, **kwargs):
+        self.attempts += 1
+        if self.refuse:
+            self.refuse -= 1
+            raise OSError("refused")
+        ws = FakeSocket(self)
+        self.sockets.append(ws)
+        return ws
+
+    def handle(self, ws: FakeSocket, data):
+        if data == "ping":
+            if self.broken:
+                raise OSError("broken pipe")
+            if self.pong:
+                ws.push("pong")
+            return
+        message = json.loads(data)
+        self.ops.append(message)
+        if message["op"] == "login":
+            ws.push(json.dumps({"event": "login", "code": "0", "msg": ""}))
+            return
+        for arg in message["args"]:
+            if message["op"] == "subscribe":
+                ws.args[arg_key(arg)] = arg
+            else:
+                ws.args.pop(arg_key(arg), None)
+            ws.push(json.dumps({"event": message["op"], "arg": arg}))
+
+    def publish(self, arg, n=0):
+        for ws in self.sockets:
+            if arg_key(arg) in ws.args and not ws.closed:
+                ws.push(json.dumps({"arg": arg, "data": [{"instId": arg.get("instId"), "n": n}]}))
+
+    def channels(self, op) -> list:
+        return [arg["instId"] for message in self.ops if message["op"] == op for arg in message["args"]]
+
+
+def tickers(*instIds):
+    return [{"channel": "tickers", "instId": instId} for instId in instIds]
+
+
+async def receive(subscriber: Subscriber, timeout=1.0) -> dict:
+    return await asyncio.wait_for(subscriber.__anext__(), timeout)
+
+
+def ticker(instId, n):
+    return {"arg": {"channel": "tickers", "instId": instId}, "data": [{"instId": instId, "n": n}]}
+
+
+def test_delivery_policy_of_channels():
+    assert delivery_policy([{"channel": "tickers"}, {"channel": "bbo-tbt"}]) == "conflate"
+    assert delivery_policy([{"channel": "tickers"}, {"channel": "trades"}]) == "drop_oldest"
+    assert delivery_policy([{"channel": "trades"}, {"channel": "orders"}]) == "block"
+
+
+@pytest.mark.asyncio
+async def test_subscriber_policies():
+    latest = Subscriber(None, "conflate", maxsize=10)
+    for n in range(3):
+        latest._put(ticker("BTC-USDT", n))
+        latest._put(ticker("ETH-USDT", n))
+    assert [(await latest.__anext__())["data"][0]["n"] for _ in range(2)] == [2, 2]
+    assert latest.stats()["conflated"] == 4
+
+    recent = Subscriber(None, "drop_oldest", maxsize=2)
+    for n in range(5):
+        recent._put(ticker("BTC-USDT", n))
+    recent._put({"event": "reconnect"}, force=True)
+    assert [(await recent.__anext__()).get("event", "data") for _ in range(3)] == ["data", "data", "reconnect"]
+    assert recent.stats()["dropped"] == 3
+    # Events are kept however many messages follow them
+    recent._put({"event": "reconnect"}, force=True)
+    for n in range(4):
+        recent._put(ticker("BTC-USDT", n))
+    messages = [await recent.__anext__() for _ in range(2)]
+    assert messages[0]["event"] == "reconnect" and messages[1]["data"][0]["n"] == 3
+    assert recent.stats()["queued"] == 0
+    # Only events buffered, new messages are dropped
+    recent._put({"event": "disconnect"}, force=True)
+    recent._put({"event": "reconnect"}, force=True)
+    recent._put(ticker("BTC-USDT", 9))
+    assert [(await recent.__anext__())["event"] for _ in range(2)] == ["disconnect", "reconnect"]
+    assert recent.stats()["queued"] == 0
+
+    blocking = Subscriber(None, "block", maxsize=1)
+    assert blocking._put(ticker("BTC-USDT", 0))
+    assert not blocking._put(ticker("BTC-USDT", 1))
+    await blocking.__anext__()
+    await blocking._wait()
+    blocking._close()
+    assert [message async for message in blocking] == []
+
+
+@pytest.mark.asyncio
+async def test_routing_and_fan_out(monkeypatch):
+    exchange = FakeExchange(monkeypatch)
+    async with WebsocketManager("wss://fake", max_channels=2) as manager:
+        first = await manager.subscribe(tickers("BTC-USDT", "ETH-USDT"))
+        second = await manager.subscribe(tickers("BTC-USDT", "SOL-USDT"))
+        # Shared channels are subscribed once, and channels spread over connections of at most 2
+        assert sorted(exchange.channels("subscribe")) == ["BTC-USDT", "ETH-USDT", "SOL-USDT"]
+        assert len(manager.connections) == 2
+        exchange.publish(tickers("BTC-USDT")[0], 1)
+        exchange.publish(tickers("SOL-USDT")[0], 2)
+        assert (await receive(first))["data"][0]["n"] == 1
+        assert [(await receive(second))["data"][0]["n"] for _ in range(2)] == [1, 2]
+        assert first.stats()["queued"] == 0
+
+
+@pytest.mark.asyncio
+async def test_add_and_remove_channels(monkeypatch):
+    exchange = FakeExchange(monkeypatch)
+    async with WebsocketManager("wss://fake") as manager:
+        first = await manager.subscribe(tickers("BTC-USDT"))
+        second = await manager.subscribe(tickers("BTC-USDT"))
+        await first.add(tickers("ETH-USDT"))
+        assert exchange.channels("subscribe") == ["BTC-USDT", "ETH-USDT"]
+        await second.remove(tickers("BTC-USDT"))
+        # Still received by the first subscriber
+        assert exchange.channels("unsubscribe") == []
+        await first.remove(tickers("BTC-USDT"))
+        assert exchange.channels("unsubscribe") == ["BTC-USDT"]
+        exchange.publish(tickers("ETH-USDT")[0])
+        assert (await receive(first))["arg"]["instId"] == "ETH-USDT"
+        await first.close()
+        # The last channel goes with its connection
+        assert manager.connections == []
+        assert [message async for message in first] == []
+
+
+@pytest.mark.asyncio
+async def test_malformed_frame_is_skipped(monkeypatch):
+    exchange = FakeExchange(monkeypatch)
+    async with WebsocketManager("wss://fake") as manager:
+        subscriber = await manager.subscribe(tickers("BTC-USDT"))
+        ws = exchange.sockets[0]
+        ws.push("{not json")
+        ws.push("[]")
+        exchange.publish(tickers("BTC-USDT")[0], 1)
+        assert (await receive(subscriber))["data"][0]["n"] == 1
+        assert manager.connections[0].metrics()["malformed"] == 2
+
+
+@pytest.mark.asyncio
+async def test_reconnect_with_backoff(monkeypatch):
+    exchange = FakeExchange(monkeypatch)
+    async with WebsocketManager("wss://fake", backoff=0.01) as manager:
+        subscriber = await manager.subscribe(tickers("BTC-USDT"))
+        exchange.refuse = 2
+        exchange.sockets[0].drop()
+        assert (await receive(subscriber))["event"] == "disconnect"
+        reconnect = await receive(subscriber)
+        assert reconnect["event"] == "reconnect" and reconnect["args"] == tickers("BTC-USDT")
+        # Resubscribed on the new connection
+        exchange.publish(tickers("BTC-USDT")[0], 1)
+        assert (await receive(subscriber))["data"][0]["n"] == 1
+        metrics = manager.connections[0].metrics()
+        assert (metrics["reconnects"], metrics["failures"]) == (1, 2)
+        assert exchange.attempts == 4
+
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_attempts(monkeypatch):
+    exchange = FakeExchange(monkeypatch)
+    async with WebsocketManager("wss://fake", backoff=0.01, max_attempts=3) as manager:
+        subscriber = await manager.subscribe(tickers("BTC-USDT"))
+        exchange.refuse = 100
+        exchange.sockets[0].drop()
+        assert (await receive(subscriber))["event"] == "disconnect"
+        with pytest.raises(OkexRequestException):
+            await receive(subscriber)
+        assert exchange.attempts == 4
+        assert not manager.connections[0].open
+        # The stream stays failed
+        with pytest.raises(OkexRequestException):
+            await receive(subscriber)
+
+
+@pytest.mark.asyncio
+async def test_subscriptions_run_on_a_manager(monkeypatch):
+    exchange = FakeExchange(monkeypatch)
+    public = PublicSubscription("wss://fake", tickers("BTC-USDT", "ETH-USDT"), reconnect=True, backoff=0.01)
+    await public.subscribe()
+    assert public.subscriber.policy == "conflate"
+    exchange.publish(tickers("ETH-USDT")[0], 1)
+    stream = public.__aiter__()
+    assert (await stream.__anext__())["data"][0]["n"] == 1
+    await stream.aclose()
+    # The stream closed its connection
+    assert exchange.sockets[0].closed and public.manager.connections == []
+
+    private = PrivateSubscription("wss://fake", [{"channel": "orders", "instType": "ANY"}], "key", "secret", "pass")
+    await private.subscribe()
+    login, subscribe = exchange.ops[-2:]
+    assert login["op"] == "login" and login["args"][0]["apiKey"] == "key"
+    assert subscribe == {"op": "subscribe", "args": [{"channel": "orders", "instType": "ANY"}]}
+    assert private.subscriber.policy == "block"
+    # Without reconnect the stream ends with the connection
+    exchange.sockets[-1].drop()
+    assert [message async for message in private] == []
+
+
+@pytest.mark.asyncio
+async def test_heartbeat(monkeypatch):
+    exchange = FakeExchange(monkeypatch)
+    async with WebsocketManager("wss://fake", ping_interval=0.02, pong_timeout=0.02, backoff=0.01) as manager:
+        subscriber = await manager.subscribe(tickers("BTC-USDT"))
+        connection = manager.connections[0]
+        await asyncio.sleep(0.1)
+        metrics = connection.metrics()
+        assert metrics["pings"] >= 2 and metrics["rtt"] is not None and metrics["pong_timeouts"] == 0
+        # A connection that stops answering is closed and reopened
+        exchange.pong = False
+        assert (await receive(subscriber))["event"] == "disconnect"
+        exchange.pong = True
+        assert (await receive(subscriber))["event"] == "reconnect"
+        assert connection.metrics()["pong_timeouts"] == 1
+        # So is one whose heartbeat fails
+        exchange.broken = True
+        assert (await receive(subscriber))["event"] == "disconnect"
+        exchange.broken = False
+        assert (await receive(subscriber))["event"] == "reconnect"
+        assert connection.reconnects == 2
+        assert len(exchange.sockets) == 3
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_behind_full_blocking_subscriber(monkeypatch):
+    exchange = FakeExchange(monkeypatch)
+    async with WebsocketManager(
+        "wss://fake", ping_interval=0.02, pong_timeout=0.02, backoff=0.01, max_blocked=0.2
+    ) as manager:
+        subscriber = await manager.subscribe(tickers("BTC-USDT"), policy="block", maxsize=1)
+        connection = manager.connections[0]
+        exchange.pong = False
+        exchange.publish(tickers("BTC-USDT")[0], 1)
+        exchange.publish(tickers("BTC-USDT")[0], 2)
+        await asyncio.sleep(0.1)
+        # Missing pongs may be queued behind the full subscriber
+        assert connection.metrics()["pong_timeouts"] == 0 and len(exchange.sockets) == 1
+        # Not waited for longer than max_blocked
+        for _ in range(50):
+            if connection.pong_timeouts:
+                break
+            await asyncio.sleep(0.01)
+        assert connection.pong_timeouts == 1
+        exchange.pong = True
+        assert (await receive(subscriber))["data"][0]["n"] == 1
+        assert (await receive(subscriber))["event"] == "disconnect"
+        assert (await receive(subscriber))["event"] == "reconnect"
+        assert len(exchange.sockets) == 2
@@ -0,0 +1,58 @@
+import asyncio
+import time
+import pytest
+from async_okx_v5.exceptions import OkexRetryException
+from async_okx_v5.retry import RetryBudget, RetryPolicy, RetryRule, deadline
+
+
+def test_full_jitter_backoff_is_capped():
+    policy = RetryPolicy(rules={"network": RetryRule(5, 0.1, 0.3)})
+    delays = [policy.backoff("network", attempt) for attempt in range(6) for _ in range(100)]
+    assert all(0 <= delay <= 0.3 for delay in delays)
+    assert max(delays) > 0.2
+
+
+@pytest.mark.asyncio
+async def test_attempts_per_error_class():
+    policy = RetryPolicy(rules={"network": RetryRule(2, 0.001, 0.001)})
+    call = policy.call()
+    await call.retry("network", "reset")
+    await call.retry("network", "reset")
+    with pytest.raises(OkexRetryException) as info:
+        await call.retry("network", "reset")
+    assert info.value.reason == "network"
+    assert info.value.attempts == 3
+
+
+@pytest.mark.asyncio
+async def test_deadline_bounds_waiting_and_backoff():
+    policy = RetryPolicy(rules={"server": RetryRule(5, 1.0, 1.0)})
+    start = time.monotonic()
+    with deadline(0.05):
+        call = policy.call()
+        with pytest.raises(OkexRetryException) as info:
+            await call.bounded(asyncio.sleep(1))
+    assert info.value.reason == "deadline"
+    assert time.monotonic() - start < 0.1
+    with deadline(10):
+        with deadline(0.3):
+            call = policy.call()
+        assert call.remaining() <= 0.3
+    with pytest.raises(OkexRetryException) as info:
+        # A backoff past the deadline is not slept
+        await call.retry("server", "503", delay=1.0)
+    assert info.value.reason == "deadline"
+
+
+@pytest.mark.asyncio
+async def test_budget_is_shared_across_calls():
+    policy = RetryPolicy(budget=RetryBudget(ratio=0.5, capacity=2))
+    calls = [policy.call() for _ in range(2)]
+    await calls[0].retry("throttle", "429", delay=0)
+    await calls[1].retry("throttle", "429", delay=0)
+    with pytest.raises(OkexRetryException) as info:
+        await calls[0].retry("throttle", "429", delay=0)
+    assert info.value.reason == "budget"
+    policy.call()
+    policy.call()
+    await calls[1].retry("throttle", "429", delay=0)
@@ -0,0 +1,53 @@
+import pytest
+from async_okx_v5.store import CandleStore, bar_interval, subtract
+
+MINUTE = 60000
+
+
+def test_bar_interval():
+    assert bar_interval("15m") == 15 * MINUTE
+    assert bar_interval("1Dutc") == bar_interval("1D") == 1440 * MINUTE
+    with pytest.raises(ValueError):
+        bar_interval("1M")
+
+
+def test_subtract():
+    assert subtract(0, 100, []) == [(0, 100)]
+    assert subtract(0, 100, [(10, 20), (30, 40)]) == [(0, 10), (20, 30), (40, 100)]
+    assert subtract(15, 35, [(10, 20), (30, 40)]) == [(20, 30)]
+    assert subtract(0, 100, [(-10, 50), (50, 120)]) == []
+    assert subtract(50, 60, [(0, 10), (70, 80)]) == [(50, 60)]
+
+
+def test_coverage_merges_overlapping_and_adjacent_ranges():
+    store = CandleStore(api=object())
+    store._add_coverage("BTC-USDT", "1m", 0, 10)
+    store._add_coverage("BTC-USDT", "1m", 20, 30)
+    store._add_coverage("ETH-USDT", "1m", 10, 20)
+    assert store.coverage("BTC-USDT", "1m") == [(0, 10), (20, 30)]
+    store._add_coverage("BTC-USDT", "1m", 10, 20)
+    assert store.coverage("BTC-USDT", "1m") == [(0, 30)]
+    store._add_coverage("BTC-USDT", "1m", 25, 40)
+    assert store.coverage("BTC-USDT", "1m") == [(0, 40)]
+    assert store.missing("BTC-USDT", "1m", 0, 50) == [(40, 50)]
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_sync_downloads_only_missing_ranges():
+    calls = []
+
+    class Api:
+        async def get_raw_candles(self, instId, bar, after, before, limit, history):
+            calls.append((after, before))
+            ts = range(after - MINUTE, before, -MINUTE)
+            return [[str(t), "1", "1", "1", "1", "1", "1", "1", "1"] for t in list(ts)[:limit]]
+
+    store = CandleStore(api=Api())
+    assert await store.sync("BTC-USDT", "1m", 0, 10 * MINUTE) == 1
+    assert await store.sync("BTC-USDT", "1m", 0, 20 * MINUTE) == 1
+    assert calls[-1][0] == 20 * MINUTE
+    candles = await store.get("BTC-USDT", "1m", 0, 20 * MINUTE)
+    assert [c.ts for c in candles] == [i * MINUTE for i in range(20)]
+    assert await store.sync("BTC-USDT", "1m", 0, 20 * MINUTE) == 0
+    store.close()
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import pytest
+from typing import Optional
+from urllib.parse import parse_qsl, urlsplit
+from async_okx_v5 import consts as c
+from async_okx_v5.exceptions import OkexAmbiguousException
+from async_okx_v5.limits import LimiterRegistry
+from async_okx_v5.trade import BATCH_SIZE, DUPLICATE_CLORDID, ORDER_NOT_EXIST, STATE_UNKNOWN, TradeAPI
+
+
+def order(n, side="buy", sz="1", **kwargs):
+    return dict(instId="BTC-USDT", tdMode="cash", side=side, ordType="limit", px=str(100 + n), sz=sz, **kwargs)
+
+
+class Exchange:
+    """Orders of a fake exchange behind a mocked `_send`
+
+    Each order request follows the next behavior of `script`: "ok" answers, "applied" places the orders and
+    times out, "lost" times out without placing them, "late" times out and places them just before the next request,
+    "partial" answers without the result of the first order.
+    """
+
+    def __init__(self, script=()):
+        self.script = list(script)
+        self.orders = {}
+        self.late = []
+        self.requests = []
+
+    def place(self, item):
+        if item["sz"] == "0":
+            return dict(clOrdId=item["clOrdId"], ordId="", tag="", sCode="51008", sMsg="Insufficient balance")
+        if item["clOrdId"] in self.orders:
+            return dict(clOrdId=item["clOrdId"], ordId="", tag="", sCode=DUPLICATE_CLORDID, sMsg="Duplicated")
+        ordId = str(len(self.orders) + 1)
+        self.orders[item["clOrdId"]] = dict(item, ordId=ordId, state="live")
+        return dict(clOrdId=item["clOrdId"], ordId=ordId, tag="", sCode="0", sMsg="")
+
+    def find(self, item) -> Optional[dict]:
+        if item.get("ordId"):
+            return next((info for info in self.orders.values() if info["ordId"] == item["ordId"]), None)
+        return self.orders.get(item.get("clOrdId"))
+
+    def cancel(self, item):
+        info = self.find(item)
+        if info is None or info["state"] != "live":
+            return dict(clOrdId=item.get("clOrdId", ""), ordId=item.get("ordId", ""), sCode="51400", sMsg="Failed")
+        info["state"] = "canceled"
+        return dict(clOrdId=info["clOrdId"], ordId=info["ordId"], sCode="0", sMsg="")
+
+    def amend(self, item):
+        info = self.find(item)
+        result = dict(clOrdId=item.get("clOrdId", ""), ordId=item.get("ordId", ""), reqId="")
+        if info is None or info["state"] != "live":
+            return dict(result, sCode="51503", sMsg="Failed")
+        if (info["px"], info["sz"]) == (item.get("newPx", info["px"]), item.get("newSz", info["sz"])):
+            # Nothing to change
+            return dict(result, sCode="51512", sMsg="Failed")
+        info.update(px=item.get("newPx", info["px"]), sz=item.get("newSz", info["sz"]))
+        return dict(result, clOrdId=info["clOrdId"], ordId=info["ordId"], sCode="0", sMsg="")
+
+    async def send(self, method, request_path, body, header, priority, trace):
+        trace.sent = True
+        path = urlsplit(request_path)
+        self.requests.append((method, path.path))
+        if method == c.GET:
+            info = self.find(dict(parse_qsl(path.query)))
+            if info is None:
+                return response([], ORDER_NOT_EXIST)
+            return response([info])
+        for item in self.late:
+            self.place(item)
+        self.late = []
+        items = json.loads(body)
+        items = items if isinstance(items, list) else [items]
+        behavior = self.script.pop(0) if self.script else "ok"
+        if behavior == "lost":
+            raise asyncio.TimeoutError()
+        if behavior == "late":
+            self.late = items
+            raise asyncio.TimeoutError()
+        handle = {c.BATCH_CANCEL: self.cancel, c.BATCH_AMEND: self.amend}.get(path.path, self.place)
+        data = [handle(item) for item in items]
+        if behavior == "applied":
+            raise asyncio.TimeoutError()
+        if behavior == "partial":
+            # The result of the first order is missing
+            return response(data[1:], "2")
+        failed = sum(1 for item in data if item["sCode"] != "0")
+        return response(data, "0" if not failed else "1" if failed == len(data) else "2")
+
+
+def response(data, code="0"):
+    return 200, {}, json.dumps(dict(code=code, msg="", data=data)).encode(), 0.01
+
+
+def trade_api(exchange: Exchange, **kwargs) -> TradeAPI:
+    api = TradeAPI("key", "secret", "pass", limits=LimiterRegistry({}), **kwargs)
+    api._send = exchange.send
+    return api
+
+
+@pytest.mark.asyncio
+async def test_ambiguous_order_found_by_lookup():
+    exchange = Exchange(["applied"])
+    api = trade_api(exchange)
+    res = await api._submit(c.TRADE_ORDER, [order(0)])
+    assert res["code"] == "0" and res["data"][0]["ordId"] == "1"
+    assert exchange.requests == [(c.POST, c.TRADE_ORDER), (c.GET, c.TRADE_ORDER)]
+
+
+@pytest.mark.asyncio
+async def test_missing_order_is_resubmitted():
+    exchange = Exchange(["lost"])
+    api = trade_api(exchange)
+    res = await api._submit(c.BATCH_ORDER, [order(0), order(1)])
+    assert [item["sCode"] for item in res["data"]] == ["0", "0"]
+    assert len(exchange.orders) == 2
+    assert exchange.requests.count((c.POST, c.BATCH_ORDER)) == 2
+
+
+@pytest.mark.asyncio
+async def test_duplicate_after_resubmit_found_by_lookup():
+    exchange = Exchange(["late"])
+    api = trade_api(exchange)
+    res = await api._submit(c.TRADE_ORDER, [order(0, clOrdId="a")])
+    assert res["data"] == [dict(clOrdId="a", ordId="1", tag="", sCode="0", sMsg="")]
+    # Placed once, by the first request
+    assert len(exchange.orders) == 1
+
+
+@pytest.mark.asyncio
+async def test_submit_attempts_exhausted():
+    exchange = Exchange(["lost"] * TradeAPI.SUBMIT_ATTEMPTS)
+    api = trade_api(exchange)
+    with pytest.raises(OkexAmbiguousException):
+        await api._submit(c.TRADE_ORDER, [order(0)])
+    assert exchange.requests.count((c.POST, c.TRADE_ORDER)) == TradeAPI.SUBMIT_ATTEMPTS
+    assert not exchange.orders
+
+
+@pytest.mark.asyncio
+async def test_failed_lookup_keeps_order_ambiguous():
+    exchange = Exchange(["lost"])
+    api = trade_api(exchange)
+    send = exchange.send
+
+    async def denied(method, request_path, body, header, priority, trace):
+        if method == c.GET:
+            trace.sent = True
+            return 401, {}, json.dumps(dict(code="50111", msg="Invalid OK-ACCESS-KEY", data=[])).encode(), 0.01
+        return await send(method, request_path, body, header, priority, trace)
+
+    api._send = denied
+    with pytest.raises(OkexAmbiguousException):
+        await api._submit(c.TRADE_ORDER, [order(0)])
+    # Not resubmitted without knowing whether the exchange has it
+    assert exchange.requests == [(c.POST, c.TRADE_ORDER)]
+
+
+@pytest.mark.asyncio
+async def test_single_orders_coalesce_into_batches():
+    exchange = Exchange()
+    api = trade_api(exchange, order_window=0.01)
+    results = await asyncio.gather(
+        *(api.take_spot_order("BTC-USDT", "buy", "limit", "1", str(100 + n)) for n in range(3))
+    )
+    assert exchange.requests == [(c.POST, c.BATCH_ORDER)]
+    assert sorted(res["ordId"] for res in results) == ["1", "2", "3"]
+    # Reduce only orders are not delayed
+    await api.take_margin_order("BTC-USDT", "sell", "limit", "1", "100", reduceOnly=True)
+    assert exchange.requests[-1] == (c.POST, c.TRADE_ORDER)
+
+
+@pytest.mark.asyncio
+async def test_full_batch_is_flushed_at_once():
+    exchange = Exchange()
+    # Only full batches are sent within the window
+    api = trade_api(exchange, order_window=10)
+    tasks = [asyncio.create_task(api.take_spot_order("BTC-USDT", "buy", "limit", "1", str(n))) for n in range(25)]
+    await asyncio.wait(tasks, timeout=0.1)
+    assert exchange.requests == [(c.POST, c.BATCH_ORDER)]
+    assert sum(task.done() for task in tasks) == BATCH_SIZE
+    for task in tasks:
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_failed_order_of_batch_maps_to_its_caller():
+    exchange = Exchange()
+    api = trade_api(exchange, order_window=0.01)
+    ok, failed = await asyncio.gather(
+        api.take_spot_order("BTC-USDT", "buy", "limit", "1", "100"),
+        api.take_spot_order("BTC-USDT", "buy", "limit", "0", "100"),
+    )
+    assert ok["sCode"] == "0" and ok["ordId"] == "1"
+    assert failed == dict(ordId="-1", code="51008", msg="Insufficient balance")
+    # Without a window the order is judged the same way
+    api = trade_api(exchange)
+    assert await api.take_spot_order("BTC-USDT", "buy", "limit", "0", "100") == failed
+
+
+@pytest.mark.asyncio
+async def test_resent_cancels_and_amends_check_order_state():
+    exchange = Exchange()
+    api = trade_api(exchange)
+    placed = await api.batch_order([order(n) for n in range(4)])
+    filled = exchange.find(placed[3])
+    filled["state"] = "filled"
+    exchange.script = ["applied", "applied"]
+    cancelled = await api.batch_cancel([dict(instId="BTC-USDT", ordId=item["ordId"]) for item in placed[:2]])
+    # The first request cancelled both orders, the resent one failed for them
+    assert [item["sCode"] for item in cancelled] == ["0", "0"]
+    amended = await api.batch_amend(
+        [dict(instId="BTC-USDT", ordId=placed[2]["ordId"], newPx="99"), dict(instId="BTC-USDT", ordId="4", newSz="2")]
+    )
+    assert [item["sCode"] for item in amended] == ["0", "51503"]
+    assert exchange.find(placed[2])["px"] == "99"
+
+
+@pytest.mark.asyncio
+async def test_unknown_state_of_batch_has_distinct_code():
+    exchange = Exchange(["lost"] * TradeAPI.SUBMIT_ATTEMPTS)
+    api = trade_api(exchange)
+    results = await api.batch_cancel([dict(instId="BTC-USDT", ordId="1"), dict(instId="BTC-USDT", ordId="2")])
+    assert [item["sCode"] for item in results] == [STATE_UNKNOWN] * 2
+    assert exchange.requests.count((c.POST, c.BATCH_CANCEL)) == TradeAPI.SUBMIT_ATTEMPTS
+
+
+@pytest.mark.asyncio
+async def test_partial_batch_response_matches_request_ids():
+    exchange = Exchange()
+    api = trade_api(exchange)
+    placed = await api.batch_order([order(n) for n in range(3)])
+    exchange.script = ["partial"]
+    # Cancelled by order ID, results also carry the client order IDs assigned when placing
+    results = await api.batch_cancel([dict(instId="BTC-USDT", ordId=item["ordId"]) for item in placed])
+    assert [(item["ordId"], item["sCode"]) for item in results] == [("1", "2"), ("2", "0"), ("3", "0")]
+    placed = await api.batch_order([order(n) for n in range(2)])
+    exchange.script = ["partial"]
+    results = await api.batch_amend([dict(instId="BTC-USDT", clOrdId=item["clOrdId"], newSz="3") for item in placed])
+    assert [(item["clOrdId"], item["sCode"]) for item in results] == [
+        (placed[0]["clOrdId"], "2"),
+        (placed[1]["clOrdId"], "0"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_requote_diffs_the_ladder():
+    exchange = Exchange()
+    api = trade_api(exchange)
+    await api.batch_order([order(0), order(-1), order(-2), order(-5), order(1, "sell")])
+    live = [dict(info) for info in exchange.orders.values()]
+    quotes = [
+        dict(side="buy", px="100", sz="1"),
+        dict(side="buy", px="99", sz="2"),
+        dict(side="buy", px="97", sz="1"),
+        dict(side="sell", px="101", sz="1"),
+        dict(side="sell", px="102", sz="1"),
+    ]
+    res = await api.requote("BTC-USDT", quotes, live)
+    assert sorted((o["side"], o["px"]) for o in res["kept"]) == [("buy", "100"), ("sell", "101")]
+    assert [item["sCode"] for item in res["amended"]] == ["0", "0"]
+    assert [item["ordId"] for item in res["cancelled"]] == ["4"]
+    assert [item["sCode"] for item in res["placed"]] == ["0"]
+    ladder = sorted((o["side"], o["px"], o["sz"]) for o in exchange.orders.values() if o["state"] == "live")
+    assert ladder == sorted((q["side"], q["px"], q["sz"]) for q in quotes)
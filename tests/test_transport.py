@@ -0,0 +1,129 @@
+import asyncio
+import contextlib
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from async_okx_v5 import consts as c
+from async_okx_v5 import transport as transport_module
+from async_okx_v5.limits import LimiterRegistry, Priority
+from async_okx_v5.public import PublicAPI
+from async_okx_v5.transport import RequestTrace, Transport, default_transport
+
+
+@contextlib.asynccontextmanager
+async def serve():
+    hits = []
+
+    async def time(request):
+        hits.append(request.path)
+        return web.json_response({"code": "0", "msg": "", "data": [{"ts": "1700000000000"}]})
+
+    app = web.Application()
+    app.router.add_get(c.SERVER_TIMESTAMP_URL, time)
+    server = TestServer(app)
+    await server.start_server()
+    server.hits = hits
+    yield server
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_keep_alive_waits_for_slot_and_limit():
+    limits = LimiterRegistry()
+    async with serve() as server, Transport(str(server.make_url("")), limit=1, reserved=0, limits=limits) as transport:
+        async with transport.slot(Priority.RISK):
+            warm = asyncio.create_task(transport.warm_up(2))
+            await asyncio.sleep(0.05)
+            # The slot is taken by a more urgent request
+            assert server.hits == []
+        await warm
+        assert len(server.hits) == 2
+        limiter, _ = limits.resolve(c.GET, c.SERVER_TIMESTAMP_URL, {})
+        assert limiter.stats()["acquired"] == 2
+
+
+@pytest.mark.asyncio
+async def test_server_time_waits_for_slot():
+    limits = LimiterRegistry()
+    async with serve() as server, Transport(str(server.make_url("")), limit=1, reserved=0, limits=limits) as transport:
+        api = PublicAPI(transport=transport, limits=limits)
+        async with transport.slot(Priority.RISK):
+            fetch = asyncio.create_task(api.get_server_time())
+            await asyncio.sleep(0.05)
+            assert not fetch.done() and server.hits == []
+        assert await fetch == 1700000000000
+
+
+@pytest.mark.asyncio
+async def test_trace_marks_written_requests():
+    async with serve() as server, Transport(str(server.make_url(""))) as transport:
+        api = PublicAPI(transport=transport, limits=LimiterRegistry({}))
+        trace = RequestTrace()
+        status, _, _, _ = await api._send(c.GET, c.SERVER_TIMESTAMP_URL, "", {}, Priority.QUERY, trace)
+        assert status == 200 and trace.sent
+
+
+def test_session_per_event_loop():
+    transport = Transport()
+
+    async def open_session():
+        session = transport.session
+        assert transport.session is session and transport.opened
+        return session
+
+    loops = [asyncio.new_event_loop() for _ in range(2)]
+    try:
+        first, second = (loop.run_until_complete(open_session()) for loop in loops)
+        # Opened lazily in the loop that uses it
+        assert first is not second
+        for loop in loops:
+            loop.run_until_complete(transport.close())
+        assert first.closed and second.closed
+    finally:
+        for loop in loops:
+            loop.close()
+
+
+@pytest.mark.asyncio
+async def test_session_discarded_after_fork(monkeypatch):
+    transport = Transport()
+    parent = transport.session
+    async with transport.slot(Priority.QUERY):
+        pass
+    monkeypatch.setattr(transport_module.os, "getpid", lambda: transport._pid + 1)
+    child = transport.session
+    # Connections of the parent are not reused, and slots are counted afresh
+    assert child is not parent and not parent.closed
+    assert all(gate.in_use == 0 for gate in transport._gates.values())
+    await transport.close()
+    await parent.close()
+
+
+@pytest.mark.asyncio
+async def test_client_kwargs_open_a_private_transport():
+    shared = PublicAPI(limits=LimiterRegistry({}))
+    private = PublicAPI(limits=LimiterRegistry({}), timeout=1, limit=4)
+    assert shared.transport is default_transport
+    assert private.transport is not default_transport and private.transport.limit == 4
+    assert private.transport.timeout.total == 1 and default_transport.timeout.total == 5
+    assert PublicAPI(limits=LimiterRegistry({})).transport is default_transport
+    session, own = shared.client, private.client
+    assert own is not session
+    # A client closes its own transport only
+    await shared.close()
+    await private.close()
+    assert own.closed and not session.closed
+    await default_transport.close()
+
+
+@pytest.mark.asyncio
+async def test_ready_connections(monkeypatch):
+    async with serve() as server, Transport(str(server.make_url("")), limits=LimiterRegistry({})) as transport:
+        assert transport.ready_connections == 0
+        assert await transport.warm_up(2) >= 1
+        with monkeypatch.context() as patch:
+            # Pool layout of another aiohttp version
+            patch.setattr(transport.session.connector, "_conns", {"key": [object()]})
+            assert transport.ready_connections == 0
+            patch.delattr(transport.session.connector, "_conns")
+            assert transport.ready_connections == 0
@@ -0,0 +1,258 @@
+import asyncio
+import time
+import pytest
+from async_okx_v5.utils import (
+    MicroBatcher,
+    RateLimiter,
+    SharedRateLimiter,
+    SingleFlight,
+    iter_with_pagination,
+    query_with_pagination,
+)
+
+
+def fake_api(total, calls=None):
+    """Paginated api over ids `total - 1` down to 0"""
+
+    async def query(after="", limit=100, **kwargs):
+        if calls is not None:
+            calls.append(after)
+        await asyncio.sleep(0)
+        start = int(after) - 1 if after != "" else total - 1
+        return [{"id": str(i)} for i in range(start, max(start - int(limit), -1), -1)]
+
+    return query
+
+
+@pytest.mark.asyncio
+async def test_query_with_pagination():
+    res = await query_with_pagination(fake_api(250), tag="id", page_size=100)
+    assert [int(r["id"]) for r in res] == list(range(249, -1, -1))
+
+
+@pytest.mark.asyncio
+async def test_query_with_pagination_sink():
+    pages = {}
+    count = await query_with_pagination(
+        fake_api(1000), tag="id", page_size=100, count=250, interval=1, sink=pages.__setitem__
+    )
+    assert count == 250
+    assert sorted(pages) == [0, 100, 200]
+    assert pages[200][-1]["id"] == "750"
+
+
+@pytest.mark.asyncio
+async def test_iter_with_pagination():
+    calls = []
+    pages = [page async for page in iter_with_pagination(fake_api(250, calls), "id", 100)]
+    assert [len(page) for page in pages] == [100, 100, 50]
+    assert calls == ["", "150", "50"]
+    rows = [row async for row in iter_with_pagination(fake_api(200), "id", 100, rows=True)]
+    assert len(rows) == 200
+
+
+@pytest.mark.asyncio
+async def test_iter_with_pagination_prefetch_is_bounded():
+    calls = []
+    pages = iter_with_pagination(fake_api(10000, calls), "id", 100, prefetch=2)
+    await pages.__anext__()
+    await asyncio.sleep(0.01)
+    # One page consumed, two queued and one waiting to be queued
+    assert len(calls) == 4
+    await pages.aclose()
+    calls.clear()
+    pages = iter_with_pagination(fake_api(10000, calls), "id", 100, prefetch=0)
+    await pages.__anext__()
+    await asyncio.sleep(0.01)
+    assert len(calls) == 1
+    await pages.aclose()
+    with pytest.raises(ValueError):
+        await iter_with_pagination(fake_api(100), "id", 100, prefetch=-1).__anext__()
+
+
+async def admission_times(limiter, n, weight=1):
+    start = time.monotonic()
+    times = []
+
+    async def acquire():
+        await limiter.acquire(weight)
+        times.append(time.monotonic() - start)
+
+    await asyncio.gather(*(acquire() for _ in range(n)))
+    return sorted(times)
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_burst_then_rate():
+    limiter = RateLimiter(5, 0.1)
+    times = await admission_times(limiter, 10)
+    assert times[4] < 0.01
+    # The next burst waits for the first to leave the window
+    assert times[5] == pytest.approx(0.1, abs=0.015)
+    assert times[9] == pytest.approx(0.1, abs=0.015)
+    stats = limiter.stats()
+    assert stats["acquired"] == 10
+    assert stats["waited"] == 5
+    assert stats["max_wait"] == pytest.approx(0.1, abs=0.015)
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_weighted():
+    limiter = RateLimiter(10, 0.1)
+    times = await admission_times(limiter, 3, weight=5)
+    assert times[1] < 0.01
+    assert times[2] == pytest.approx(0.1, abs=0.015)
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_bounds_every_sliding_window():
+    limiter = RateLimiter(5, 0.05)
+    times = await admission_times(limiter, 25)
+    for i in range(len(times) - 5):
+        # Six admissions never fit in one window
+        assert times[i + 5] - times[i] >= 0.05 - 1e-3
+    limiter = RateLimiter(6, 0.05)
+    weights = [1, 2, 3, 1, 2, 3, 1, 2, 3]
+    admitted = []
+
+    async def acquire(weight):
+        await limiter.acquire(weight)
+        admitted.extend([time.monotonic()] * weight)
+
+    # Staggered arrivals of mixed weights do not line up with window boundaries
+    for weight in weights:
+        await acquire(weight)
+        await asyncio.sleep(0.003)
+    for i in range(len(admitted) - 6):
+        assert admitted[i + 6] - admitted[i] >= 0.05 - 1e-3
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_cancelled_waiter():
+    limiter = RateLimiter(1, 0.1)
+    async with limiter:
+        pass
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert limiter.stats()["queued"] == 0
+    start = time.monotonic()
+    await limiter.acquire()
+    assert time.monotonic() - start == pytest.approx(0.09, abs=0.015)
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_priority():
+    limiter = RateLimiter(1, 0.02)
+    async with limiter:
+        pass
+    order = []
+
+    async def acquire(name, priority):
+        await limiter.acquire(priority=priority)
+        order.append(name)
+
+    tasks = [asyncio.create_task(acquire(f"query{i}", 2)) for i in range(3)]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(acquire("cancel", 0)))
+    tasks.append(asyncio.create_task(acquire("order", 1)))
+    await asyncio.gather(*tasks)
+    assert order == ["cancel", "order", "query0", "query1", "query2"]
+
+
+@pytest.mark.asyncio
+async def test_shared_rate_limiter(tmp_path):
+    # Two limiters with one name stand in for two processes
+    first = SharedRateLimiter(4, 0.1, "test", str(tmp_path))
+    second = SharedRateLimiter(4, 0.1, "test", str(tmp_path))
+    start = time.monotonic()
+    await asyncio.gather(*(limiter.acquire() for limiter in (first, second) for _ in range(4)))
+    assert time.monotonic() - start == pytest.approx(0.1, abs=0.02)
+
+
+@pytest.mark.asyncio
+async def test_shared_rate_limiter_backs_off_together(tmp_path):
+    first = SharedRateLimiter(10, 1, "test", str(tmp_path))
+    second = SharedRateLimiter(10, 1, "test", str(tmp_path))
+    first.throttled(retry_after=0.01)
+    # The second process sees the decrease with its next admission
+    await second.acquire()
+    assert second.rate_factor == first.rate_factor == 0.5
+    assert second.limit == 5
+    second.throttled()
+    # Same congestion event
+    assert second.rate_factor == 0.5
+    for _ in range(10):
+        first.succeeded(0.01)
+    await second.acquire()
+    assert second.rate_factor == pytest.approx(0.7)
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_adapts_to_throttles():
+    limiter = RateLimiter(10, 1)
+    limiter.throttled()
+    limiter.throttled()
+    # One decrease per congestion event
+    assert limiter.rate_factor == 0.5
+    assert limiter.stats()["throttles"] == 2
+    for _ in range(10):
+        limiter.succeeded(0.01)
+    assert limiter.rate_factor == pytest.approx(0.7)
+    limiter.succeeded(1.0)
+    limiter.succeeded(1.0)
+    # Congested, no increase
+    assert limiter.rate_factor == pytest.approx(0.7)
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_retry_after():
+    limiter = RateLimiter(100, 1)
+    limiter.throttled(retry_after=0.05)
+    start = time.monotonic()
+    await limiter.acquire()
+    assert time.monotonic() - start == pytest.approx(0.05, abs=0.015)
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_concurrent_calls():
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return {"key": key}
+
+    results = await asyncio.gather(*(flights.do(key, lambda key=key: fetch(key)) for key in "aaab"))
+    assert calls == ["a", "b"]
+    assert results[0] is results[1] is results[2]
+    assert flights.stats()["hits"] == 2
+    # Cancelling one caller leaves the call to the others
+    first = asyncio.create_task(flights.do("c", lambda: fetch("c")))
+    second = asyncio.create_task(flights.do("c", lambda: fetch("c")))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == {"key": "c"}
+    assert flights.stats()["in_flight"] == 0
+    await flights.do("a", lambda: fetch("a"))
+    assert calls == ["a", "b", "c", "a"]
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_splits_batches():
+    batches = []
+
+    async def fetch(keys):
+        batches.append(keys)
+        await asyncio.sleep(0.01)
+        return {key: key.upper() for key in keys if key != "missing"}
+
+    batcher = MicroBatcher(fetch, max_size=3, window=0.01)
+    results = await asyncio.gather(*(batcher.get(key) for key in ["a", "b", "a", "c", "d", "missing"]))
+    assert results == ["A", "B", "A", "C", "D", None]
+    # Full batches leave at once, the rest after the window
+    assert batches == [["a", "b", "c"], ["d", "missing"]]
+    assert batcher.stats()["batches"] == 2